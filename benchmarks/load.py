@@ -0,0 +1,289 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import httpx
+from benchmarks.seed import skewed
+from common.auth import create_token
+from data.database import read_query
+from data.models.user import User
+from main import app
+
+
+DEFAULT_MIX = 'browse=35,read=35,vote=10,reply=8,message=6,conversation=4,inbox=2'
+
+_SERVER_ERROR = 500
+
+
+class World:
+    ''' Ids of the seeded forum the scenarios pick from, read once before the run.
+
+    Attributes:
+        - tokens: (user id, access token) of customers
+        - topics: ids of open, non-private topics
+        - replies: (topic id, reply id) of replies in those topics
+        - conversations: (sender id, receiver id) pairs that exchanged messages
+    '''
+
+    def __init__(self, tokens: list, topics: list, replies: list, conversations: list):
+        self.tokens = tokens
+        self.topics = topics
+        self.replies = replies
+        self.conversations = conversations
+
+    @classmethod
+    async def load(cls, users: int):
+        customers = await read_query("SELECT id, username, role FROM users WHERE role = 'customer' ORDER BY id LIMIT ?", (users,))
+        topics = await read_query('SELECT id FROM topics WHERE is_private = 0 AND is_locked = 0 ORDER BY id')
+        replies = await read_query(
+            '''SELECT r.topic_id, r.id FROM replies r JOIN topics t ON t.id = r.topic_id
+               WHERE t.is_private = 0 AND t.is_locked = 0 ORDER BY r.id''')
+        conversations = await read_query('SELECT DISTINCT sender_id, receiver_id FROM messages ORDER BY sender_id, receiver_id LIMIT 10000')
+
+        tokens = [(id, create_token(User(id=id, username=username, password='', role=role))) for id, username, role in customers]
+
+        return cls(tokens, [row[0] for row in topics], [tuple(row) for row in replies], [tuple(row) for row in conversations])
+
+
+def _pick(rng: random.Random, items: list):
+    ''' Popular items are at the start of the lists, like the seeded data.'''
+
+    return items[skewed(rng, len(items)) - 1]
+
+
+def _browse(rng: random.Random, world: World) -> tuple:
+    params = {'limit': 20}
+    if rng.random() < 0.3:
+        params['sort'], params['sort_by'] = rng.choice((('desc', 'created_at'), ('asc', 'title')))
+
+    return 'GET /topics/', 'GET', '/topics/', {'params': params}
+
+
+def _read(rng: random.Random, world: World) -> tuple:
+    return 'GET /topics/{id}', 'GET', f'/topics/{_pick(rng, world.topics)}', {'params': {'limit': 20}}
+
+
+def _vote(rng: random.Random, world: World) -> tuple:
+    topic_id, reply_id = _pick(rng, world.replies)
+    user_id, token = rng.choice(world.tokens)
+    vote = rng.choice(('upvote', 'upvote', 'upvote', 'downvote', 'clear'))
+
+    return ('POST /topics/{id}/{reply_id}', 'POST', f'/topics/{topic_id}/{reply_id}',
+            {'params': {'vote': vote}, 'headers': {'x-token': token}})
+
+
+def _reply(rng: random.Random, world: World) -> tuple:
+    user_id, token = rng.choice(world.tokens)
+
+    return ('POST /topics/{id}', 'POST', f'/topics/{_pick(rng, world.topics)}',
+            {'json': {'content': f'benchmark reply {rng.random()}'}, 'headers': {'x-token': token}})
+
+
+def _message(rng: random.Random, world: World) -> tuple:
+    sender_id, token = rng.choice(world.tokens)
+    receiver_id, _ = rng.choice(world.tokens)
+    if receiver_id == sender_id:
+        receiver_id = 1
+
+    return ('POST /messages/{sender_id}/to/{receiver_id}', 'POST', f'/messages/{sender_id}/to/{receiver_id}',
+            {'json': {'content': f'benchmark message {rng.random()}'}, 'headers': {'x-token': token}})
+
+
+def _conversation(rng: random.Random, world: World) -> tuple:
+    sender_id, receiver_id = _pick(rng, world.conversations)
+    token = create_token(User(id=sender_id, username='bench', password='', role='customer'))
+
+    return ('GET /messages/conversation/{sender_id}/to/{receiver_id}', 'GET',
+            f'/messages/conversation/{sender_id}/to/{receiver_id}', {'headers': {'x-token': token}})
+
+
+def _inbox(rng: random.Random, world: World) -> tuple:
+    user_id, token = rng.choice(world.tokens)
+
+    return 'GET /messages/{sender_id}/my_conversations', 'GET', f'/messages/{user_id}/my_conversations', {'headers': {'x-token': token}}
+
+
+SCENARIOS = {
+    'browse': _browse,
+    'read': _read,
+    'vote': _vote,
+    'reply': _reply,
+    'message': _message,
+    'conversation': _conversation,
+    'inbox': _inbox,
+}
+
+
+def parse_mix(mix: str) -> dict:
+    ''' Used for reading a mix like 'browse=40,read=40,vote=20'.
+
+    Returns:
+        - scenario name -> weight
+    '''
+
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f'Unknown scenario {name!r}, expected one of {", ".join(SCENARIOS)}.')
+        weights[name] = float(weight or 1)
+
+    return weights
+
+
+async def _worker(client: httpx.AsyncClient, world: World, mix: dict, rng: random.Random, deadline: float, results: dict):
+    names, weights = list(mix), list(mix.values())
+
+    while time.perf_counter() < deadline:
+        label, method, url, kwargs = SCENARIOS[rng.choices(names, weights)[0]](rng, world)
+
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status, queries = response.status_code, response.headers.get('x-db-queries')
+        except Exception:
+            status, queries = _SERVER_ERROR, None
+        elapsed = time.perf_counter() - started
+
+        results.setdefault(label, []).append((elapsed, status, int(queries) if queries is not None else None))
+
+
+async def run(world: World, mix: dict, concurrency: int, duration: float, warmup: float, seed: int) -> tuple[dict, float]:
+    ''' Used for driving the app of main.py in-process through httpx, so no server and no network are measured.
+    httpx does not run the lifespan of the app, the caller has to, see _main().
+
+    Returns:
+        - label -> list of (seconds, status, X-DB-Queries or None), seconds the measured run took
+    '''
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+        if warmup > 0:
+            deadline = time.perf_counter() + warmup
+            await asyncio.gather(*(_worker(client, world, mix, random.Random(f'warmup-{seed}-{n}'), deadline, {})
+                                   for n in range(concurrency)))
+
+        results = {}
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(_worker(client, world, mix, random.Random(f'{seed}-{n}'), deadline, results)
+                               for n in range(concurrency)))
+
+    return results, time.perf_counter() - started
+
+
+def percentile(sorted_values: list, percent: float) -> float:
+    ''' Nearest-rank percentile of an already sorted list.'''
+
+    if not sorted_values:
+        return 0.0
+
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(percent / 100 * len(sorted_values)) - 1))]
+
+
+def summarize(results: dict, elapsed: float) -> dict:
+    ''' Used for turning the raw results into the report.
+
+    Returns:
+        - label -> requests, throughput (requests/s), p50_ms, p95_ms, p99_ms, max_ms, client_errors, server_errors,
+          queries (mean X-DB-Queries, None unless FORUM_DEBUG=1), with the whole run under 'total'
+    '''
+
+    def summary(samples: list) -> dict:
+        latencies = sorted(sample[0] * 1000 for sample in samples)
+        queries = [sample[2] for sample in samples if sample[2] is not None]
+
+        return {
+            'requests': len(samples),
+            'throughput': len(samples) / elapsed,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': latencies[-1] if latencies else 0.0,
+            'client_errors': sum(400 <= sample[1] < 500 for sample in samples),
+            'server_errors': sum(sample[1] >= _SERVER_ERROR for sample in samples),
+            'queries': sum(queries) / len(queries) if queries else None,
+        }
+
+    report = {label: summary(samples) for label, samples in sorted(results.items())}
+    report['total'] = summary([sample for samples in results.values() for sample in samples])
+
+    return report
+
+
+def print_report(report: dict, baseline: dict = None):
+    ''' Prints one line per endpoint. With a baseline the change of throughput and p95 is shown next to the values.'''
+
+    width = max(len(label) for label in report)
+    print(f'{"endpoint":<{width}}  {"req":>7} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8} {"4xx":>5} {"5xx":>5} {"queries":>7}')
+
+    for label, row in report.items():
+        queries = f'{row["queries"]:.1f}' if row['queries'] is not None else '-'
+        line = (f'{label:<{width}}  {row["requests"]:>7} {row["throughput"]:>8.1f} {row["p50_ms"]:>8.1f} {row["p95_ms"]:>8.1f} '
+                f'{row["p99_ms"]:>8.1f} {row["max_ms"]:>8.1f} {row["client_errors"]:>5} {row["server_errors"]:>5} {queries:>7}')
+
+        before = (baseline or {}).get(label)
+        if before:
+            line += f'  req/s {_change(before["throughput"], row["throughput"])}, p95 {_change(before["p95_ms"], row["p95_ms"])}'
+        print(line)
+
+
+def _change(before: float, after: float) -> str:
+    return f'{(after - before) / before * 100:+.1f}%' if before else 'n/a'
+
+
+async def _main(args):
+    # The lifespan of the app migrates and warms up the pools like in production, and closes them after the run.
+    async with app.router.lifespan_context(app):
+        world = await World.load(args.users)
+        if not world.tokens or not world.topics or not world.replies:
+            raise SystemExit('The database has no customers, open topics or replies, run python -m benchmarks.seed --database <FORUM_DB_NAME> --reset first.')
+
+        mix = parse_mix(args.mix)
+        if 'conversation' in mix and not world.conversations:
+            del mix['conversation']
+
+        results, elapsed = await run(world, mix, args.concurrency, args.duration, args.warmup, args.seed)
+
+    return summarize(results, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Drives the forum app in-process with a mix of requests and reports throughput and latency per endpoint. '
+                    'Run python -m benchmarks.seed against the same FORUM_DB_* database first. '
+                    'Set FORUM_DEBUG=1 to also report the mean number of queries per request.')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'scenario weights, default {DEFAULT_MIX}')
+    parser.add_argument('--concurrency', type=int, default=16, help='number of concurrent clients')
+    parser.add_argument('--duration', type=float, default=30, help='seconds measured')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds run before measuring, e.g. to fill the caches')
+    parser.add_argument('--users', type=int, default=200, help='number of customers the clients act as')
+    parser.add_argument('--seed', type=int, default=1, help='random seed of the clients')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare with')
+    args = parser.parse_args()
+
+    try:
+        parse_mix(args.mix)
+    except ValueError as error:
+        parser.error(str(error))
+
+    report = asyncio.run(_main(args))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['endpoints']
+
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'settings': vars(args), 'endpoints': report}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
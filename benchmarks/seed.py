@@ -0,0 +1,214 @@
+import argparse
+import asyncio
+import hashlib
+import random
+import re
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from data import migrations
+from data.database import close_pool, database_name, direct_connection
+from services import message_service
+
+
+SCHEMA_FILE = Path(__file__).resolve().parent.parent / 'web_teamwork.sql'
+
+# Database of web_teamwork.sql and default FORUM_DB_NAME of the application, never seeded.
+APP_DATABASE = 'web_teamwork'
+
+# Every seeded user logs in with this password, e.g. bench_user_1 / BENCH_PASSWORD.
+BENCH_PASSWORD = 'bench-password'
+ADMIN_USERNAME = 'bench_admin'
+
+_BATCH_SIZE = 1000
+_SEED_START = datetime(2024, 1, 1)
+_SEED_DAYS = 365
+
+_WORDS = ('forum', 'python', 'database', 'index', 'query', 'cache', 'replica', 'latency', 'thread', 'topic',
+          'reply', 'vote', 'message', 'category', 'token', 'cursor', 'stream', 'schema', 'server', 'client',
+          'request', 'response', 'benchmark', 'profile', 'memory', 'network', 'pool', 'commit', 'lock', 'page')
+
+
+def schema_statements(database: str) -> list[str]:
+    ''' Used for creating the schema of web_teamwork.sql under another database name, e.g. a database for benchmarks.
+    VISIBLE is dropped from the index definitions, MariaDB does not know it and it is the default of MySQL.
+
+    Returns:
+        - the statements of web_teamwork.sql, without comments
+    '''
+
+    sql = SCHEMA_FILE.read_text().replace(f'`{APP_DATABASE}`', f'`{database}`')
+
+    return migrations.split_statements(re.sub(r'\s+VISIBLE\b', '', sql))
+
+
+def reset_schema(database: str):
+    ''' Used for dropping the database and creating it again from web_teamwork.sql. web_teamwork.sql already has
+    the changes of every migration, they are applied to record them in schema_migrations.
+
+    Raises:
+        - ValueError for the application database, it is never dropped
+    '''
+
+    if database == APP_DATABASE:
+        raise ValueError(f'Refusing to drop the application database {APP_DATABASE}.')
+
+    conn = direct_connection(database=False)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'DROP DATABASE IF EXISTS `{database}`')
+        for statement in schema_statements(database):
+            cursor.execute(statement)
+    finally:
+        conn.close()
+
+    migrations.migrate()
+
+
+def _hash_password(password: str) -> str:
+    ''' Same hash as services.user_service, so the seeded users can log in.'''
+
+    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+
+def _text(rng: random.Random, min_words: int, max_words: int, max_length: int) -> str:
+    return ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(min_words, max_words)))[:max_length]
+
+
+def _moment(rng: random.Random, after: datetime = _SEED_START) -> datetime:
+    ''' Random second between after and the end of the seeded year.'''
+
+    end = _SEED_START + timedelta(days=_SEED_DAYS)
+    span = max(1, int((end - after).total_seconds()))
+
+    return after + timedelta(seconds=rng.randrange(span))
+
+
+def skewed(rng: random.Random, count: int) -> int:
+    ''' Random id from 1 to count, low ids are picked far more often. Popular topics and chatty users get most of the rows,
+    like on a real forum.'''
+
+    return 1 + int(count * rng.random() ** 3)
+
+
+def generate(rng: random.Random, users: int, categories: int, topics: int, replies: int, votes: int, messages: int) -> dict:
+    ''' Used for generating the rows of a forum. Ids are given explicitly, starting at 1 in every table.
+
+    Returns:
+        - table name -> (columns, rows), in an order that satisfies the foreign keys
+    '''
+
+    password = _hash_password(BENCH_PASSWORD)
+    user_rows = [(1, ADMIN_USERNAME, password, 'admin')]
+    user_rows += [(id, f'bench_user_{id}', password, 'customer') for id in range(2, users + 1)]
+
+    category_rows = [(id, f'Category {id}', _text(rng, 2, 5, 50), 0, 0, _moment(rng)) for id in range(1, categories + 1)]
+
+    topic_rows = []
+    for id in range(1, topics + 1):
+        title = f'Topic {id} ' + _text(rng, 1, 4, 30)
+        topic_rows.append((id, title[:40], _text(rng, 5, 40, 300), rng.randint(1, categories),
+                           skewed(rng, users), 0, 0, None, _moment(rng)))
+
+    reply_rows = []
+    for id in range(1, replies + 1):
+        topic = topic_rows[skewed(rng, topics) - 1]
+        reply_rows.append([id, _moment(rng, topic[8]), _text(rng, 3, 60, 1000), topic[0], skewed(rng, users), 0, 0, 0])
+
+    vote_rows = []
+    voted = set()
+    attempts = 0
+    while len(vote_rows) < votes and attempts < votes * 3:
+        attempts += 1
+        reply_id, user_id = skewed(rng, replies), rng.randint(1, users)
+        if (reply_id, user_id) in voted:
+            continue
+
+        voted.add((reply_id, user_id))
+        vote = int(rng.random() < 0.8)
+        vote_rows.append((len(vote_rows) + 1, reply_id, user_id, vote))
+
+        reply = reply_rows[reply_id - 1]
+        reply[5 if vote else 6] += 1
+        reply[7] += 1 if vote else -1
+
+    # Messages get ids in the order they were sent, like the ones of the app.
+    message_rows = []
+    for id, sent_at in enumerate(sorted(_moment(rng) for _ in range(messages)), start=1):
+        sender_id = skewed(rng, users)
+        receiver_id = skewed(rng, users)
+        if receiver_id == sender_id:
+            receiver_id = sender_id % users + 1
+        message_rows.append((id, _text(rng, 2, 30, 250), sent_at, sender_id, receiver_id))
+
+    return {
+        'users': ('id, username, password, role', user_rows),
+        'categories': ('id, name, description, is_locked, is_private, created_at', category_rows),
+        'topics': ('id, title, body, category_id, user_id, is_locked, is_private, best_reply_id, created_at', topic_rows),
+        'replies': ('id, creation_date, content, topic_id, user_id, upvotes, downvotes, score', [tuple(row) for row in reply_rows]),
+        'votes': ('id, reply_id, user_id, vote', vote_rows),
+        'messages': ('id, content, timestamp, sender_id, receiver_id', message_rows),
+    }
+
+
+def load(tables: dict):
+    ''' Used for inserting generated rows into the forum database in batches of _BATCH_SIZE.'''
+
+    conn = direct_connection()
+    try:
+        cursor = conn.cursor()
+        for table, (columns, rows) in tables.items():
+            started = time.perf_counter()
+            sql = f'INSERT INTO {table}({columns}) VALUES({", ".join("?" * len(columns.split(",")))})'
+            for start in range(0, len(rows), _BATCH_SIZE):
+                cursor.executemany(sql, rows[start:start + _BATCH_SIZE])
+            print(f'{table}: {len(rows)} rows in {time.perf_counter() - started:.1f}s')
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Seeds a benchmark database (FORUM_DB_* settings) with synthetic data. '
+                    f'Every user logs in with the password {BENCH_PASSWORD!r}, {ADMIN_USERNAME} is an admin.')
+    parser.add_argument('--database', required=True,
+                        help=f'name of the benchmark database, the same as FORUM_DB_NAME and never {APP_DATABASE}')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--topics', type=int, default=10000)
+    parser.add_argument('--replies', type=int, default=100000)
+    parser.add_argument('--votes', type=int, default=200000)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=1, help='random seed, the same seed gives the same data')
+    parser.add_argument('--reset', action='store_true',
+                        help='drop the benchmark database and recreate it from web_teamwork.sql, '
+                             'otherwise the rows are inserted into its existing, empty tables')
+    args = parser.parse_args()
+
+    if args.users < 2 or min(args.categories, args.topics, args.replies) < 1:
+        parser.error('at least 2 users and 1 category, topic and reply are needed')
+
+    database = database_name()
+    if args.database == APP_DATABASE:
+        parser.error(f'refusing to seed the application database {APP_DATABASE}, use a database of its own')
+    if args.database != database:
+        parser.error(f'--database {args.database} is not FORUM_DB_NAME ({database}), the seeder and the app '
+                     'connect through the same settings')
+
+    if args.reset:
+        reset_schema(database)
+        print(f'Recreated {database} from {SCHEMA_FILE.name}')
+
+    tables = generate(random.Random(args.seed), args.users, args.categories, args.topics,
+                      args.replies, args.votes, args.messages)
+    load(tables)
+
+    try:
+        count = asyncio.run(message_service.rebuild_conversations())
+    finally:
+        close_pool()
+    print(f'conversations: {count} rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+from common import auth
+from data import indexes, migrations
+from services import category_service, message_service, reply_service, topic_service, vote_service
+
+
+def recount_votes(args):
+    ''' Rebuilds the vote counters stored on replies from the votes table.'''
+
+    changed = asyncio.run(vote_service.recount_votes(args.reply_id))
+    print(f'Recounted votes, {changed} replies updated.')
+
+
+def rebuild_conversations(args):
+    ''' Rebuilds the conversation summaries from the messages table.'''
+
+    count = asyncio.run(message_service.rebuild_conversations())
+    print(f'Rebuilt conversations, {count} conversations.')
+
+
+def migrate(args):
+    ''' Applies the pending migrations of the migrations directory.'''
+
+    if args.status:
+        for version, applied_at in migrations.status():
+            print(f'{version}: {applied_at or "pending"}')
+        return
+
+    versions = migrations.migrate(dry_run=args.dry_run)
+    if not versions:
+        print('The schema is up to date.')
+    for version in versions:
+        print(f'{"Pending" if args.dry_run else "Applied"} {version}')
+
+
+def hot_queries() -> list[dict]:
+    ''' The statements run on every request, as built by the services.'''
+
+    return [query for module in (auth, category_service, topic_service, reply_service, vote_service, message_service)
+            for query in module.hot_queries()]
+
+
+def check_indexes(args):
+    ''' Explains the hot queries of the services and fails if one scans or sorts a large table without an index.'''
+
+    failed = False
+    for name, (plan, problems) in indexes.check_indexes(hot_queries(), min_rows=args.min_rows).items():
+        keys = ', '.join(f'{row["table"]}: {row["key"] or row["type"]}' for row in plan if row.get('table'))
+        print(f'{"FAIL" if problems else "ok":<4}  {name} ({keys})')
+        for problem in problems:
+            print(f'      {problem}')
+        failed = failed or bool(problems)
+
+    if failed:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintenance commands for the forum database.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    recount = commands.add_parser('recount-votes', help='rebuild replies.upvotes/downvotes/score from votes')
+    recount.add_argument('--reply-id', type=int, default=None, help='recount only this reply')
+    recount.set_defaults(handler=recount_votes)
+
+    conversations = commands.add_parser('rebuild-conversations', help='rebuild the conversations table from messages')
+    conversations.set_defaults(handler=rebuild_conversations)
+
+    schema = commands.add_parser('migrate', help='apply the pending schema migrations')
+    schema.add_argument('--dry-run', action='store_true', help='only list the pending migrations')
+    schema.add_argument('--status', action='store_true', help='list every migration and when it was applied')
+    schema.set_defaults(handler=migrate)
+
+    check = commands.add_parser('check-indexes',
+                                help='EXPLAIN the hot queries and fail on full scans, run against a seeded database')
+    check.add_argument('--min-rows', type=int, default=indexes.MIN_ROWS, help='ignore scans and sorts of fewer rows')
+    check.set_defaults(handler=check_indexes)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,201 @@
 from fastapi import HTTPException
 from data.models.user import User
-from data.database import read_query
+from data import identity_map
+from data.database import read_query, insert_query, on_commit
+from data.indexes import hot_query
+from collections import OrderedDict
+import os
+import threading
+import time
 import jwt
 
 
 _JWT_SECRET = ';a,jhsd1jahsd1kjhas1kjdh'
 
+_USER_COLUMNS = 'id, username, password, role'
 
-def get_user_or_raise_401(token: str) -> User:
-    ''' Authenticates the given token in Header and finds the whole information of the user through its username:
+_USER_BY_USERNAME = f'SELECT {_USER_COLUMNS} FROM users WHERE username = ?'
+
+# Only revocations younger than an access token matter.
+_RECENT_REVOCATIONS = '''SELECT user_id, UNIX_TIMESTAMP(revoked_at) FROM token_revocations
+                         WHERE revoked_at > NOW() - INTERVAL ? SECOND'''
+
+identity_map.register('users', _USER_COLUMNS)
+
+_ACCESS_TOKEN_TTL = int(os.environ.get('FORUM_ACCESS_TOKEN_TTL', 15 * 60))
+_REFRESH_TOKEN_TTL = int(os.environ.get('FORUM_REFRESH_TOKEN_TTL', 7 * 24 * 60 * 60))
+_REVOCATIONS_RELOAD_AFTER = float(os.environ.get('FORUM_REVOCATIONS_RELOAD_AFTER', 30))
+
+_revocations = {}
+_revocations_loaded_at = None
+_revocations_lock = threading.Lock()
+
+_USER_CACHE_TTL = float(os.environ.get('FORUM_AUTH_CACHE_TTL', 60))
+_USER_CACHE_SIZE = int(os.environ.get('FORUM_AUTH_CACHE_SIZE', 10000))
+
+_user_cache = OrderedDict()
+_user_cache_tokens = {}
+_user_cache_lock = threading.Lock()
+_user_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+
+def _cached_user(token: str) -> tuple | None:
+    ''' Looks the token up in the LRU cache of authenticated users. Expired entries count as a miss.
+
+    Returns:
+        - user, issued_at of the token
+    '''
+
+    with _user_cache_lock:
+        entry = _user_cache.get(token)
+        if entry is not None and entry[1] > time.monotonic():
+            _user_cache.move_to_end(token)
+            _user_cache_stats['hits'] += 1
+            return entry[0]
+
+        if entry is not None:
+            _forget_token(token)
+        _user_cache_stats['misses'] += 1
+
+        return None
+
+
+def _cache_user(token: str, user: User, issued_at: float, expires_at: int):
+    ttl = min(_USER_CACHE_TTL, expires_at - time.time())
+
+    with _user_cache_lock:
+        if token in _user_cache:
+            _forget_token(token)
+
+        _user_cache[token] = ((user, issued_at), time.monotonic() + ttl)
+        _user_cache_tokens.setdefault(user.id, set()).add(token)
+
+        while len(_user_cache) > _USER_CACHE_SIZE:
+            _forget_token(next(iter(_user_cache)))
+            _user_cache_stats['evictions'] += 1
+
+
+def _forget_token(token: str):
+    ''' Removes a token from the cache. Must be called holding _user_cache_lock.'''
+
+    (user, _), _ = _user_cache.pop(token)
+    tokens = _user_cache_tokens.get(user.id)
+    if tokens is not None:
+        tokens.discard(token)
+        if not tokens:
+            del _user_cache_tokens[user.id]
+
+
+def invalidate_user(user_id: int):
+    ''' Drops every cached token of a user, used when the user is edited or deleted.'''
+
+    with _user_cache_lock:
+        for token in list(_user_cache_tokens.get(user_id, ())):
+            _forget_token(token)
+        _user_cache_stats['invalidations'] += 1
+
+
+def user_cache_stats() -> dict:
+    ''' Used for monitoring the authenticated-user cache.
+
+    Returns:
+        - size, hits, misses, evictions, invalidations
+    '''
+
+    with _user_cache_lock:
+        return {'size': len(_user_cache), **_user_cache_stats}
+
+
+async def _load_revocations():
+    ''' Reloads the revocation list from the database once it is older than _REVOCATIONS_RELOAD_AFTER seconds,
+    so revocations made by other workers are picked up. Only revocations younger than an access token matter.'''
+
+    global _revocations, _revocations_loaded_at
+
+    if _revocations_loaded_at is not None and time.monotonic() - _revocations_loaded_at < _REVOCATIONS_RELOAD_AFTER:
+        return
+
+    # A lagging replica could miss a revocation this worker already knows, so the list is read from the primary
+    # and merged, keeping the later revocation of every user.
+    data = await read_query(_RECENT_REVOCATIONS, (_ACCESS_TOKEN_TTL,), primary=True)
+    oldest = time.time() - _ACCESS_TOKEN_TTL
+
+    with _revocations_lock:
+        revocations = {user_id: revoked_at for user_id, revoked_at in _revocations.items() if revoked_at > oldest}
+        for user_id, revoked_at in data:
+            revocations[user_id] = max(revocations.get(user_id, 0), float(revoked_at))
+
+        _revocations = revocations
+        _revocations_loaded_at = time.monotonic()
+
+
+async def _is_revoked(user_id: int, issued_at: float) -> bool:
+    ''' Access tokens and revocations carry sub-second timestamps, so a token issued right after a revocation
+    (e.g. by /refresh after a role change) is accepted even within the same second.'''
+
+    await _load_revocations()
+
+    with _revocations_lock:
+        revoked_at = _revocations.get(user_id)
+
+    return revoked_at is not None and issued_at <= revoked_at
+
+
+async def revoke_user_tokens(user_id: int):
+    ''' Rejects every access token issued to the user until now, used when the role of the user changes or the user is deleted.
+    The user has to log in again or use a refresh token to get a token with the new role.'''
+
+    now = time.time()
+    await insert_query(
+        '''INSERT INTO token_revocations(user_id, revoked_at) VALUES (?, FROM_UNIXTIME(?))
+           ON DUPLICATE KEY UPDATE revoked_at = VALUES(revoked_at)''', (user_id, now))
+
+    await on_commit(_revoked, user_id, now)
+
+
+async def _revoked(user_id: int, revoked_at: float):
+    ''' Applies a committed revocation to this worker, before the next reload of the revocation list.'''
+
+    with _revocations_lock:
+        _revocations[user_id] = max(_revocations.get(user_id, 0), revoked_at)
+
+    invalidate_user(user_id)
+
+
+async def _authenticate(token: str) -> User:
+    ''' Returns the user of an access token from its claims, no database lookup is needed.'''
+
+    cached = _cached_user(token)
+    if cached is None:
+        payload = is_authenticated(token)
+        if payload.get('type') != 'access':
+            raise jwt.InvalidTokenError('Not an access token.')
+
+        user = User(id=payload['id'], username=payload['username'], password='', role=payload['role'])
+        cached = (user, payload['iat'])
+        _cache_user(token, user, payload['iat'], payload['exp'])
+
+    user, issued_at = cached
+    if await _is_revoked(user.id, issued_at):
+        raise jwt.InvalidTokenError('Token revoked.')
+
+    return user
+
+
+async def get_user_or_raise_401(token: str) -> User:
+    ''' Authenticates the given access token in Header and builds the user from its id, username and role claims.
     
     Args:
         - token (str): text with indents
     '''
 
     try:
-        payload = is_authenticated(token)
-        return find_by_username(payload['username'])
+        return await _authenticate(token)
     except:
         raise HTTPException(status_code=401)
 
 
-def compare_token(token: str) -> User:
+async def compare_token(token: str) -> User:
     ''' Drags the id from the token so it can be compared.
 
     Args:
@@ -32,14 +206,12 @@ def compare_token(token: str) -> User:
     '''
 
     try:
-        payload = is_authenticated(token)
-        payload = find_by_username(payload['username'])
-        return payload.id
+        return (await _authenticate(token)).id
     except:
         raise HTTPException(status_code=401)
 
 
-def find_by_username(username: str) -> User | None:
+async def find_by_username(username: str) -> User | None:
     ''' Drags the id from the token so it can be compared.
 
     Args:
@@ -49,14 +221,12 @@ def find_by_username(username: str) -> User | None:
         - id of the token
     '''
 
-    data = read_query(
-        'SELECT id, username, password, role FROM users WHERE username = ?',
-        (username,))
+    data = await read_query(_USER_BY_USERNAME, (username,))
 
     return next((User.from_query_result(*row) for row in data), None)
 
 
-def find_by_id(id: int) -> User | None:
+async def find_by_id(id: int) -> User | None:
     ''' Search through users.id the whole information about the account in the data.
      
     Args:
@@ -66,15 +236,36 @@ def find_by_id(id: int) -> User | None:
         - all the necessary information about the user (id, username, hashed password, role and etc.)
     '''
 
-    data = read_query(
-        'SELECT id, username, password, role FROM users WHERE id = ?',
-        (id,))
+    row = await identity_map.load('users', id)
 
-    return next((User.from_query_result(*row) for row in data), None)
+    return User.from_query_result(*row) if row is not None else None
 
 
 def create_token(user: User) -> str:
-    ''' Creates JWT token when user uses login request.
+    ''' Creates a short-lived JWT access token when user uses login request.
+    
+    Args:
+        - user: id(int), username(str), role(str)
+    
+    Returns:
+        - encoded JWT token
+    '''
+
+    now = time.time()
+    payload = {
+        "id": user.id,
+        "username": user.username,
+        "role": user.role,
+        "type": "access",
+        "iat": now,
+        "exp": int(now) + _ACCESS_TOKEN_TTL
+    }
+   
+    return jwt.encode(payload, _JWT_SECRET, algorithm="HS256")
+
+
+def create_refresh_token(user: User) -> str:
+    ''' Creates a long-lived JWT refresh token which can only be exchanged for new access tokens.
     
     Args:
         - user: id(int), username(str)
@@ -83,22 +274,63 @@ def create_token(user: User) -> str:
         - encoded JWT token
     '''
 
+    now = int(time.time())
     payload = {
         "id": user.id,
-        "username": user.username
+        "username": user.username,
+        "type": "refresh",
+        "iat": now,
+        "exp": now + _REFRESH_TOKEN_TTL
     }
    
     return jwt.encode(payload, _JWT_SECRET, algorithm="HS256")
 
 
-def is_authenticated(token: str) -> bool:
-    ''' Decodes JWT token.
+async def refresh_access_token(refresh_token: str) -> str:
+    ''' Exchanges a refresh token for a new access token. The user is read from the database,
+    so deleted users cannot refresh and changed roles are put into the new token.
+
+    Returns:
+        - encoded JWT access token
+    '''
+
+    try:
+        payload = is_authenticated(refresh_token)
+        if payload.get('type') != 'refresh':
+            raise jwt.InvalidTokenError('Not a refresh token.')
+        user = await find_by_id(payload['id'])
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail='Invalid refresh token.')
+
+    if user is None:
+        raise HTTPException(status_code=401, detail='Invalid refresh token.')
+
+    return create_token(user)
+
+
+def access_token_ttl() -> int:
+    ''' Seconds an access token is valid for.'''
+
+    return _ACCESS_TOKEN_TTL
+
+
+def is_authenticated(token: str) -> dict:
+    ''' Decodes JWT token and checks its expiry.
     
     Args:
         - encoded JWT token
     
     Returns:
-        - user: id(int), username(str)
+        - payload: id(int), username(str), role(str), type(str), iat(float for access tokens), exp(int)
     '''
 
-    return jwt.decode(token, _JWT_SECRET, algorithms=["HS256"])
\ No newline at end of file
+    return jwt.decode(token, _JWT_SECRET, algorithms=["HS256"])
+
+
+def hot_queries() -> list[dict]:
+    ''' Used by cli.py check-indexes to EXPLAIN the statements of login and token checks.'''
+
+    return [
+        hot_query('user by username', _USER_BY_USERNAME, ('bench_user_2',)),
+        hot_query('recent token revocations', _RECENT_REVOCATIONS, (_ACCESS_TOKEN_TTL,)),
+    ]
@@ -0,0 +1,104 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache:
+    ''' In-process cache with a bounded number of entries and a time to live. The least recently used entry is evicted first.
+    Generation counters are kept apart from the entries and are never evicted.
+
+    Args:
+        - max_size: number of entries kept
+        - ttl: seconds an entry is valid for
+    '''
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    async def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if entry[1] <= time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+
+            return entry[0]
+
+    async def set(self, key: str, value: bytes):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    async def generations(self, keys: list[str]) -> list[int]:
+        with self._lock:
+            return [self._generations.get(key, 0) for key in keys]
+
+    async def bump(self, key: str):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._entries), 'evictions': self._evictions}
+
+
+class RedisCache:
+    ''' Cache shared by every worker through Redis. Entries expire after ttl seconds, eviction is left to the
+    maxmemory policy of the server. Needs the optional redis package.
+
+    Args:
+        - url: e.g. redis://localhost:6379/0
+        - ttl: seconds an entry is valid for
+    '''
+
+    def __init__(self, url: str, ttl: float):
+        try:
+            from redis import asyncio as redis
+        except ImportError as error:
+            raise RuntimeError('The redis package is required for a redis:// cache URL.') from error
+
+        self.ttl = ttl
+        self._redis = redis.from_url(url)
+
+    async def get(self, key: str) -> bytes | None:
+        return await self._redis.get(key)
+
+    async def set(self, key: str, value: bytes):
+        await self._redis.set(key, value, ex=max(1, int(self.ttl)))
+
+    async def generations(self, keys: list[str]) -> list[int]:
+        return [int(value or 0) for value in await self._redis.mget(keys)]
+
+    async def bump(self, key: str):
+        await self._redis.incr(key)
+
+    def stats(self) -> dict:
+        return {}
+
+
+def create_cache(url: str | None, max_size: int, ttl: float):
+    ''' Used for choosing the cache backend from the configuration.
+
+    Returns:
+        - RedisCache for a redis:// or rediss:// URL, LRUCache of this process otherwise
+    '''
+
+    if url:
+        return RedisCache(url, ttl)
+
+    return LRUCache(max_size, ttl)
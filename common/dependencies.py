@@ -0,0 +1,21 @@
+from fastapi import Request
+from data.database import session, transaction
+from data.identity_map import identity_scope
+
+
+async def unit_of_work(request: Request):
+    ''' Used as an application wide dependency, so that every query awaited while handling a request
+    runs inside one transaction.
+
+    Connections are checked out lazily by the first query and the transaction commits once,
+    after the endpoint returns. A raised exception (e.g. HTTPException) rolls the whole request back.
+    Rows loaded by id are kept in the identity map of the request, so each one is read at most once.
+    The request belongs to the session of its token (or of the client address without one), so after
+    a write its reads go to the primary instead of a lagging replica.
+    '''
+
+    key = request.headers.get('x-token') or (request.client.host if request.client else None)
+
+    with identity_scope(), session(key):
+        async with transaction():
+            yield
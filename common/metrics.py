@@ -0,0 +1,127 @@
+import threading
+from data import query_stats
+
+
+_REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    ''' Prometheus histogram with one series per combination of label values.
+
+    Args:
+        - name: metric name, e.g. forum_request_duration_seconds
+        - help: description shown in # HELP
+        - labels: label names, e.g. ('method', 'route')
+        - buckets: upper bounds in seconds, +Inf is added
+    '''
+
+    def __init__(self, name: str, help: str, labels: tuple, buckets: tuple):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+
+        with self._lock:
+            series = [(values, list(counts), total, count) for values, (counts, total, count) in self._series.items()]
+
+        for values, counts, total, count in sorted(series):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}')
+            le = 'le="+Inf"'
+            lines.append(f'{self.name}_bucket{_labels(self.labels, values, le)} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, values)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labels, values)} {count}')
+
+        return lines
+
+
+class Counter:
+    ''' Prometheus counter with one series per combination of label values.'''
+
+    def __init__(self, name: str, help: str, labels: tuple):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+
+        return sample_lines(self.name, self.help, 'counter', [(dict(zip(self.labels, values)), value) for values, value in series])
+
+
+def sample_lines(name: str, help: str, type: str, samples: list) -> list[str]:
+    ''' Used for rendering values that are read when /metrics is scraped, e.g. the state of the connection pool.
+
+    Args:
+        - type: 'gauge' or 'counter'
+        - samples: list of (labels dict, value)
+    '''
+
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} {type}']
+    for labels, value in samples:
+        lines.append(f'{name}{_labels(tuple(labels), tuple(labels.values()))} {_number(value)}')
+
+    return lines
+
+
+request_duration = Histogram('forum_request_duration_seconds', 'Latency of HTTP requests per route.',
+                             ('method', 'route'), _REQUEST_BUCKETS)
+
+request_errors = Counter('forum_request_errors_total', 'HTTP requests per route that failed with a 5xx status or an unhandled exception.',
+                         ('method', 'route'))
+
+query_duration = Histogram('forum_query_duration_seconds', 'Latency of SQL statements per fingerprint.',
+                           ('fingerprint',), _QUERY_BUCKETS)
+
+
+def _observe_query(sql: str, seconds: float):
+    query_duration.observe(seconds, query_stats.fingerprint(sql))
+
+
+query_stats.observers.append(_observe_query)
@@ -0,0 +1,80 @@
+import logging
+import os
+import time
+from fastapi import Request
+from common import metrics
+from data import query_stats
+
+
+_DEBUG = os.environ.get('FORUM_DEBUG', '').lower() in ('1', 'true', 'yes')
+
+_logger = logging.getLogger(__name__)
+
+
+def route_path(request: Request) -> str:
+    ''' Used to group requests by their route, e.g. '/topics/{id}'. Requests matching no route share one path.'''
+
+    route = request.scope.get('route')
+
+    return route.path if route is not None else '<unmatched>'
+
+
+def route_name(request: Request) -> str:
+    return f'{request.method} {route_path(request)}'
+
+
+async def query_stats_middleware(request: Request, call_next):
+    ''' Used for collecting the queries of every request and adding them to the totals of its route.
+    Requests repeating a statement more than query_stats.N_PLUS_ONE_THRESHOLD times are logged as N+1.
+
+    In debug mode (FORUM_DEBUG=1) the response also gets the headers:
+        - X-DB-Queries: number of statements
+        - X-DB-Time-Ms: time spent in statements
+        - X-DB-Acquire-Ms: time spent waiting for pooled connections
+        - X-DB-Query: one per fingerprint, '<executions> <fingerprint>'
+        - X-DB-N-Plus-One: number of fingerprints flagged as N+1
+    '''
+
+    with query_stats.capture() as stats:
+        response = await call_next(request)
+
+    route = route_name(request)
+    query_stats.record_request(route, stats)
+
+    repeated = stats.n_plus_one()
+    if repeated:
+        _logger.warning('N+1 queries in %s: %s', route, repeated)
+
+    if _DEBUG:
+        response.headers['X-DB-Queries'] = str(stats.count)
+        response.headers['X-DB-Time-Ms'] = f'{stats.db_time * 1000:.2f}'
+        response.headers['X-DB-Acquire-Ms'] = f'{stats.acquire_time * 1000:.2f}'
+        for sql, count in stats.fingerprints.most_common():
+            response.headers.append('X-DB-Query', f'{count} {sql}')
+        if repeated:
+            response.headers['X-DB-N-Plus-One'] = str(len(repeated))
+
+    return response
+
+
+def _observe_request(request: Request, started: float, failed: bool):
+    method, path = request.method, route_path(request)
+    metrics.request_duration.observe(time.perf_counter() - started, method, path)
+    if failed:
+        metrics.request_errors.inc(method, path)
+
+
+async def metrics_middleware(request: Request, call_next):
+    ''' Used for recording the latency of every request per route, and counting the requests that failed
+    with a 5xx status or an unhandled exception.'''
+
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        _observe_request(request, started, failed=True)
+        raise
+
+    _observe_request(request, started, failed=response.status_code >= 500)
+
+    return response
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+
+_logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    ''' Messages of one channel for one subscriber, e.g. one open event stream. A subscriber that falls more than
+    max_pending messages behind is dropped, its listen() ends and the client has to catch up and subscribe again.'''
+
+    def __init__(self, channel: str, max_pending: int):
+        self.channel = channel
+        self.dropped = False
+        self._queue = asyncio.Queue(maxsize=max_pending)
+
+    def _deliver(self, payload: bytes) -> bool:
+        if self.dropped:
+            return False
+
+        try:
+            self._queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.dropped = True
+            return False
+
+        return True
+
+    async def listen(self, heartbeat: float):
+        ''' Yields the published payloads, and None after heartbeat seconds without one (e.g. to keep a connection open).'''
+
+        while not self.dropped or not self._queue.empty():
+            try:
+                yield await asyncio.wait_for(self._queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                if self.dropped:
+                    return
+                yield None
+
+
+class LocalBroker:
+    ''' Publish/subscribe inside this process. Only subscribers of the same worker receive the messages.
+
+    Args:
+        - max_pending: messages kept for a subscriber that has not read them yet
+    '''
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+
+        self._subscriptions = {}
+        self._stats = {'published': 0, 'delivered': 0, 'dropped': 0}
+
+    async def publish(self, channel: str, payload: bytes):
+        self.deliver(channel, payload)
+
+    def deliver(self, channel: str, payload: bytes):
+        ''' Hands the payload to the subscribers of the channel in this process.'''
+
+        self._stats['published'] += 1
+        for subscription in list(self._subscriptions.get(channel, ())):
+            if subscription._deliver(payload):
+                self._stats['delivered'] += 1
+            elif subscription.dropped:
+                self._stats['dropped'] += 1
+                self._unregister(subscription)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        subscription = Subscription(channel, self.max_pending)
+        self._subscriptions.setdefault(channel, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._unregister(subscription)
+
+    def _unregister(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.channel)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.channel]
+
+    def stats(self) -> dict:
+        return {'subscribers': sum(len(subscriptions) for subscriptions in self._subscriptions.values()), **self._stats}
+
+
+class RedisBroker:
+    ''' Publish/subscribe shared by every worker through Redis. Each worker keeps one Redis subscription for all channels
+    and hands the messages to its own subscribers. Needs the optional redis package.
+
+    Args:
+        - url: e.g. redis://localhost:6379/0
+        - max_pending: messages kept for a subscriber that has not read them yet
+        - prefix: prefix of the Redis channels, e.g. forum:
+    '''
+
+    def __init__(self, url: str, max_pending: int, prefix: str = 'forum:'):
+        try:
+            from redis import asyncio as redis
+        except ImportError as error:
+            raise RuntimeError('The redis package is required for a redis:// broker URL.') from error
+
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+        self._local = LocalBroker(max_pending)
+        self._listener = None
+
+    async def publish(self, channel: str, payload: bytes):
+        await self._redis.publish(self.prefix + channel, payload)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str):
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+        async with self._local.subscribe(channel) as subscription:
+            yield subscription
+
+    async def _listen(self):
+        ''' Receives the messages of every channel and delivers them in this worker, reconnecting after errors.'''
+
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                await pubsub.psubscribe(self.prefix + '*')
+                async for message in pubsub.listen():
+                    channel = message['channel'].decode('utf-8')[len(self.prefix):]
+                    self._local.deliver(channel, message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _logger.exception('Redis subscription failed, reconnecting')
+                await asyncio.sleep(1)
+
+    def stats(self) -> dict:
+        return self._local.stats()
+
+
+def create_broker(url: str | None, max_pending: int):
+    ''' Used for choosing the publish/subscribe backend from the configuration.
+
+    Returns:
+        - RedisBroker for a redis:// or rediss:// URL, LocalBroker of this process otherwise
+    '''
+
+    if url:
+        return RedisBroker(url, max_pending)
+
+    return LocalBroker(max_pending)
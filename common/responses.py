@@ -0,0 +1,74 @@
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic_core import to_json
+
+
+_NDJSON_CHUNK_SIZE = 64 * 1024
+
+_SSE_HEARTBEAT = b': keep-alive\n\n'
+
+
+async def _ndjson_chunks(items):
+    chunk = []
+    size = 0
+    async for item in items:
+        line = item.model_dump_json().encode('utf-8') + b'\n'
+        chunk.append(line)
+        size += len(line)
+        if size >= _NDJSON_CHUNK_SIZE:
+            yield b''.join(chunk)
+            chunk, size = [], 0
+
+    if chunk:
+        yield b''.join(chunk)
+
+
+def ndjson_response(items) -> StreamingResponse:
+    ''' Used for streaming a listing as newline delimited JSON (one model per line) while it is read from the database,
+    so the memory of the request stays flat whatever the size of the listing.
+
+    Args:
+        - items: async iterable of pydantic models, e.g. topic_service.stream_all()
+    '''
+
+    return StreamingResponse(_ndjson_chunks(items), media_type='application/x-ndjson')
+
+
+def sse_event(event: str, data, id=None) -> bytes:
+    ''' Used for encoding one Server-Sent Event.
+
+    Args:
+        - event: name of the event, e.g. 'message'
+        - data: JSON serializable content, pydantic models included
+        - id: id of the event, sent back by reconnecting clients as Last-Event-ID
+    '''
+
+    frame = f'event: {event}\n'
+    if id is not None:
+        frame += f'id: {id}\n'
+
+    return frame.encode('utf-8') + b'data: ' + to_json(data) + b'\n\n'
+
+
+async def _sse_frames(events):
+    async for event in events:
+        yield _SSE_HEARTBEAT if event is None else event
+
+
+def sse_response(events) -> StreamingResponse:
+    ''' Used for a Server-Sent Events stream (text/event-stream) that stays open while events are pushed.
+
+    Args:
+        - events: async iterable of events encoded by sse_event(), None sends a keep-alive comment
+    '''
+
+    return StreamingResponse(_sse_frames(events), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+class ModelJSONResponse(JSONResponse):
+    ''' JSON response rendered by pydantic-core in a single pass. Pydantic models (also nested in lists and dicts)
+    are serialized by their compiled serializer, instead of jsonable_encoder followed by json.dumps.
+    Returned directly from an endpoint, FastAPI leaves the content as it is.'''
+
+    def render(self, content) -> bytes:
+        return to_json(content)
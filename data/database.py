@@ -1,50 +1,694 @@
-from mariadb import connect
+import asyncio
+import contextvars
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from data import query_stats
+from mariadb import connect, Error, PoolError
 from mariadb.connections import Connection
 
 
-def _get_connection() -> Connection:
+_DB_CONFIG = {
+    'user': os.environ.get('FORUM_DB_USER', 'root'),
+    'password': os.environ.get('FORUM_DB_PASSWORD', '1234'),
+    'host': os.environ.get('FORUM_DB_HOST', '127.0.0.1'),
+    'port': int(os.environ.get('FORUM_DB_PORT', 3306)),
+    'database': os.environ.get('FORUM_DB_NAME', 'web_teamwork'),
+}
+
+_POOL_MIN_SIZE = int(os.environ.get('FORUM_DB_POOL_MIN_SIZE', 2))
+_POOL_MAX_SIZE = int(os.environ.get('FORUM_DB_POOL_MAX_SIZE', 20))
+_POOL_IDLE_TIMEOUT = float(os.environ.get('FORUM_DB_POOL_IDLE_TIMEOUT', 300))
+_POOL_ACQUIRE_TIMEOUT = float(os.environ.get('FORUM_DB_POOL_ACQUIRE_TIMEOUT', 10))
+_POOL_HEALTH_CHECK_AFTER = float(os.environ.get('FORUM_DB_POOL_HEALTH_CHECK_AFTER', 30))
+
+# Streamed results (iter_query) hold a connection as long as their client reads, at most this many at once,
+# so slow clients cannot take the connections of the other requests.
+_MAX_STREAMS = int(os.environ.get('FORUM_DB_MAX_STREAMS', max(1, _POOL_MAX_SIZE // 4)))
+
+# Comma separated host[:port] list of read replicas, e.g. 'replica1,replica2:3307'. Without replicas everything runs on the primary.
+_REPLICA_HOSTS = [host.strip() for host in os.environ.get('FORUM_DB_REPLICAS', '').split(',') if host.strip()]
+_REPLICA_STRATEGY = os.environ.get('FORUM_DB_REPLICA_STRATEGY', 'round_robin')
+_READ_YOUR_WRITES_WINDOW = float(os.environ.get('FORUM_DB_READ_YOUR_WRITES_WINDOW', 5))
+
+
+def _connect(config: dict) -> Connection:
     ''' Connects to the database through MariaDB.'''
-    
-    return connect(
-        user='root',
-        password='1234',
-        host='127.0.0.1',
-        port=3306,
-        database='web_teamwork'
+
+    return connect(**config, autocommit=True)
+
+
+def _replica_config(host: str) -> dict:
+    host, _, port = host.partition(':')
+
+    return {**_DB_CONFIG, 'host': host, 'port': int(port) if port else _DB_CONFIG['port']}
+
+
+class ConnectionPool:
+    ''' Bounded pool of MariaDB connections shared by all query helpers.
+
+    Args:
+        - config: connect() arguments of the server the pool connects to
+        - min_size: idle connections are never reaped below this number
+        - max_size: hard limit of open connections, callers wait for a free one above it
+        - idle_timeout: seconds after which an idle connection above min_size is closed
+        - acquire_timeout: seconds a caller waits for a free connection before PoolError
+        - health_check_after: connections idle longer than this are pinged on checkout
+    '''
+
+    def __init__(self, config: dict, min_size: int, max_size: int, idle_timeout: float,
+                 acquire_timeout: float, health_check_after: float):
+        self.config = config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stats = {
+            'created': 0,
+            'closed': 0,
+            'acquired': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+        }
+
+    def acquire(self) -> Connection:
+        ''' Checks out an idle connection, opens a new one if the pool is not full or waits for a release.'''
+
+        deadline = time.monotonic() + self.acquire_timeout
+        conn, idle_since, stale = None, None, []
+
+        with self._cond:
+            stale = self._reap_idle()
+            while conn is None:
+                if self._closed:
+                    raise PoolError('The database pool is closed.')
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    break
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolError(f'No free database connection after {self.acquire_timeout} seconds.')
+                    self._stats['waits'] += 1
+                    self._cond.wait(remaining)
+            self._stats['acquired'] += 1
+
+        self._close_all(stale)
+
+        if conn is None:
+            return self._open()
+
+        if time.monotonic() - idle_since >= self.health_check_after:
+            try:
+                conn.ping()
+            except Error:
+                with self._cond:
+                    self._stats['health_check_failures'] += 1
+                self._close_all([conn])
+                return self._open()
+
+        return conn
+
+    def release(self, conn: Connection, discard: bool = False):
+        ''' Returns a connection to the pool. Broken connections are discarded and their slot is freed,
+        like every connection returned after close().'''
+
+        with self._cond:
+            discard = discard or self._closed
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+        if discard:
+            self._close_all([conn])
+
+    def stats(self) -> dict:
+        ''' Used for monitoring the pool.
+
+        Returns:
+            - size, idle, in_use, min_size, max_size and the lifetime counters
+        '''
+
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                **self._stats,
+            }
+
+    def in_use(self) -> int:
+        with self._cond:
+            return self._size - len(self._idle)
+
+    def warm_up(self):
+        ''' Opens connections until min_size are open, e.g. on application startup, so the first requests do not connect.'''
+
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+
+            conn = self._open()
+
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def close(self):
+        ''' Closes every idle connection, e.g. on application shutdown. Connections still checked out,
+        e.g. by a stream or a background task, are closed when they are released.'''
+
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        self._close_all(idle)
+
+    def _open(self) -> Connection:
+        try:
+            conn = _connect(self.config)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._stats['created'] += 1
+
+        return conn
+
+    def _reap_idle(self) -> list:
+        ''' Pops connections idle for longer than idle_timeout (oldest first). Must be called holding the lock.'''
+
+        stale = []
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            stale.append(conn)
+
+        return stale
+
+    def _close_all(self, connections: list):
+        for conn in connections:
+            try:
+                conn.close()
+            except Error:
+                pass
+
+        if connections:
+            with self._cond:
+                self._stats['closed'] += len(connections)
+
+
+def _create_pool(config: dict) -> ConnectionPool:
+    return ConnectionPool(
+        config,
+        min_size=_POOL_MIN_SIZE,
+        max_size=_POOL_MAX_SIZE,
+        idle_timeout=_POOL_IDLE_TIMEOUT,
+        acquire_timeout=_POOL_ACQUIRE_TIMEOUT,
+        health_check_after=_POOL_HEALTH_CHECK_AFTER
     )
 
 
-def read_query(sql: str, sql_params=()):
-    "No results = [ ]"
-    with _get_connection() as conn:
-        cursor = conn.cursor()
+_pool = _create_pool(_DB_CONFIG)
+
+_replica_pools = [_create_pool(_replica_config(host)) for host in _REPLICA_HOSTS]
+_replica_turn = itertools.count()
+
+# Session (e.g. token of the user) -> monotonic time until which its reads go to the primary.
+# Deadlines only grow, so the oldest entries are always first and expired ones are dropped from the front.
+_recent_writes = OrderedDict()
+_recent_writes_lock = threading.Lock()
+_session = ContextVar('_session', default=None)
+_primary_reads = ContextVar('_primary_reads', default=False)
+
+_stream_slots = threading.BoundedSemaphore(_MAX_STREAMS)
+
+
+# The mariadb driver is blocking, so statements run on a dedicated executor sized like the pools.
+# Request handlers await them instead of holding a thread of the server's threadpool.
+_executor = ThreadPoolExecutor(max_workers=_POOL_MAX_SIZE * (1 + len(_replica_pools)), thread_name_prefix='database')
+
+# Waiting for a free connection happens on an executor of its own. A request holds its connection across awaits and
+# needs a thread of _executor for its next statement, so a thread of _executor must never wait for a connection.
+_acquire_executor = ThreadPoolExecutor(max_workers=_POOL_MAX_SIZE * (1 + len(_replica_pools)),
+                                       thread_name_prefix='database-acquire')
+
+
+async def _run(fn, *args, executor: ThreadPoolExecutor = None):
+    ''' Runs a blocking database call on the database executor, keeping the context of the caller (e.g. its transaction).'''
+
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+
+    return await loop.run_in_executor(executor or _executor, context.run, fn, *args)
+
+
+def _replica_pool() -> ConnectionPool:
+    if _REPLICA_STRATEGY == 'least_loaded':
+        return min(_replica_pools, key=lambda pool: pool.in_use())
+
+    return _replica_pools[next(_replica_turn) % len(_replica_pools)]
+
+
+def _reads_from_primary() -> bool:
+    ''' Reads go to the primary if there are no replicas, inside primary_reads() or if the session wrote within the
+    read-your-writes window.'''
+
+    if not _replica_pools or _primary_reads.get():
+        return True
+
+    session = _session.get()
+    if session is None:
+        return False
+
+    with _recent_writes_lock:
+        deadline = _recent_writes.get(session)
+
+    return deadline is not None and deadline > time.monotonic()
+
+
+def _wrote():
+    ''' Sends the reads of the current session to the primary for the next _READ_YOUR_WRITES_WINDOW seconds.'''
+
+    session = _session.get()
+    if session is None or not _replica_pools:
+        return
+
+    now = time.monotonic()
+    with _recent_writes_lock:
+        _recent_writes[session] = now + _READ_YOUR_WRITES_WINDOW
+        _recent_writes.move_to_end(session)
+        while _recent_writes and next(iter(_recent_writes.values())) <= now:
+            _recent_writes.popitem(last=False)
+
+
+def _acquire(primary: bool) -> tuple:
+    ''' Checks out a connection of the primary or of a replica. Reads fall back to the primary if the replica is down.
+
+    Returns:
+        - pool, connection
+    '''
+
+    started = time.perf_counter()
+    try:
+        if not primary:
+            pool = _replica_pool()
+            try:
+                return pool, pool.acquire()
+            except Error:
+                pass
+
+        return _pool, _pool.acquire()
+    finally:
+        query_stats.record_acquire(time.perf_counter() - started)
+
+
+def _acquire_stream(primary: bool) -> tuple:
+    ''' Takes one of the _MAX_STREAMS stream slots, then a connection like _acquire(). Runs on _acquire_executor.'''
+
+    if not _stream_slots.acquire(timeout=_POOL_ACQUIRE_TIMEOUT):
+        raise PoolError(f'No free database stream after {_POOL_ACQUIRE_TIMEOUT} seconds.')
+
+    try:
+        return _acquire(primary)
+    except BaseException:
+        _stream_slots.release()
+        raise
+
+
+def _release_stream(pool: ConnectionPool, conn: Connection, discard: bool = False):
+    pool.release(conn, discard=discard)
+    _stream_slots.release()
+
+
+def _release_abandoned_stream(acquiring: asyncio.Future):
+    ''' Gives back the slot and the connection of an iteration cancelled while it waited for them.'''
+
+    if not acquiring.cancelled() and acquiring.exception() is None:
+        _release_stream(*acquiring.result())
+
+
+def _begin(primary: bool) -> tuple:
+    pool, conn = _acquire(primary)
+    try:
+        conn.begin()
+    except Exception:
+        pool.release(conn, discard=True)
+        raise
+
+    return pool, conn
+
+
+def _end(pool: ConnectionPool, conn: Connection, commit: bool):
+    discard = False
+    try:
+        if commit:
+            conn.commit()
+    except Exception:
+        commit = False
+        raise
+    finally:
+        if not commit:
+            try:
+                conn.rollback()
+            except Error:
+                discard = True
+        pool.release(conn, discard=discard)
+
+
+class _UnitOfWork:
+    ''' One transaction shared by every query of a request or a transaction() block.
+    Connections are only checked out, and transactions only begun, when the first query runs.
+    Reads run on a replica until the first write or primary read, everything after that runs on the primary.'''
+
+    def __init__(self):
+        self.conn = None
+        self.replica = None
+        self.finished = False
+        self.after_commit = []
+        self._lock = asyncio.Lock()
+
+    async def connection(self, primary: bool) -> Connection:
+        async with self._lock:
+            if self.conn is None and not primary:
+                if self.replica is None:
+                    self.replica = await _run(_begin, False, executor=_acquire_executor)
+                return self.replica[1]
+
+            if self.conn is None:
+                _, self.conn = await _run(_begin, True, executor=_acquire_executor)
+
+            return self.conn
+
+    def finish(self, commit: bool):
+        ''' Commits or rolls back and returns the connections to their pools. Blocking, run it through _run.'''
+
+        self.finished = True
+        try:
+            if self.conn is not None:
+                _end(_pool, self.conn, commit)
+        finally:
+            if self.replica is not None:
+                _end(*self.replica, commit=False)
+            self.conn = self.replica = None
+
+
+_unit_of_work = ContextVar('_unit_of_work', default=None)
+
+
+def _active_unit_of_work() -> _UnitOfWork | None:
+    unit = _unit_of_work.get()
+    if unit is None or unit.finished:
+        return None
+
+    return unit
+
+
+def pool_stats() -> dict:
+    ''' Used for getting the current state of the connection pools.
+
+    Returns:
+        - stats of the primary pool, with the stats of every replica pool under 'replicas'
+    '''
+
+    return {**_pool.stats(), 'replicas': [pool.stats() for pool in _replica_pools]}
+
+
+def database_name() -> str:
+    ''' Name of the forum database, FORUM_DB_NAME.'''
+
+    return _DB_CONFIG['database']
+
+
+def direct_connection(database: bool = True) -> Connection:
+    ''' Used by maintenance commands that work outside of the pools, e.g. bulk loads or creating the schema.
+
+    Args:
+        - database: False to connect to the server without selecting the forum database, e.g. before it exists
+    '''
+
+    config = _DB_CONFIG if database else {key: value for key, value in _DB_CONFIG.items() if key != 'database'}
+
+    return _connect(config)
+
+
+async def warm_up_pools():
+    ''' Used for opening min_size connections of the primary and of every replica pool when the application starts.'''
+
+    await asyncio.gather(*(_run(pool.warm_up, executor=_acquire_executor) for pool in [_pool, *_replica_pools]))
+
+
+def close_pool():
+    ''' Used for closing the idle pooled connections when the application stops.'''
+
+    _pool.close()
+    for pool in _replica_pools:
+        pool.close()
+
+
+@contextmanager
+def session(key: str):
+    ''' Used for marking the queries run inside the with block as one client's, e.g. by its token.
+    After a write of the session its reads go to the primary for a while, so it sees its own writes despite replica lag.'''
+
+    token = _session.set(key)
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    ''' Used for reading from the primary inside the with block, e.g. to build a value cached for every session.
+    A replica may lag behind a committed write, what is read from it must not outlive the request.'''
+
+    token = _primary_reads.set(True)
+    try:
+        yield
+    finally:
+        _primary_reads.reset(token)
+
+
+def _rollback(conn: Connection) -> bool:
+    try:
+        conn.rollback()
+    except Error:
+        return False
+
+    return True
+
+
+@asynccontextmanager
+async def _get_connection(primary: bool = True):
+    ''' Checks out a pooled connection for the duration of the with block, of a replica unless primary is set.
+    Inside transaction() or a request unit of work the connection of the unit is reused instead.
+    The statements run on _executor, the connection is checked out before, see _acquire_executor.'''
+
+    primary = primary or _reads_from_primary()
+
+    unit = _active_unit_of_work()
+    if unit is not None:
+        yield await unit.connection(primary)
+        return
+
+    pool, conn = await _run(_acquire, primary, executor=_acquire_executor)
+    discard = False
+    try:
+        yield conn
+    except Exception:
+        discard = not await _run(_rollback, conn)
+        raise
+    finally:
+        pool.release(conn, discard=discard)
+
+
+@asynccontextmanager
+async def transaction():
+    ''' Runs every query helper awaited inside the async with block on one connection and commits once at the end.
+    Any exception rolls the whole block back. Nested calls join the outer transaction, including the
+    unit of work of the current request.'''
+
+    if _active_unit_of_work() is not None:
+        yield
+        return
+
+    unit = _UnitOfWork()
+    token = _unit_of_work.set(unit)
+    try:
+        yield
+    except BaseException:
+        await _run(unit.finish, False)
+        raise
+    else:
+        await _run(unit.finish, True)
+        for fn, args in unit.after_commit:
+            await fn(*args)
+    finally:
+        _unit_of_work.reset(token)
+
+
+async def on_commit(fn, *args):
+    ''' Used for running the coroutine function fn(*args) once the current transaction commits, e.g. to invalidate a cache.
+    Outside of a transaction it runs right away. It never runs if the transaction is rolled back.'''
+
+    unit = _active_unit_of_work()
+    if unit is None:
+        await fn(*args)
+        return
+
+    unit.after_commit.append((fn, args))
+
+
+def _commit(conn: Connection):
+    if _active_unit_of_work() is None:
+        conn.commit()
+
+
+@contextmanager
+def _timed(sql: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        query_stats.record_query(sql, time.perf_counter() - started)
+
+
+def _read_query(conn: Connection, sql: str, sql_params=()):
+    cursor = conn.cursor()
+    with _timed(sql):
         cursor.execute(sql, sql_params)
+        result = list(cursor)
+    cursor.close()
 
-        return list(cursor)
+    return result
 
 
-def insert_query(sql: str, sql_params=()) -> int:
-    with _get_connection() as conn:
-        cursor = conn.cursor()
+def _insert_query(conn: Connection, sql: str, sql_params=()) -> int:
+    cursor = conn.cursor()
+    with _timed(sql):
         cursor.execute(sql, sql_params)
-        conn.commit()
+    _commit(conn)
+    _wrote()
+    generated_id = cursor.lastrowid
+    cursor.close()
 
-        return cursor.lastrowid
+    return generated_id
 
 
-def update_query(sql: str, sql_params=()) -> bool:
-    with _get_connection() as conn:
-        cursor = conn.cursor()
+def _update_query(conn: Connection, sql: str, sql_params=()) -> int:
+    cursor = conn.cursor()
+    with _timed(sql):
         cursor.execute(sql, sql_params)
-        conn.commit()
+    _commit(conn)
+    _wrote()
+    rowcount = cursor.rowcount
+    cursor.close()
+
+    return rowcount
+
+
+def _read_query_additional(conn: Connection, sql: str, sql_params=()):
+    cursor = conn.cursor()
+    with _timed(sql):
+        cursor.execute(sql, sql_params)
+        result = cursor.fetchone()
+    cursor.close()
+
+    return result
 
-        return cursor.rowcount
 
+async def read_query(sql: str, sql_params=(), primary: bool = False):
+    "No results = [ ]. Runs on a replica unless primary is set, e.g. for SELECT ... FOR UPDATE"
+    async with _get_connection(primary) as conn:
+        return await _run(_read_query, conn, sql, sql_params)
 
-def read_query_additional(sql: str, sql_params=()):
-    """No results = None"""
-    with _get_connection() as conn:
-        cursor = conn.cursor()
+
+def _open_cursor(conn: Connection, sql: str, sql_params):
+    cursor = conn.cursor(buffered=False)
+    with _timed(sql):
         cursor.execute(sql, sql_params)
 
-        return cursor.fetchone()
\ No newline at end of file
+    return cursor
+
+
+async def iter_query(sql: str, sql_params=(), chunk_size: int = 500, primary: bool = False):
+    ''' Used for reading big results row by row. Rows are fetched from the server in chunks of chunk_size through an
+    unbuffered cursor, so memory stays flat whatever the size of the result.
+
+    The rows are read on a connection of their own, outside of the current transaction, so that the iteration can
+    outlive the request, e.g. in a StreamingResponse. A connection left with unread rows is discarded.
+    At most _MAX_STREAMS iterations hold a connection at once, the others wait for one of them to end.
+    '''
+
+    acquiring = asyncio.ensure_future(_run(_acquire_stream, primary or _reads_from_primary(), executor=_acquire_executor))
+    try:
+        pool, conn = await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        acquiring.add_done_callback(_release_abandoned_stream)
+        raise
+
+    exhausted = False
+    pending = None
+    try:
+        # Shielded, a cancelled iteration (e.g. the client disconnected) does not stop the call running on its thread.
+        pending = asyncio.ensure_future(_run(_open_cursor, conn, sql, sql_params))
+        cursor = await asyncio.shield(pending)
+        while True:
+            pending = asyncio.ensure_future(_run(cursor.fetchmany, chunk_size))
+            rows = await asyncio.shield(pending)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+        cursor.close()
+        exhausted = True
+    finally:
+        # The connection goes back to the pool only once no thread uses it anymore.
+        if pending is not None and not pending.done():
+            await asyncio.wait([pending])
+        _release_stream(pool, conn, discard=not exhausted)
+
+
+async def insert_query(sql: str, sql_params=()) -> int:
+    async with _get_connection() as conn:
+        return await _run(_insert_query, conn, sql, sql_params)
+
+
+async def update_query(sql: str, sql_params=()) -> int:
+    async with _get_connection() as conn:
+        return await _run(_update_query, conn, sql, sql_params)
+
+
+async def read_query_additional(sql: str, sql_params=(), primary: bool = False):
+    """No results = None. Runs on a replica unless primary is set, e.g. for SELECT ... FOR UPDATE"""
+    async with _get_connection(primary) as conn:
+        return await _run(_read_query_additional, conn, sql, sql_params)
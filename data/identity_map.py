@@ -0,0 +1,74 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from data.database import read_query
+
+
+_TABLES = {}
+
+_rows = ContextVar('_identity_map_rows', default=None)
+
+
+def register(table: str, columns: str, from_clause: str = None, id_column: str = 'id'):
+    ''' Used by the services to declare how one row of their table is loaded by id.
+
+    Args:
+        - table: name of the table, e.g. 'topics'
+        - columns: selected columns, in the order expected by the model's from_query_result
+        - from_clause: FROM clause if the columns use an alias, e.g. 'replies r'
+        - id_column: id column matching the alias, e.g. 'r.id'
+    '''
+
+    _TABLES[table] = (columns, from_clause or table, id_column)
+
+
+def is_registered(table: str) -> bool:
+    return table in _TABLES
+
+
+@contextmanager
+def identity_scope():
+    ''' Keeps every row loaded through load() until the with block ends, e.g. for one request.'''
+
+    token = _rows.set({})
+    try:
+        yield
+    finally:
+        _rows.reset(token)
+
+
+async def load(table: str, id: int) -> tuple | None:
+    ''' Used for loading a row of a registered table by id. Inside identity_scope() every row is read at most once,
+    missing rows included. Outside of it every call queries the database.
+
+    Returns:
+        - row or None if it does not exist
+    '''
+
+    rows = _rows.get()
+    key = (table, id)
+    if rows is not None and key in rows:
+        return rows[key]
+
+    columns, from_clause, id_column = _TABLES[table]
+    data = await read_query(f'SELECT {columns} FROM {from_clause} WHERE {id_column} = ?', (id,))
+    row = data[0] if data else None
+
+    if rows is not None:
+        rows[key] = row
+
+    return row
+
+
+def forget(table: str, id: int = None):
+    ''' Used after a write, so that the next load() reads the row again. Without id every row of the table is forgotten.'''
+
+    rows = _rows.get()
+    if rows is None:
+        return
+
+    if id is not None:
+        rows.pop((table, id), None)
+        return
+
+    for key in [key for key in rows if key[0] == table]:
+        del rows[key]
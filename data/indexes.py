@@ -0,0 +1,83 @@
+from data.database import direct_connection
+
+
+# Scans and sorts of fewer rows are left to the optimizer, e.g. it reads a table of 20 categories without an index.
+MIN_ROWS = 1000
+
+# Sample page size of the listings explained, the plans do not depend on it.
+SAMPLE_LIMIT = 20
+
+
+def hot_query(name: str, sql: str, params, ordered: bool = False) -> dict:
+    ''' Used by the services to describe a statement they run on every request, built by their own SQL builders,
+    e.g. for cli.py check-indexes.
+
+    Args:
+        - ordered: the ORDER BY has to be read from an index, without a filesort
+
+    Returns:
+        - name, sql, params, ordered
+    '''
+
+    return {'name': name, 'sql': sql, 'params': tuple(params), 'ordered': ordered}
+
+
+def _is_table(name) -> bool:
+    ''' Derived tables and unions show up as <derived2>, <union1,2>.'''
+
+    return bool(name) and not name.startswith('<')
+
+
+def explain(cursor, sql: str, params: tuple) -> list[dict]:
+    ''' Returns:
+        - the rows of EXPLAIN, as dicts of its columns, e.g. table, type, key, rows, Extra
+    '''
+
+    cursor.execute(f'EXPLAIN {sql}', params)
+    columns = [description[0] for description in cursor.description]
+
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def problems(query: dict, plan: list[dict], min_rows: int = MIN_ROWS) -> list[str]:
+    ''' Used to decide whether a plan reads its tables through indexes.
+
+    Returns:
+        - a description of every full table scan, and of every filesort of an ordered query, over min_rows rows or more
+    '''
+
+    found = []
+    for row in plan:
+        if not _is_table(row.get('table')) or (row.get('rows') or 0) < min_rows:
+            continue
+
+        if row.get('type') == 'ALL':
+            found.append(f'full scan of {row["table"]} ({row["rows"]} rows)')
+        if query.get('ordered') and 'Using filesort' in (row.get('Extra') or ''):
+            found.append(f'filesort of {row["table"]} ({row["rows"]} rows)')
+
+    return found
+
+
+def check_indexes(queries: list[dict], min_rows: int = MIN_ROWS) -> dict:
+    ''' Used for checking that the hot queries use indexes, run against a database with production-like data,
+    e.g. seeded by python -m benchmarks.seed. EXPLAIN does not run the statements.
+
+    Args:
+        - queries: built by hot_query(), e.g. the hot_queries() of the services
+
+    Returns:
+        - query name -> (plan, problems)
+    '''
+
+    conn = direct_connection()
+    try:
+        cursor = conn.cursor()
+        results = {}
+        for query in queries:
+            plan = explain(cursor, query['sql'], query['params'])
+            results[query['name']] = plan, problems(query, plan, min_rows)
+    finally:
+        conn.close()
+
+    return results
\ No newline at end of file
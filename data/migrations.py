@@ -0,0 +1,109 @@
+import os
+import re
+from pathlib import Path
+from data.database import direct_connection
+
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / 'migrations'
+
+# Apply the pending migrations when the application starts, FORUM_DB_MIGRATE_ON_STARTUP=1.
+MIGRATE_ON_STARTUP = os.environ.get('FORUM_DB_MIGRATE_ON_STARTUP', '').lower() in ('1', 'true', 'yes')
+
+_LOCK_NAME = 'forum_schema_migrations'
+_LOCK_TIMEOUT = int(os.environ.get('FORUM_DB_MIGRATE_LOCK_TIMEOUT', 60))
+
+_STATEMENT_END = re.compile(r';\s*$', re.MULTILINE)
+
+
+def split_statements(sql: str) -> list[str]:
+    ''' Used for running a .sql file statement by statement. Lines starting with -- are comments,
+    a statement ends with ; at the end of a line.
+
+    Returns:
+        - the statements, without comments
+    '''
+
+    sql = '\n'.join(line for line in sql.splitlines() if not line.lstrip().startswith('--'))
+
+    return [statement.strip() for statement in _STATEMENT_END.split(sql) if statement.strip()]
+
+
+def available() -> list[tuple[str, Path]]:
+    ''' Used for listing the migrations, e.g. migrations/0001_reply_vote_counters.sql has version 0001_reply_vote_counters.
+
+    Returns:
+        - (version, path) of every migration, in the order they are applied
+    '''
+
+    return [(path.stem, path) for path in sorted(MIGRATIONS_DIR.glob('*.sql'))]
+
+
+def _ensure_table(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version VARCHAR(255) NOT NULL,
+                        applied_at DATETIME NOT NULL,
+                        PRIMARY KEY (version))''')
+
+
+def _applied(cursor) -> dict:
+    cursor.execute('SELECT version, applied_at FROM schema_migrations')
+
+    return dict(cursor.fetchall())
+
+
+def status() -> list[tuple[str, object]]:
+    ''' Used for showing which migrations the database already has.
+
+    Returns:
+        - (version, applied_at or None if pending) of every migration
+    '''
+
+    conn = direct_connection()
+    try:
+        cursor = conn.cursor()
+        _ensure_table(cursor)
+        applied = _applied(cursor)
+    finally:
+        conn.close()
+
+    return [(version, applied.get(version)) for version, _ in available()]
+
+
+def migrate(dry_run: bool = False) -> list[str]:
+    ''' Used for bringing the database schema up to date, from the CLI or when the application starts.
+    Workers starting together wait for each other through a named lock, so every migration runs once.
+    Each migration can run again after it failed half way, its statements check what already exists.
+
+    Args:
+        - dry_run: only return the pending migrations
+
+    Returns:
+        - versions of the migrations applied (or pending, with dry_run)
+    '''
+
+    conn = direct_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT GET_LOCK(?, ?)', (_LOCK_NAME, _LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError(f'Another process holds the {_LOCK_NAME} lock for more than {_LOCK_TIMEOUT}s.')
+
+        try:
+            _ensure_table(cursor)
+            applied = _applied(cursor)
+            pending = [(version, path) for version, path in available() if version not in applied]
+            if dry_run:
+                return [version for version, _ in pending]
+
+            for version, path in pending:
+                for statement in split_statements(path.read_text()):
+                    cursor.execute(statement)
+                cursor.execute('INSERT INTO schema_migrations(version, applied_at) VALUES(?, NOW())', (version,))
+                conn.commit()
+        finally:
+            cursor.execute('SELECT RELEASE_LOCK(?)', (_LOCK_NAME,))
+            cursor.fetchone()
+    finally:
+        conn.close()
+
+    return [version for version, _ in pending]
\ No newline at end of file
@@ -11,6 +11,7 @@ class Category(BaseModel):
     is_private: bool | None = 0
     topics: list[Topic] = []
     created_at: datetime | None = None
+    next_cursor: str | None = None
     
     
     @classmethod
@@ -21,12 +22,12 @@ class Category(BaseModel):
             - id, name, description, is_locked, is private, created_at
         '''
         
-        return cls(
+        return cls.model_construct(
             id=id,
             name=name,
             description=description,
-            is_locked=is_locked,
-            is_private=is_private,
+            is_locked=bool(is_locked),
+            is_private=bool(is_private),
             created_at=created_at
             )
 
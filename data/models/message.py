@@ -23,9 +23,11 @@ class MessageResponseModel(BaseModel):
         
         Returns:
             - id, content, timestamp, sender_id, receiver_id
+
+        Skips validation, the row was validated when the message was sent.
         '''
         
-        return cls(
+        return cls.model_construct(
                     id = id,
                     content=content,
                     timestamp=timestamp,
@@ -34,6 +36,34 @@ class MessageResponseModel(BaseModel):
         )
 
 
+class ConversationResponseModel(BaseModel):
+    user_id: int
+    username: str
+    last_message_id: int
+    last_message_preview: str
+    last_activity: datetime
+    unread: int = 0
+
+    @classmethod
+    def from_query_result(cls, user_id, username, last_message_id, last_message_preview, last_activity, unread):
+        ''' When ConversationResponseModel is shown in the response.
+
+        Returns:
+            - user_id and username of the other user, last_message_id, last_message_preview, last_activity, unread
+
+        Skips validation, the row comes from the conversations table.
+        '''
+
+        return cls.model_construct(
+                    user_id=user_id,
+                    username=username,
+                    last_message_id=last_message_id,
+                    last_message_preview=last_message_preview,
+                    last_activity=last_activity,
+                    unread=unread
+        )
+
+
 class CreateMessageModel(BaseModel):
     id: int | None = None
     content: constr(min_length=2, max_length=250)
@@ -10,24 +10,26 @@ class Reply(BaseModel):
     user_id: int | None = None
     upvotes: int | None = 0
     downvotes: int | None = 0
+    score: int | None = 0
 
 
     @classmethod
-    def from_query_result(cls, id, creation_date, content, topic_id, user_id, upvotes, downvotes):
+    def from_query_result(cls, id, creation_date, content, topic_id, user_id, upvotes, downvotes, score):
         ''' When Reply Model is shown in the response.
         
         Returns:
-            - id, creation_date, content, topic_id, user_id, upvotes, downvotes
+            - id, creation_date, content, topic_id, user_id, upvotes, downvotes, score
         '''
         
-        return cls(
+        return cls.model_construct(
                     id = id,
                     creation_date=creation_date,
                     content=content,
                     topic_id=topic_id,
                     user_id=user_id,
                     upvotes=upvotes,
-                    downvotes=downvotes
+                    downvotes=downvotes,
+                    score=score
         )
 
 
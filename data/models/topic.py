@@ -14,24 +14,26 @@ class Topic(BaseModel):
     best_reply_id: int | None = None
     replies: list[Reply] = []
     created_at: datetime | None = None
+    next_cursor: str | None = None
     
 
     @classmethod
     def from_query_result(cls, id, title, body, category_id, user_id, is_locked, is_private, best_reply_id, created_at):
-        ''' When Reply Model is shown in the response.
+        ''' When Reply Model is shown in the response. The row comes from our database and is trusted,
+        so the model is constructed without validation.
         
         Returns:
             - id, title, body, category_id, user_id, is_locked, is_private, best_reply_id, created_at
         '''
         
-        return cls(
+        return cls.model_construct(
             id=id,
             title=title,
             body=body,
             category_id=category_id,
             user_id=user_id,
-            is_locked=is_locked,
-            is_private=is_private,
+            is_locked=bool(is_locked),
+            is_private=bool(is_private),
             best_reply_id=best_reply_id,
             created_at=created_at
         )
@@ -14,6 +14,10 @@ class LoginData(BaseModel):
     password: str
 
 
+class RefreshData(BaseModel):
+    refresh_token: str
+
+
 class User(BaseModel):
     id: int | None = None
     username: TUsername
@@ -49,7 +53,7 @@ class User(BaseModel):
             - id, username, role
         '''
         
-        return cls(
+        return cls.model_construct(
             id=id,
             username=username,
             password=password,
@@ -64,7 +68,7 @@ class User(BaseModel):
             - id, username, role
         '''
         
-        return cls(
+        return cls.model_construct(
             id=id,
             username=username,
             password='',
@@ -0,0 +1,167 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+import os
+import re
+import threading
+
+
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('FORUM_N_PLUS_ONE_THRESHOLD', 5))
+
+_SPACES = re.compile(r'\s+')
+_LITERALS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql: str) -> str:
+    ''' Used to group statements that only differ by their values, e.g. SELECT ... WHERE id = 1 and id = 2.
+
+    Returns:
+        - the statement on one line, with literals replaced by ? and lists of ? collapsed to (?+)
+    '''
+
+    sql = _SPACES.sub(' ', sql).strip()
+    sql = _LITERALS.sub('?', sql)
+
+    return _IN_LISTS.sub('(?+)', sql)
+
+
+class QueryStats:
+    ''' Queries run while handling one request (or inside capture()).
+
+    Attributes:
+        - count: number of statements
+        - db_time: seconds spent executing statements and fetching their rows
+        - acquire_time: seconds spent waiting for pooled connections
+        - fingerprints: number of executions per fingerprint
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.db_time = 0.0
+        self.acquire_time = 0.0
+        self.fingerprints = Counter()
+        self._lock = threading.Lock()
+
+    def add_query(self, sql: str, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.db_time += seconds
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def add_acquire(self, seconds: float):
+        with self._lock:
+            self.acquire_time += seconds
+
+    def merge(self, other: 'QueryStats'):
+        with self._lock:
+            self.count += other.count
+            self.db_time += other.db_time
+            self.acquire_time += other.acquire_time
+            self.fingerprints.update(other.fingerprints)
+
+    def n_plus_one(self, threshold: int = None) -> list[str]:
+        ''' Used to find N+1 patterns.
+
+        Returns:
+            - fingerprints executed more than threshold times (N_PLUS_ONE_THRESHOLD by default)
+        '''
+
+        threshold = N_PLUS_ONE_THRESHOLD if threshold is None else threshold
+
+        return [sql for sql, count in self.fingerprints.items() if count > threshold]
+
+
+_current = ContextVar('_query_stats', default=None)
+
+# Functions called with (sql, seconds) for every statement, also outside of capture(), e.g. by common.metrics.
+observers = []
+
+_routes = {}
+_routes_lock = threading.Lock()
+
+
+def record_query(sql: str, seconds: float):
+    ''' Called by data.database for every executed statement.'''
+
+    for observer in observers:
+        observer(sql, seconds)
+
+    stats = _current.get()
+    if stats is not None:
+        stats.add_query(sql, seconds)
+
+
+def record_acquire(seconds: float):
+    ''' Called by data.database for every connection checked out of a pool.'''
+
+    stats = _current.get()
+    if stats is not None:
+        stats.add_acquire(seconds)
+
+
+@contextmanager
+def capture():
+    ''' Used for collecting the queries run inside the with block, e.g. one request. Queries of a nested capture()
+    also count for the outer one.
+
+    Returns:
+        - QueryStats, complete once the with block ends
+    '''
+
+    outer = _current.get()
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        if outer is not None:
+            outer.merge(stats)
+
+
+@contextmanager
+def assert_queries(max_count: int = None, n_plus_one_threshold: int = None):
+    ''' Used in tests as a guard against query regressions, e.g.
+
+        with assert_queries(max_count=3):
+            asyncio.run(topic_service.get_by_id(1, None))
+
+    Raises:
+        - AssertionError if more than max_count statements ran or a fingerprint ran more than n_plus_one_threshold times
+    '''
+
+    with capture() as stats:
+        yield stats
+
+    if max_count is not None and stats.count > max_count:
+        raise AssertionError(f'Expected at most {max_count} queries, {stats.count} ran: {dict(stats.fingerprints)}')
+
+    repeated = stats.n_plus_one(n_plus_one_threshold)
+    if repeated:
+        raise AssertionError(f'N+1 queries: {repeated}')
+
+
+def record_request(route: str, stats: QueryStats):
+    ''' Used for adding the queries of a finished request to the totals of its route.'''
+
+    with _routes_lock:
+        totals = _routes.setdefault(route, {'requests': 0, 'queries': 0, 'db_time': 0.0, 'acquire_time': 0.0, 'n_plus_one': 0})
+        totals['requests'] += 1
+        totals['queries'] += stats.count
+        totals['db_time'] += stats.db_time
+        totals['acquire_time'] += stats.acquire_time
+        totals['n_plus_one'] += bool(stats.n_plus_one())
+
+
+def route_stats() -> dict:
+    ''' Used for monitoring the queries per route.
+
+    Returns:
+        - route path -> requests, queries, db_time, acquire_time, n_plus_one (requests flagged as N+1)
+    '''
+
+    with _routes_lock:
+        return {route: dict(totals) for route, totals in _routes.items()}
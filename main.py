@@ -1,13 +1,40 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import Depends, FastAPI
+from common.dependencies import unit_of_work
+from common.middleware import metrics_middleware, query_stats_middleware
+from data import migrations
+from data.database import close_pool, warm_up_pools
 from routers.categories import categories_router
 from routers.users import users_router
 from routers.topics import topics_router
 from routers.messages import messages_router
 from routers.replies import replies_router
+from routers.metrics import metrics_router
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ''' Used for bringing the schema up to date and opening the pooled connections before the first request,
+    and for closing them when the application stops.'''
+
+    # migrate() blocks on the migration lock and the DDL, so it runs on a thread instead of the event loop.
+    if migrations.MIGRATE_ON_STARTUP:
+        await asyncio.to_thread(migrations.migrate)
+    await warm_up_pools()
+
+    try:
+        yield
+    finally:
+        close_pool()
+
+
+app = FastAPI(lifespan=lifespan, dependencies=[Depends(unit_of_work, scope='function')])
+app.middleware('http')(query_stats_middleware)
+app.middleware('http')(metrics_middleware)
 app.include_router(categories_router)
 app.include_router(users_router)
 app.include_router(topics_router)
 app.include_router(messages_router)
-app.include_router(replies_router)
\ No newline at end of file
+app.include_router(replies_router)
+app.include_router(metrics_router)
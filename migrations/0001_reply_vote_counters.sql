@@ -0,0 +1,21 @@
+-- Vote counters stored on replies and one vote per user and reply.
+-- Every statement can run again, e.g. on a database created from a newer web_teamwork.sql.
+
+ALTER TABLE replies
+  ADD COLUMN IF NOT EXISTS upvotes INT(11) NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS downvotes INT(11) NOT NULL DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS score INT(11) NOT NULL DEFAULT 0;
+
+-- Duplicated votes keep the latest one, so the unique index can be created.
+DELETE v1 FROM votes v1
+  JOIN votes v2 ON v2.reply_id = v1.reply_id AND v2.user_id = v1.user_id AND v2.id > v1.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS reply_user_UNIQUE ON votes (reply_id, user_id);
+
+UPDATE replies r
+  LEFT JOIN (SELECT reply_id, SUM(vote = 1) AS upvotes, SUM(vote = 0) AS downvotes
+             FROM votes
+             GROUP BY reply_id) v ON v.reply_id = r.id
+  SET r.upvotes = COALESCE(v.upvotes, 0),
+      r.downvotes = COALESCE(v.downvotes, 0),
+      r.score = COALESCE(v.upvotes, 0) - COALESCE(v.downvotes, 0);
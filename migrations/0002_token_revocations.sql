@@ -0,0 +1,9 @@
+-- Access tokens issued before revoked_at are rejected.
+
+CREATE TABLE IF NOT EXISTS token_revocations (
+  user_id INT(11) NOT NULL,
+  revoked_at DATETIME NOT NULL,
+  PRIMARY KEY (user_id),
+  INDEX token_revocations_revoked_at_idx (revoked_at ASC))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4;
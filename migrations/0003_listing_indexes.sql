@@ -0,0 +1,16 @@
+-- Keyset pagination, sorting and search of the category, topic and reply listings.
+
+CREATE INDEX IF NOT EXISTS categories_created_at_idx ON categories (created_at);
+CREATE INDEX IF NOT EXISTS categories_private_created_at_idx ON categories (is_private, created_at);
+CREATE FULLTEXT INDEX IF NOT EXISTS categories_name_ft ON categories (name);
+
+CREATE INDEX IF NOT EXISTS topics_created_at_idx ON topics (created_at);
+CREATE INDEX IF NOT EXISTS topics_private_created_at_idx ON topics (is_private, created_at);
+CREATE INDEX IF NOT EXISTS topics_category_created_at_idx ON topics (category_id, created_at);
+CREATE INDEX IF NOT EXISTS topics_category_title_idx ON topics (category_id, title);
+CREATE FULLTEXT INDEX IF NOT EXISTS topics_title_ft ON topics (title);
+
+CREATE INDEX IF NOT EXISTS replies_topic_creation_date_idx ON replies (topic_id, creation_date);
+CREATE INDEX IF NOT EXISTS replies_topic_upvotes_idx ON replies (topic_id, upvotes);
+CREATE INDEX IF NOT EXISTS replies_topic_downvotes_idx ON replies (topic_id, downvotes);
+CREATE FULLTEXT INDEX IF NOT EXISTS replies_content_ft ON replies (content);
@@ -0,0 +1,45 @@
+-- Conversation pages read each direction of a user pair by timestamp,
+-- the inbox is read from the conversations summaries.
+
+CREATE INDEX IF NOT EXISTS messages_pair_timestamp_idx ON messages (sender_id, receiver_id, timestamp);
+
+CREATE TABLE IF NOT EXISTS conversations (
+  user_low_id INT(11) NOT NULL,
+  user_high_id INT(11) NOT NULL,
+  last_message_id INT(11) NOT NULL,
+  last_message_preview VARCHAR(100) NOT NULL,
+  last_activity DATETIME NOT NULL,
+  low_unread INT(11) NOT NULL DEFAULT 0,
+  high_unread INT(11) NOT NULL DEFAULT 0,
+  low_last_read_id INT(11) NOT NULL DEFAULT 0,
+  high_last_read_id INT(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_low_id, user_high_id),
+  INDEX conversations_low_activity_idx (user_low_id ASC, last_activity ASC),
+  INDEX conversations_high_activity_idx (user_high_id ASC, last_activity ASC),
+  CONSTRAINT fk_conversations_users1
+    FOREIGN KEY (user_low_id)
+    REFERENCES users (id)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION,
+  CONSTRAINT fk_conversations_users2
+    FOREIGN KEY (user_high_id)
+    REFERENCES users (id)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4;
+
+-- Summaries of the existing messages, like cli.py rebuild-conversations.
+INSERT INTO conversations(user_low_id, user_high_id, last_message_id, last_message_preview, last_activity,
+                          low_last_read_id, high_last_read_id)
+SELECT user_low_id, user_high_id, id, LEFT(content, 100), timestamp, id, id
+FROM (SELECT id, content, timestamp,
+             LEAST(sender_id, receiver_id) AS user_low_id, GREATEST(sender_id, receiver_id) AS user_high_id,
+             ROW_NUMBER() OVER (PARTITION BY LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id)
+                                ORDER BY timestamp DESC, id DESC) AS position
+      FROM messages) m
+WHERE position = 1
+ON DUPLICATE KEY UPDATE
+  last_message_id = VALUES(last_message_id),
+  last_message_preview = VALUES(last_message_preview),
+  last_activity = VALUES(last_activity);
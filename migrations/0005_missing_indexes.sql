@@ -0,0 +1,7 @@
+-- Service queries that still scanned a whole table:
+-- deleting a reply clears it as best reply of its topic (topics.best_reply_id),
+-- non-private topics sorted by title and non-private categories sorted by name.
+
+CREATE INDEX IF NOT EXISTS topics_best_reply_idx ON topics (best_reply_id);
+CREATE INDEX IF NOT EXISTS topics_private_title_idx ON topics (is_private, title);
+CREATE INDEX IF NOT EXISTS categories_private_name_idx ON categories (is_private, name);
@@ -0,0 +1,3 @@
+-- Revocations keep the microseconds, like the iat of the access tokens they are compared with.
+
+ALTER TABLE token_revocations MODIFY revoked_at DATETIME(6) NOT NULL;
@@ -1,23 +1,24 @@
-from fastapi import APIRouter, Query, Header, HTTPException
+from typing import Annotated
+from fastapi import APIRouter, BackgroundTasks, Query, Header, HTTPException, Response
 from data.models.category import Category, CreateCategoryModel
 from services import category_service
-from services import topic_service
 from services.utils import id_exists
 from common.auth import get_user_or_raise_401
+from common.responses import ModelJSONResponse
 from data.models.user import User
-from services.utils import paginate, get_page
+from services.utils import MAX_PAGE_SIZE
 
 
 categories_router = APIRouter(prefix='/categories', tags=['Categories'])
 
 
 @categories_router.get('/')
-def get_categories(
+async def get_categories(
     sort_cat: str | None = Query(None, alias="sort"), 
     sort_cat_by: str | None = Query(None, alias="sort_by"), 
     search_cat: str | None = Query(None, alias="search"),
-    page: int | None = None,
-    pagination: int | None = None,
+    cursor: str | None = None,
+    limit: Annotated[int | None, Query(ge=1, le=MAX_PAGE_SIZE)] = None,
     x_token: str = Header(default=None)
 ):
     ''' Finds all categories in the forum.
@@ -25,38 +26,35 @@ def get_categories(
     Returns:
         - if user.role is 'admin': all categories(private and non-private)
         - if user.role is 'customer: categories(non-private)
+        - with limit: one page of categories and the next_cursor for the following page
     '''
     
-    all_categories = category_service.all(search_cat)
-
     if x_token != None:
-        user = get_user_or_raise_401(x_token)
+        user = await get_user_or_raise_401(x_token)
     
         if User.is_customer(user):
-            all_categories = category_service.all_non_private(search_cat)
+            all_categories, next_cursor = await category_service.all_non_private(search_cat, cursor, limit, sort_cat, sort_cat_by)
         elif User.is_admin(user):
-            all_categories = category_service.all(search_cat)
+            all_categories, next_cursor = await category_service.all(search_cat, cursor, limit, sort_cat, sort_cat_by)
     else:
-        all_categories = category_service.all_non_private(search_cat)
+        all_categories, next_cursor = await category_service.all_non_private(search_cat, cursor, limit, sort_cat, sort_cat_by)
 
 
-    if sort_cat and (sort_cat == 'asc' or sort_cat == 'desc'):
-        all_categories = category_service.sort(all_categories, reverse=sort_cat == 'desc', attribute=sort_cat_by)
-    if pagination:
-        all_categories = paginate(all_categories, pagination)
-    if page:
-        all_categories = get_page(all_categories, page)
+    if not all_categories and cursor is None:
+        return HTTPException(status_code=404, detail='There are no categories.')
+    if limit:
+        return ModelJSONResponse({'categories': all_categories, 'next_cursor': next_cursor})
 
-    return all_categories if all_categories else HTTPException(status_code=404, detail='There are no categories.')
+    return ModelJSONResponse(all_categories)
 
 
 @categories_router.get('/{id}')
-def get_category_by_id(id: int,
+async def get_category_by_id(id: int,
     sort_topics: str | None = Query(None, alias="sort"),
     sort_topics_by: str | None = Query(None, alias="sort_by"),
     search_topics: str | None = Query(None, alias="search"),
-    page: int | None = None,
-    pagination: int | None = None,
+    cursor: str | None = None,
+    limit: Annotated[int | None, Query(ge=1, le=MAX_PAGE_SIZE)] = None,
     x_token: str = Header(default=None)
 ):
     ''' Finds the category through id.
@@ -66,32 +64,23 @@ def get_category_by_id(id: int,
         - if user.role is 'customer: category(non-private)
     '''
     
-    if not id_exists(id, 'categories'):
+    if not await id_exists(id, 'categories'):
         raise HTTPException(status_code=404, detail=f'Category with id: {id} does not exist.')
 
-    category = category_service.get_by_id(id, search_topics)
+    category = await category_service.get_by_id(id, search_topics, cursor, limit, sort_topics, sort_topics_by)
     
     if category.is_private == True:
         if x_token != None:
-            user = get_user_or_raise_401(x_token)
+            user = await get_user_or_raise_401(x_token)
     
             if User.is_customer(user):
                 raise HTTPException(status_code=400, detail=f'The category with id {id} is private.')
-            elif User.is_admin(user):
-                category = category_service.get_by_id(id, search_topics)
-
-    if sort_topics and (sort_topics == 'asc' or sort_topics == 'desc'):
-        category = topic_service.sort(category.topics, reverse=sort_topics == 'desc', attribute=sort_topics_by)
-    if pagination:
-        category.topics = paginate(category.topics, pagination)
-    if page:
-        category.topics = get_page(category.topics, page)  
 
-    return category 
+    return ModelJSONResponse(category)
     
 
 @categories_router.post('/')
-def create_category(category: CreateCategoryModel, x_token: str = Header(default=None)):
+async def create_category(category: CreateCategoryModel, x_token: str = Header(default=None)):
     '''Creates a category. Only an admin is allowed to create categories.
 
     Args:
@@ -105,16 +94,16 @@ def create_category(category: CreateCategoryModel, x_token: str = Header(default
     if x_token == None:
         raise HTTPException(status_code=401, detail='You must be logged in and be an admin to be able to create a new category.')
     
-    user = get_user_or_raise_401(x_token)
+    user = await get_user_or_raise_401(x_token)
     
     if not User.is_admin(user):
         raise HTTPException(status_code=401, detail='Only admins can create new categories.')
 
-    return {'Category created:'}, category_service.create(category)
+    return {'Category created:'}, await category_service.create(category)
 
 
 @categories_router.put('/edit/{id}')
-def edit_category_by_id(new_category: Category, id: int, x_token: str = Header(default=None)):
+async def edit_category_by_id(new_category: Category, id: int, x_token: str = Header(default=None)):
     '''Used for editing a category through id. Only an admin is allowed to edit categories.
 
     Args:
@@ -125,45 +114,51 @@ def edit_category_by_id(new_category: Category, id: int, x_token: str = Header(d
         - Category updated
     '''
 
-    if not id_exists(id, 'categories'):
+    if not await id_exists(id, 'categories'):
         raise HTTPException(status_code=404, detail='Category does not exist.')
     
     if x_token == None:
         raise HTTPException(status_code=401, detail='You need to be logged in and be an admin to edit a category.')    
 
-    user = get_user_or_raise_401(x_token)
+    user = await get_user_or_raise_401(x_token)
 
     if not User.is_admin(user):
         raise HTTPException(status_code=401, detail='You must be an admin to edit a category.')
     
-    old_category = category_service.get_by_id(id)
+    old_category = await category_service.get_by_id(id)
 
-    return {'Category updated:'}, category_service.edit_category(old_category, new_category)
+    return {'Category updated:'}, await category_service.edit_category(old_category, new_category)
 
 
 @categories_router.delete('/delete/{id}')
-def delete_category(id: int, x_token: str = Header(default=None)):
+async def delete_category(id: int, background_tasks: BackgroundTasks, response: Response, background: bool = False, x_token: str = Header(default=None)):
     '''Used for deleting a category through id. Only an admin is allowed to delete categories.
 
     Args:
         - id of the category in the URL link
+        - background: bool(URL link), very large categories can be deleted after the response is sent
         - JWT token(Header)
 
     Returns:
-        - Category deleted
+        - Category deleted, or 202 Category deletion started if background
     '''
 
-    if not id_exists(id, 'categories'):
+    if not await id_exists(id, 'categories'):
         raise HTTPException(status_code=404, detail='Category does not exist.')
     
     if x_token == None:
         raise HTTPException(status_code=401, detail='You need to be logged in and to be an admin to delete a message.')    
     
-    user = get_user_or_raise_401(x_token)
+    user = await get_user_or_raise_401(x_token)
 
     if not User.is_admin(user):
         raise HTTPException(status_code=401, detail='You must be an admin to delete a category.')
     
-    category_service.delete_category(id)
+    if background:
+        background_tasks.add_task(category_service.delete_category, id)
+        response.status_code = 202
+        return {'Category deletion started.'}
+
+    await category_service.delete_category(id)
 
     return {'Category deleted.'}
\ No newline at end of file
@@ -1,7 +1,10 @@
-from fastapi import APIRouter, HTTPException, Header
+from datetime import datetime
+from typing import Annotated
+from fastapi import APIRouter, HTTPException, Header, Query
 from services import message_service
+from common.responses import ModelJSONResponse, ndjson_response, sse_response
 from data.models.message import Message, CreateMessageModel
-from services.utils import id_exists
+from services.utils import MAX_PAGE_SIZE, id_exists
 from common.auth import get_user_or_raise_401
 
 
@@ -9,37 +12,89 @@ messages_router = APIRouter(prefix='/messages', tags=['Messages'])
 
 
 @messages_router.get('/conversation/{sender_id}/to/{receiver_id}',status_code=200)
-def view_conversation(sender_id: int, receiver_id, x_token: str = Header(default=None)):
+async def view_conversation(sender_id: int, receiver_id: int, stream: bool = False,
+    before: str | None = None,
+    after: str | None = None,
+    since: datetime | None = None,
+    limit: Annotated[int | None, Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+    x_token: str = Header(default=None)):
     ''' Used for viewing a conversation. The conversation can be viewed by the sender and also by the receiver.
     
     Args:
         - sender_id: int(URL link)
         - receiver_id: int(URL link)
+        - stream: bool(URL link), streams the messages as NDJSON (one message per line) instead of one JSON list
+        - before: str(URL link), previous_cursor of a page, for the older messages
+        - after: str(URL link), next_cursor of a page, for the newer messages, e.g. to fetch only new messages
+        - since: datetime(URL link), for the messages sent after this time
+        - limit: int(URL link), page size
         - JWT token(Header)
     
     Returns:
         - The whole conversation between the two user id's
+        - with before, after, since or limit: one page of messages, previous_cursor and next_cursor
+        - with stream: the whole conversation as NDJSON, one message per line, the page params are ignored
     '''
 
     if x_token == None:
         raise HTTPException(status_code=401, detail='You need to log-in to send a message.')    
-    if sender_id != get_user_or_raise_401(x_token).id:
+    if sender_id != (await get_user_or_raise_401(x_token)).id:
         raise HTTPException(status_code=401, detail='Viewing conversations of other accounts is not possible.')
 
-    if not id_exists(receiver_id, 'users'):
+    if not await id_exists(receiver_id, 'users'):
         raise HTTPException(status_code=404, detail=f'Receiver with ID: {receiver_id} does not exist.')
-    if not id_exists(sender_id, 'users'):
+    if not await id_exists(sender_id, 'users'):
         raise HTTPException(status_code=404, detail=f'Sender with ID: {sender_id} does not exist.')
     if sender_id == receiver_id:
         raise HTTPException(status_code=400, detail='Conversation does not exist.')
+
+    if sum(param is not None for param in (before, after, since)) > 1:
+        raise HTTPException(status_code=400, detail='Use only one of before, after and since.')
+
+    if stream:
+        return ndjson_response(message_service.stream_conversation(sender_id, receiver_id))
+
+    if before is not None or after is not None or since is not None or limit is not None:
+        messages, previous_cursor, next_cursor = await message_service.get_conversation_page(
+            sender_id, receiver_id, before, after, since, limit)
+        return ModelJSONResponse({'messages': messages, 'previous_cursor': previous_cursor, 'next_cursor': next_cursor})
     
-    all_messages = message_service.get_conversation(sender_id, receiver_id)
+    all_messages = await message_service.get_conversation(sender_id, receiver_id)
 
     return all_messages
 
 
+@messages_router.post('/conversation/{sender_id}/to/{receiver_id}/read', status_code=200)
+async def mark_conversation_read(sender_id: int, receiver_id: int, x_token: str = Header(default=None)):
+    ''' Used for marking a conversation as read once the user saw it. Viewing the conversation does not change it,
+    so prefetched or retried views do not mark messages as read.
+    
+    Args:
+        - sender_id: int(URL link), the user who read the conversation
+        - receiver_id: int(URL link), the other user
+        - JWT token(Header)
+    
+    Returns:
+        - The unread count of the conversation goes back to 0
+    '''
+
+    if x_token == None:
+        raise HTTPException(status_code=401, detail='You need to log-in to read a conversation.')
+    if sender_id != (await get_user_or_raise_401(x_token)).id:
+        raise HTTPException(status_code=401, detail='Reading conversations of other accounts is not possible.')
+
+    if not await id_exists(receiver_id, 'users'):
+        raise HTTPException(status_code=404, detail=f'Receiver with ID: {receiver_id} does not exist.')
+    if sender_id == receiver_id:
+        raise HTTPException(status_code=400, detail='Conversation does not exist.')
+
+    await message_service.mark_read(sender_id, receiver_id)
+
+    return {'Conversation marked as read.'}
+
+
 @messages_router.get('/{sender_id}/my_conversations', status_code=200)
-def get_conversations(sender_id: int, x_token: str = Header(default=None)):
+async def get_conversations(sender_id: int, x_token: str = Header(default=None)):
     ''' Used for viewing all conversations of the user.
     
     Args:
@@ -47,23 +102,46 @@ def get_conversations(sender_id: int, x_token: str = Header(default=None)):
         - JWT token(Header)
     
     Returns:
-        - A list of all conversations
+        - A list of all conversations (sent or received messages), the most recent first, with the other user,
+          the last message preview, the last activity and the number of unread messages
     '''
     
     if x_token == None:
         raise HTTPException(status_code=401, detail='You need to log-in to view conversations list.')
-    if not id_exists(sender_id, 'users'):
+    if not await id_exists(sender_id, 'users'):
         raise HTTPException(status_code=404, detail=f'Sender with ID: {sender_id} does not exist.')
-    if sender_id != get_user_or_raise_401(x_token).id:
+    if sender_id != (await get_user_or_raise_401(x_token)).id:
         raise HTTPException(status_code=401, detail="You can not view other people's conversations.")
     
-    conversations = message_service.get_conversations_list(sender_id)
+    return await message_service.get_conversations_list(sender_id)
 
-    return {'You have conversations with:': (user[0] for user in conversations)}
+
+@messages_router.get('/{user_id}/events')
+async def message_events(user_id: int, x_token: str = Header(default=None), last_event_id: str = Header(default=None)):
+    ''' Used for receiving new messages as they are sent, instead of polling the conversations.
+    
+    Args:
+        - user_id: int(URL link)
+        - JWT token(Header)
+        - Last-Event-ID(Header): id of the last message received, sent by reconnecting clients
+    
+    Returns:
+        - Server-Sent Events stream, a 'message' event for every message sent to or by the user
+    '''
+
+    if x_token == None:
+        raise HTTPException(status_code=401, detail='You need to log-in to receive messages.')
+    if user_id != (await get_user_or_raise_401(x_token)).id:
+        raise HTTPException(status_code=401, detail='Receiving messages of other accounts is not possible.')
+
+    if last_event_id is not None and not last_event_id.isdigit():
+        raise HTTPException(status_code=400, detail='Last-Event-ID must be the id of a message.')
+
+    return sse_response(message_service.message_events(user_id, int(last_event_id) if last_event_id is not None else None))
 
 
 @messages_router.post('/{sender_id}/to/{receiver_id}', status_code=201)
-def send_new_message(message: CreateMessageModel, sender_id: int, receiver_id: int, x_token: str = Header(default=None)):
+async def send_new_message(message: CreateMessageModel, sender_id: int, receiver_id: int, x_token: str = Header(default=None)):
     ''' Used for sending a message to another user.
     
     Args:
@@ -78,23 +156,23 @@ def send_new_message(message: CreateMessageModel, sender_id: int, receiver_id: i
 
     if x_token == None:
         raise HTTPException(status_code=401, detail='You need to log-in to send a message.')    
-    if sender_id != get_user_or_raise_401(x_token).id:
+    if sender_id != (await get_user_or_raise_401(x_token)).id:
         raise HTTPException(status_code=401, detail='Sending message from wrong account is not possible.')
    
-    if not id_exists(receiver_id, 'users'):
+    if not await id_exists(receiver_id, 'users'):
         raise HTTPException(status_code=404, detail=f'Receiver with ID: {receiver_id} does not exist.')
-    if not id_exists(sender_id, 'users'):
+    if not await id_exists(sender_id, 'users'):
         raise HTTPException(status_code=404, detail=f'Sender with ID: {sender_id} does not exist.')
     if sender_id == receiver_id:
         raise HTTPException(status_code=400, detail='You are trying to message yourself. Try a different receiver ID.')
     
-    message_service.send_message(message, sender_id, receiver_id)
+    await message_service.send_message(message, sender_id, receiver_id)
 
     return {'Message sent.'}
 
 
 @messages_router.put('/edit/{id}')
-def edit_message_by_id(new_message: Message, id: int, x_token: str = Header(default=None)):
+async def edit_message_by_id(new_message: Message, id: int, x_token: str = Header(default=None)):
     ''' Used for editing a message through id(of the message). Only the sender of the message can edit it.
     
     Args:
@@ -108,20 +186,20 @@ def edit_message_by_id(new_message: Message, id: int, x_token: str = Header(defa
 
     if x_token == None:
         raise HTTPException(status_code=401, detail='You need to log-in to edit a message.')    
-    if message_service.get_by_id(id).sender_id != get_user_or_raise_401(x_token).id:
-        raise HTTPException(status_code=401, detail='Editing other account message is not possible.')
-    
-    if not id_exists(id, 'messages'):
+    if not await id_exists(id, 'messages'):
         raise HTTPException(status_code=404, detail=f'Message with id {id} does not exist.')
-    old_message = message_service.get_by_id(id)
 
-    message_service.edit_message(old_message, new_message)
+    old_message = await message_service.get_by_id(id)
+    if old_message.sender_id != (await get_user_or_raise_401(x_token)).id:
+        raise HTTPException(status_code=401, detail='Editing other account message is not possible.')
+
+    await message_service.edit_message(old_message, new_message)
 
     return {'Message updated.'}
 
 
 @messages_router.delete('/delete/{id}')
-def delete_message(id: int, x_token: str = Header(default=None)):
+async def delete_message(id: int, x_token: str = Header(default=None)):
     ''' Used for deleting a message through id(of the message). Only the sender of the message can delete it.
     
     Args:
@@ -132,13 +210,13 @@ def delete_message(id: int, x_token: str = Header(default=None)):
         - Deleted message
     '''
     
-    if not id_exists(id, 'messages'):
+    if not await id_exists(id, 'messages'):
         raise HTTPException(status_code=404, detail=f'Message with id {id} does not exist.')
     if x_token == None:
         raise HTTPException(status_code=401, detail='You need to log-in to delete a message.')    
-    if message_service.get_by_id(id).sender_id != get_user_or_raise_401(x_token).id:
+    if (await message_service.get_by_id(id)).sender_id != (await get_user_or_raise_401(x_token)).id:
         raise HTTPException(status_code=401, detail='Deleting messages from wrong account is not possible.')
     
-    message_service.delete_message(id)
+    await message_service.delete_message(id)
 
     return {'Message deleted.'}
\ No newline at end of file
@@ -0,0 +1,88 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from common import metrics
+from common.auth import user_cache_stats
+from data.database import pool_stats
+from data.query_stats import route_stats
+from services import events, topic_cache
+
+
+metrics_router = APIRouter(tags=['Metrics'])
+
+_POOL_GAUGES = ('size', 'idle', 'in_use')
+_POOL_COUNTERS = ('created', 'closed', 'acquired', 'waits', 'timeouts', 'health_check_failures')
+_EVENT_COUNTERS = {
+    'published': 'Events received for the subscribers of this worker.',
+    'delivered': 'Events handed to an open event stream.',
+    'dropped': 'Event streams closed for falling too far behind.',
+}
+
+
+def _pool_lines() -> list[str]:
+    primary = pool_stats()
+    pools = [('primary', primary)] + [(f'replica{i}', stats) for i, stats in enumerate(primary['replicas'])]
+
+    lines = []
+    for key in _POOL_GAUGES:
+        lines += metrics.sample_lines(f'forum_db_pool_{key}', f'Connections of the pool ({key}).', 'gauge',
+                                      [({'pool': name}, stats[key]) for name, stats in pools])
+    for key in _POOL_COUNTERS:
+        lines += metrics.sample_lines(f'forum_db_pool_{key}_total', f'Lifetime count of pool events ({key}).', 'counter',
+                                      [({'pool': name}, stats[key]) for name, stats in pools])
+
+    return lines
+
+
+def _cache_lines() -> list[str]:
+    topics, users = topic_cache.stats(), user_cache_stats()
+    caches = [('topic', topics), ('auth', users)]
+
+    lines = []
+    for key in ('hits', 'misses', 'invalidations'):
+        lines += metrics.sample_lines(f'forum_cache_{key}_total', f'Lifetime count of cache {key}.', 'counter',
+                                      [({'cache': name}, stats[key]) for name, stats in caches])
+    lines += metrics.sample_lines('forum_cache_hit_ratio', 'Hits / (hits + misses) since the start of the worker.', 'gauge',
+                                  [({'cache': name}, stats['hits'] / max(1, stats['hits'] + stats['misses'])) for name, stats in caches])
+    lines += metrics.sample_lines('forum_cache_size', 'Entries in the in-process cache.', 'gauge',
+                                  [({'cache': name}, stats['size']) for name, stats in caches if 'size' in stats])
+
+    return lines
+
+
+def _route_lines() -> list[str]:
+    routes = sorted(route_stats().items())
+
+    lines = metrics.sample_lines('forum_route_queries_total', 'SQL statements run by the requests of a route.', 'counter',
+                                 [({'route': route}, totals['queries']) for route, totals in routes])
+    lines += metrics.sample_lines('forum_route_n_plus_one_total', 'Requests of a route flagged as N+1.', 'counter',
+                                  [({'route': route}, totals['n_plus_one']) for route, totals in routes])
+
+    return lines
+
+
+def _event_lines() -> list[str]:
+    stats = events.stats()
+
+    lines = metrics.sample_lines('forum_event_subscribers', 'Open event streams of this worker.', 'gauge', [({}, stats['subscribers'])])
+    for key, help in _EVENT_COUNTERS.items():
+        lines += metrics.sample_lines(f'forum_events_{key}_total', help, 'counter', [({}, stats[key])])
+
+    return lines
+
+
+@metrics_router.get('/metrics', response_class=PlainTextResponse)
+async def get_metrics():
+    ''' Used for scraping the metrics of this worker in the Prometheus text format:
+    request latency and errors per route, SQL latency per fingerprint, connection pools, caches and event streams.
+    Each worker process keeps its own metrics.
+    '''
+
+    lines = metrics.request_duration.render()
+    lines += metrics.request_errors.render()
+    lines += metrics.query_duration.render()
+    lines += _pool_lines()
+    lines += _cache_lines()
+    lines += _route_lines()
+    lines += _event_lines()
+
+    return PlainTextResponse('\n'.join(lines) + '\n', media_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Header, HTTPException
-from common.auth import get_user_or_raise_401, create_token, find_by_id
-from data.models.user import User, LoginData
+from common.auth import get_user_or_raise_401, create_token, create_refresh_token, refresh_access_token, access_token_ttl, find_by_id
+from common.responses import ndjson_response
+from data.models.user import User, LoginData, RefreshData
 from services import user_service, utils
 
 
@@ -8,7 +9,7 @@ users_router = APIRouter(prefix='/users', tags=['Users'])
 
 
 @users_router.post('/register')
-def register(data: LoginData):
+async def register(data: LoginData):
     ''' Used for registering new users.
     
     Args:
@@ -18,36 +19,53 @@ def register(data: LoginData):
         - Registered user as customer
     '''
     
-    user = user_service.create(data.username, data.password)
+    user = await user_service.create(data.username, data.password)
 
     return user or HTTPException(status_code=400, detail=f'Username {data.username} is already taken.')
 
 
 @users_router.post('/login')
-def login(data: LoginData):
+async def login(data: LoginData):
     ''' Used for logging in.
 
     Args:
         - LoginData(username, password(str))
 
     Returns:
-        - JWT token
+        - JWT access token, JWT refresh token
     '''
 
-    user = user_service.try_login(data.username, data.password)
+    user = await user_service.try_login(data.username, data.password)
 
     if user:
         token = create_token(user)
-        return {'token': token}
+        return {'token': token, 'refresh_token': create_refresh_token(user), 'expires_in': access_token_ttl()}
     else:
         raise HTTPException(status_code=400, detail='Invalid login data.')
 
 
+@users_router.post('/refresh')
+async def refresh(data: RefreshData):
+    ''' Used for getting a new access token when the old one expired.
+
+    Args:
+        - RefreshData(refresh_token(str))
+
+    Returns:
+        - JWT access token
+    '''
+
+    token = await refresh_access_token(data.refresh_token)
+
+    return {'token': token, 'expires_in': access_token_ttl()}
+
+
 @users_router.get('/info/all')
-def all_users(x_token: str = Header(default=None)):
+async def all_users(stream: bool = False, x_token: str = Header(default=None)):
     ''' Used for admins to see a list with all users.
     
     Args:
+        - stream: bool(URL link), streams the users as NDJSON (one user per line) instead of one JSON list
         - JWT token
     
     Returns:
@@ -57,16 +75,19 @@ def all_users(x_token: str = Header(default=None)):
     if x_token == None:
         raise HTTPException(status_code=401, detail='You must be logged in and be an admin to be able to view a list with users.')
     
-    user = get_user_or_raise_401(x_token)
+    user = await get_user_or_raise_401(x_token)
     
     if not User.is_admin(user):
         raise HTTPException(status_code=401, detail='Only admins can view a list with all users.')
+
+    if stream:
+        return ndjson_response(user_service.stream_all_users())
     
-    return user_service.find_all_users()
+    return await user_service.find_all_users()
 
 
 @users_router.get('/info/id/{id}')
-def user_info(id: int, x_token: str = Header(default=None)):
+async def user_info(id: int, x_token: str = Header(default=None)):
     ''' Used for admins to see data information about a user.
     
     Args:
@@ -80,19 +101,19 @@ def user_info(id: int, x_token: str = Header(default=None)):
     if x_token == None:
         raise HTTPException(status_code=401, detail='You must be logged in and be an admin to be able to review accounts.')
     
-    user = get_user_or_raise_401(x_token)
+    user = await get_user_or_raise_401(x_token)
     
     if not User.is_admin(user):
         raise HTTPException(status_code=401, detail='Only admins can review accounts.')
     
-    if not utils.id_exists(id, 'users'):
+    if not await utils.id_exists(id, 'users'):
         raise HTTPException(status_code=404, detail=f'User with id {id} does not exist.')
     
-    return user_service.find_by_id_admin(id)
+    return await user_service.find_by_id_admin(id)
 
 
 @users_router.get('/info/username/{username}')
-def user_info(username: str, x_token: str = Header(default=None)):
+async def user_info(username: str, x_token: str = Header(default=None)):
     ''' Used for admins and customers to see data information about a user.
     
     Args:
@@ -106,21 +127,21 @@ def user_info(username: str, x_token: str = Header(default=None)):
     if x_token == None:
         raise HTTPException(status_code=401, detail='You must be logged in and be an admin to be able to search accounts.')
     
-    user = get_user_or_raise_401(x_token)
+    user = await get_user_or_raise_401(x_token)
 
-    if not utils.username_exists(username, 'users'):
+    if not await utils.username_exists(username, 'users'):
         raise HTTPException(status_code=404, detail=f'User with username {username} does not exist.')
     
     if User.is_admin(user):
-        return user_service.find_by_username_info(username)
+        return await user_service.find_by_username_info(username)
     elif User.is_customer(user):
-        return user_service.find_by_username_info(username)
+        return await user_service.find_by_username_info(username)
     else:
         raise HTTPException(status_code=401, detail='Only logged in users and admins can search accounts.')
 
 
 @users_router.put('/edit/{id}')
-def edit_users_role(new_user: User, id: int, x_token: str = Header(default=None)):
+async def edit_users_role(new_user: User, id: int, x_token: str = Header(default=None)):
     ''' Used for editing a user's role through user.id. Only admins can edit it.
 
     Args:
@@ -134,24 +155,24 @@ def edit_users_role(new_user: User, id: int, x_token: str = Header(default=None)
     if x_token == None:
         raise HTTPException(status_code=401, detail='You must be logged in and be an admin to be able to edit users roles.')
     
-    user = get_user_or_raise_401(x_token)
+    user = await get_user_or_raise_401(x_token)
     
     if not User.is_admin(user):
         raise HTTPException(status_code=401, detail='Only admins can edit roles.')
 
-    if not utils.id_exists(id, 'users'):
+    if not await utils.id_exists(id, 'users'):
         raise HTTPException(status_code=404, detail=f'User with id {id} does not exist.')
 
     if new_user.role != 'admin' and new_user.role != 'customer':
         raise HTTPException(status_code=404, detail='Unknown role.')
     
-    old_user = find_by_id(id)
+    old_user = await find_by_id(id)
 
-    return user_service.edit_user(old_user, new_user)
+    return await user_service.edit_user(old_user, new_user)
 
 
 @users_router.delete('/delete/{id}')
-def delete_user(id: int, x_token: str = Header(default=None)):
+async def delete_user(id: int, x_token: str = Header(default=None)):
     ''' Used for deleting a user through user.id. Only admins can delete it.
 
     Args:
@@ -165,13 +186,13 @@ def delete_user(id: int, x_token: str = Header(default=None)):
     if x_token == None:
         raise HTTPException(status_code=401, detail='You must be logged in and be an admin to be able to delete a user.')    
     
-    user = get_user_or_raise_401(x_token)
+    user = await get_user_or_raise_401(x_token)
 
-    if not utils.id_exists(id, 'users'):
+    if not await utils.id_exists(id, 'users'):
         raise HTTPException(status_code=404, detail=f'User with id {id} does not exist.')
 
     if User.is_admin(user):
-        user_service.delete_user(id)
+        await user_service.delete_user(id)
     
     if User.is_customer(user):
         raise HTTPException(status_code=401, detail='You must be admin to be able to delete a user.')
@@ -1,50 +1,80 @@
 from datetime import datetime
 from fastapi import APIRouter, Response, HTTPException
-from data.database import insert_query, read_query, read_query_additional, update_query
+from data import identity_map
+from data.database import insert_query, update_query, transaction
+from data.indexes import SAMPLE_LIMIT, hot_query
 from data.models.category import Category
-from data.models.topic import Topic
-from services import topic_service
+from services import topic_cache, topic_service
+from services.utils import keyset_query, keyset_sql, search_condition, sort_order
 
 
-def all(search: str = None):
+_CATEGORY_COLUMNS = 'id, name, description, is_locked, is_private, created_at'
+
+identity_map.register('categories', _CATEGORY_COLUMNS)
+
+_SORT_COLUMNS = {'name': 'name', 'created_at': 'created_at', 'id': 'id'}
+
+
+def _categories_query(conditions: list, params: list, search: str, sort: str, sort_by: str) -> dict:
+    relevance = None
+    if search is not None:
+        condition, search_params, relevance = search_condition('name', search)
+        conditions.append(condition)
+        params += search_params
+
+    order_by, descending, order_params = sort_order(_SORT_COLUMNS, sort, sort_by, relevance=relevance)
+
+    return {'conditions': conditions, 'sql_params': params, 'order_by': order_by, 'descending': descending, 'order_params': order_params}
+
+
+async def _categories_page(conditions: list, params: list, search: str, cursor: str, limit: int, sort: str, sort_by: str):
+    data, next_cursor = await keyset_query(_CATEGORY_COLUMNS, 'categories', cursor=cursor, limit=limit,
+                                     **_categories_query(conditions, params, search, sort, sort_by))
+
+    return [Category.from_query_result(*cat) for cat in data], next_cursor
+
+
+def hot_queries() -> list[dict]:
+    ''' Used by cli.py check-indexes to EXPLAIN the category listings, built like for the requests.'''
+
+    def listing(name: str, sort: str = None, sort_by: str = None):
+        sql, sql_params = keyset_sql(_CATEGORY_COLUMNS, 'categories', limit=SAMPLE_LIMIT,
+                                     **_categories_query(['is_private = 0'], [], None, sort, sort_by))
+
+        return hot_query(name, sql, sql_params, ordered=True)
+
+    return [
+        listing('categories by created_at'),
+        listing('categories by name', sort='asc', sort_by='name'),
+    ]
+
+
+async def all(search: str = None, cursor: str = None, limit: int = None, sort: str = None, sort_by: str = None):
     ''' Used for getting all categories(private and non-private) from database. Used functions for admins requests.
 
+    Can be sorted by: name, created_at, id. Can be sorted also in reverse. Search results are ranked by relevance unless sorted.
+
     Returns:
-        - List of all categories
+        - List of all categories, next_cursor
     '''
 
-    if search is None:
-        data = read_query('SELECT id, name, description, is_locked, is_private, created_at FROM categories')
-    else:
-        data = read_query('SELECT id, name, description, is_locked, is_private, created_at FROM categories WHERE name LIKE ?', (f'%{search}%',))
-
-    result = (Category.from_query_result(*cat) for cat in data)
-
-    return result if data else HTTPException(status_code=404, detail='There are no categories.')
+    return await _categories_page([], [], search, cursor, limit, sort, sort_by)
     
 
-def all_non_private(search: str = None):
+async def all_non_private(search: str = None, cursor: str = None, limit: int = None, sort: str = None, sort_by: str = None):
     ''' Used for getting all categories(only non-private) from database. Used functions for customers requests.
 
+    Can be sorted by: name, created_at, id. Can be sorted also in reverse. Search results are ranked by relevance unless sorted.
+
     Returns:
-        - List of all non-private categories
+        - List of all non-private categories, next_cursor
     '''
 
-    if search is None:
-        categories = read_query('''SELECT id, name, description, is_locked, is_private, created_at 
-                                FROM categories 
-                                WHERE is_private = 0''')
-    else:
-        categories = read_query('''
-        SELECT id, name, description, is_locked, is_private, created_at
-        FROM categories 
-        WHERE is_private = 0 AND name LIKE ?''', (f'%{search}%',))  
-
-    return (Category.from_query_result(*cat) for cat in categories) if categories else HTTPException(status_code=404, detail='There are no categories.')
+    return await _categories_page(['is_private = 0'], [], search, cursor, limit, sort, sort_by)
     
 
-def get_by_id(id: int, search: str = None):
-    ''' Used for getting a single category by category.id.
+async def get_by_id(id: int, search: str = None, cursor: str = None, limit: int = None, sort: str = None, sort_by: str = None):
+    ''' Used for getting a single category by category.id with one page of its topics.
     
     Args:
         - category.id: int(URL link)
@@ -53,42 +83,19 @@ def get_by_id(id: int, search: str = None):
         - category
     '''
 
-    category = read_query_additional('SELECT id, name, description, is_locked, is_private, created_at FROM categories where id = ?',(id,)) 
+    category = await identity_map.load('categories', id)
                 
     if category is None:
         raise HTTPException(status_code=404, detail=f'Category with id: {id} does not exist.')
     
     actual = Category.from_query_result(*category)
 
-    if search is None:
-        cat_topics = read_query('''SELECT * FROM topics where category_id = ?''', (id,))
-    else:
-        cat_topics = read_query('SELECT * FROM topics WHERE category_id = ? AND title LIKE ?', (id, f'%{search}%'))
-    
-    topics = [Topic.from_query_result(*topic) for topic in cat_topics]
-    actual.topics = topics
+    actual.topics, actual.next_cursor = await topic_service.get_by_category(id, search, cursor, limit, sort, sort_by)
     
     return actual
     
 
-def sort(categories: list[Category], *, attribute=None, reverse=False):
-    ''' Used for sorting all categories. Can be sorted by: name, created_at, id. Can be sorted also in reverse.
-
-    Returns:
-        - sorted list of categories
-    '''
-
-    if attribute == 'name':
-        sort_fn = lambda c: c.name
-    elif attribute == 'created_at':
-        sort_fn = lambda c: c.created_at
-    else:
-        sort_fn = lambda c: c.id
-    
-    return sorted(categories, key=sort_fn, reverse=reverse)
-
-
-def create(category: Category):
+async def create(category: Category):
     ''' Used for saving the created category to the database.
     
     Returns:
@@ -96,7 +103,7 @@ def create(category: Category):
     '''
 
     DATETIME_NOW = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    generated_id = insert_query(
+    generated_id = await insert_query(
         'INSERT INTO categories(name, description, is_locked, is_private, created_at) values(?,?,?,?,?)',
         (category.name, category.description, category.is_locked, category.is_private, DATETIME_NOW))
 
@@ -107,19 +114,28 @@ def create(category: Category):
     return category
 
 
-def delete_category(id: int):
-    ''' Used for deleting the category and all topics in it from the database.'''
+async def delete_category(id: int):
+    ''' Used for deleting the category and all topics, replies and votes in it from the database.
+    Every table is cleared with one set-based DELETE, all in one transaction.'''
     
-    topic_ids = read_query('SELECT id FROM topics WHERE category_id = ?', (id,))
-
-    for topic_id in topic_ids:
-        topic_service.delete_topic(topic_id[0])
-
-    insert_query('''DELETE FROM categories WHERE id = ?''',
-                 (id,))
+    async with transaction():
+        await update_query('''DELETE v FROM votes v
+                        JOIN replies r ON v.reply_id = r.id
+                        JOIN topics t ON r.topic_id = t.id
+                        WHERE t.category_id = ?''', (id,))
+        await update_query('''DELETE r FROM replies r
+                        JOIN topics t ON r.topic_id = t.id
+                        WHERE t.category_id = ?''', (id,))
+        await update_query('''DELETE FROM topics WHERE category_id = ?''', (id,))
+        await update_query('''DELETE FROM categories WHERE id = ?''', (id,))
+        await topic_cache.invalidate_all()
+
+    identity_map.forget('categories', id)
+    identity_map.forget('topics')
+    identity_map.forget('replies')
     
     
-def edit_category(old_category: Category, new_category: Category):
+async def edit_category(old_category: Category, new_category: Category):
     ''' Used for editing name, description, is_locked, is_private of a category in the database.'''
     
     edited_category = Category(
@@ -132,10 +148,13 @@ def edit_category(old_category: Category, new_category: Category):
         created_at=old_category.created_at
     )
 
-    update_query('''UPDATE categories SET name = ?, description = ?, is_locked = ?, is_private = ?, created_at = ? WHERE id = ?''',
+    await update_query('''UPDATE categories SET name = ?, description = ?, is_locked = ?, is_private = ?, created_at = ? WHERE id = ?''',
                 (edited_category.name, edited_category.description, edited_category.is_locked, edited_category.is_private, edited_category.created_at, edited_category.id))
+    identity_map.forget('categories', edited_category.id)
 
     if new_category.is_private == True:
-        new_category.topics = update_query('''UPDATE topics SET is_private = 1 WHERE category_id = ?''', (old_category.id,))
+        new_category.topics = await update_query('''UPDATE topics SET is_private = 1 WHERE category_id = ?''', (old_category.id,))
+        identity_map.forget('topics')
+        await topic_cache.invalidate_all()
 
     return edited_category
\ No newline at end of file
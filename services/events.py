@@ -0,0 +1,70 @@
+import logging
+import os
+from contextlib import asynccontextmanager
+from common.pubsub import create_broker
+from common.responses import sse_event
+from data.database import on_commit
+
+
+_broker = create_broker(
+    os.environ.get('FORUM_EVENTS_URL'),
+    max_pending=int(os.environ.get('FORUM_EVENTS_MAX_PENDING', 1000))
+)
+
+# Seconds between keep-alive comments of an idle event stream, so proxies do not close it.
+HEARTBEAT = float(os.environ.get('FORUM_EVENTS_HEARTBEAT', 15))
+
+_logger = logging.getLogger(__name__)
+
+
+def user_channel(user_id: int) -> str:
+    return f'user:{user_id}'
+
+
+def topic_channel(topic_id: int) -> str:
+    return f'topic:{topic_id}'
+
+
+async def publish(channel: str, event: str, data, id=None):
+    ''' Used after a write to push an event to the subscribers of a channel once the transaction commits,
+    so subscribers never see a rolled back write. The event is encoded once, for every subscriber.
+
+    Args:
+        - event: name of the event, e.g. 'message'
+        - data: JSON serializable content, pydantic models included
+        - id: id of the event, sent back by reconnecting clients as Last-Event-ID
+    '''
+
+    await on_commit(_publish, channel, sse_event(event, data, id))
+
+
+async def _publish(channel: str, payload: bytes):
+    ''' The write is already committed, a failed publish only means subscribers catch up when they reconnect.'''
+
+    try:
+        await _broker.publish(channel, payload)
+    except Exception:
+        _logger.exception('Publishing to %s failed', channel)
+
+
+@asynccontextmanager
+async def subscribe(channel: str):
+    ''' Used for receiving the events published to a channel while the with block runs.
+    Subscribe before reading what was missed, so nothing written in between is lost.
+
+    Returns:
+        - Subscription, its listen(HEARTBEAT) yields every event encoded by sse_event() and None as a heartbeat
+    '''
+
+    async with _broker.subscribe(channel) as subscription:
+        yield subscription
+
+
+def stats() -> dict:
+    ''' Used for monitoring the event streams.
+
+    Returns:
+        - subscribers, published, delivered and dropped (subscribers too far behind) of this worker
+    '''
+
+    return _broker.stats()
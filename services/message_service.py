@@ -1,17 +1,51 @@
 from datetime import datetime
 from fastapi import APIRouter, HTTPException
-from data.database import insert_query, read_query, read_query_additional, update_query
-from data.models.message import Message, MessageResponseModel
+from data import identity_map
+from data.database import insert_query, iter_query, read_query, read_query_additional, update_query, transaction
+from data.indexes import SAMPLE_LIMIT, hot_query
+from data.models.message import ConversationResponseModel, Message, MessageResponseModel
+from common.responses import sse_event
+from services import events
+from services.utils import MAX_PAGE_SIZE, decode_cursor, encode_cursor
 
 
-def all():
+_MESSAGE_COLUMNS = 'id, content, timestamp, sender_id, receiver_id'
+
+identity_map.register('messages', _MESSAGE_COLUMNS)
+
+_PREVIEW_LENGTH = 100
+
+# The whole conversation between two users, oldest first.
+_CONVERSATION = '''SELECT * FROM messages WHERE (sender_id = ? AND receiver_id = ?)
+                   OR (sender_id = ? AND receiver_id = ?)
+                   ORDER BY timestamp ASC'''
+
+# The conversations of a user, the most recent first.
+_CONVERSATIONS = '''SELECT c.user_id, u.username, c.last_message_id, c.last_message_preview, c.last_activity, c.unread
+                    FROM (SELECT user_high_id AS user_id, last_message_id, last_message_preview, last_activity, low_unread AS unread
+                          FROM conversations WHERE user_low_id = ?
+                          UNION ALL
+                          SELECT user_low_id, last_message_id, last_message_preview, last_activity, high_unread
+                          FROM conversations WHERE user_high_id = ?) c
+                    JOIN users u ON u.id = c.user_id
+                    ORDER BY c.last_activity DESC, c.last_message_id DESC'''
+
+_MESSAGES_AFTER_SIDE = f'(SELECT {_MESSAGE_COLUMNS} FROM messages WHERE {{column}} = ? AND id > ? ORDER BY id LIMIT ?)'
+
+# The messages sent or received by a user after a message id, oldest first.
+_MESSAGES_AFTER = f'''SELECT {_MESSAGE_COLUMNS}
+                      FROM ({_MESSAGES_AFTER_SIDE.format(column='receiver_id')} UNION ALL {_MESSAGES_AFTER_SIDE.format(column='sender_id')}) m
+                      ORDER BY id LIMIT ?'''
+
+
+async def all():
     ''' Used for getting all messages from database.
 
     Returns:
         - List of all messages
     '''
 
-    messages = read_query_additional('''SELECT * FROM messages''')
+    messages = await read_query_additional('''SELECT * FROM messages''')
 
     if messages:
         return (MessageResponseModel.from_query_result(*msg) for msg in messages)
@@ -19,21 +53,106 @@ def all():
         return HTTPException(status_code=404, content='No messages found.')
     
 
-def get_conversation(sender_id, receiver_id):
+async def get_conversation(sender_id, receiver_id):
     ''' Used for getting the whole conversation between two users from the database.'''
 
-    messages = read_query('''SELECT * FROM messages WHERE (sender_id = ? AND receiver_id = ?)
-                           OR (sender_id = ? AND receiver_id = ?)
-                           ORDER BY timestamp ASC''', (sender_id, receiver_id, receiver_id, sender_id))
+    messages = await read_query(_CONVERSATION, (sender_id, receiver_id, receiver_id, sender_id))
     
     if messages:
         return [MessageResponseModel.from_query_result(*msg) for msg in messages]
+
+
+def _message_cursor(message: MessageResponseModel) -> str:
+    return encode_cursor('timestamp', False, (message.timestamp, message.id))
+
+
+def _pair_sql(user_id: int, other_id: int, condition: str, params: list, forward: bool, limit: int) -> tuple:
+    ''' Used to build the statement of _read_pair().
+
+    Returns:
+        - sql, params
+    '''
+
+    direction = 'ASC' if forward else 'DESC'
+    side = f'''(SELECT {_MESSAGE_COLUMNS} FROM messages WHERE sender_id = ? AND receiver_id = ?{condition}
+               ORDER BY timestamp {direction}, id {direction} LIMIT ?)'''
+
+    return (f'''SELECT {_MESSAGE_COLUMNS} FROM ({side} UNION ALL {side}) m
+                ORDER BY timestamp {direction}, id {direction} LIMIT ?''',
+            (user_id, other_id, *params, limit, other_id, user_id, *params, limit, limit))
+
+
+async def _read_pair(user_id: int, other_id: int, condition: str, params: list, forward: bool, limit: int, primary: bool = False):
+    ''' Used to read the messages between two users ordered by timestamp and id. Each direction of the conversation is
+    read from the (sender_id, receiver_id, timestamp) index with its own ORDER BY and LIMIT, instead of an OR of both.
+
+    Args:
+        - condition: extra condition on timestamp and id, starting with AND
+        - forward: oldest first if True, newest first otherwise
+
+    Returns:
+        - at most limit rows
+    '''
+
+    sql, sql_params = _pair_sql(user_id, other_id, condition, params, forward, limit)
+
+    return await read_query(sql, sql_params, primary=primary)
+
+
+async def get_conversation_page(sender_id: int, receiver_id: int, before: str = None, after: str = None,
+                                since: datetime = None, limit: int = None):
+    ''' Used for getting one page of a conversation, ordered by timestamp and id like get_conversation().
+    Only the rows of the page are read, however long the conversation is.
+
+    Args:
+        - before: cursor, the messages right before it (older)
+        - after: cursor, the messages right after it (newer)
+        - since: only messages sent after this time
+        - limit: page size, MAX_PAGE_SIZE by default. Without before, after and since the latest messages are returned.
+
+    Returns:
+        - list of messages, previous_cursor (for before, None if there are no older messages), next_cursor (for after)
+    '''
+
+    limit = limit or MAX_PAGE_SIZE
+    condition, params = '', []
+    if before is not None:
+        timestamp, id = decode_cursor(before, 'timestamp', False)
+        condition, params = ' AND (timestamp < ? OR (timestamp = ? AND id < ?))', [timestamp, timestamp, id]
+    elif after is not None:
+        timestamp, id = decode_cursor(after, 'timestamp', False)
+        condition, params = ' AND (timestamp > ? OR (timestamp = ? AND id > ?))', [timestamp, timestamp, id]
+    elif since is not None:
+        condition, params = ' AND timestamp > ?', [since]
+
+    forward = after is not None or since is not None
+    data = await _read_pair(sender_id, receiver_id, condition, params, forward, limit + 1)
+
+    more = len(data) > limit
+    messages = [MessageResponseModel.from_query_result(*row) for row in data[:limit]]
+    if not forward:
+        messages.reverse()
+
+    if not messages:
+        return messages, None, after
+
+    previous_cursor = _message_cursor(messages[0]) if forward or more else None
+
+    return messages, previous_cursor, _message_cursor(messages[-1])
+
+
+def stream_conversation(sender_id, receiver_id):
+    ''' Used like get_conversation(), but yields the messages one by one while they are read from the database. Used for streamed responses.'''
+
+    messages = iter_query(_CONVERSATION, (sender_id, receiver_id, receiver_id, sender_id))
+
+    return (MessageResponseModel.from_query_result(*msg) async for msg in messages)
     
 
-def get_by_id(id: int):
+async def get_by_id(id: int):
     ''' Used for getting a message by message.id from a conversation between two users from the database.'''
 
-    message = read_query_additional('''SELECT * from messages WHERE id = ?''', (id,))
+    message = await identity_map.load('messages', id)
 
     if message:
         return MessageResponseModel.from_query_result(*message)
@@ -41,44 +160,162 @@ def get_by_id(id: int):
         return HTTPException(status_code=404, content=f'Message with ID:{id} not found.')
     
 
-def get_conversations_list(sender_id):
-    ''' Used for getting all conversations of the user from the database.'''
+def _pair(user_id: int, other_id: int) -> tuple:
+    ''' Key of the conversation between two users in the conversations table: user_low_id, user_high_id.'''
 
-    conversations = read_query(
-        '''SELECT DISTINCT users.username 
-           FROM messages
-           JOIN users ON messages.receiver_id = users.id
-           WHERE sender_id = ?''', 
-        (sender_id,))
-    
-    return conversations
+    return min(user_id, other_id), max(user_id, other_id)
+
+
+def _side(user_id: int, user_low_id: int) -> str:
+    ''' Prefix of the columns of one user in a conversations row: low or high.'''
+
+    return 'low' if user_id == user_low_id else 'high'
+
+
+async def get_conversations_list(sender_id):
+    ''' Used for getting all conversations of the user (sent or received messages) from the conversations table,
+    the most recent first. Reads the user's rows through the (user_low_id, last_activity) and (user_high_id, last_activity)
+    indexes instead of scanning the messages.
+
+    Returns:
+        - list of conversations with the other user, last message preview, last activity and unread count
+    '''
 
+    conversations = await read_query(_CONVERSATIONS, (sender_id, sender_id))
 
-def send_message(
+    return [ConversationResponseModel.from_query_result(*row) for row in conversations]
+
+
+async def mark_read(user_id: int, other_id: int):
+    ''' Used when the user marked the conversation as read, its unread count goes back to 0.
+    The count is read first, so marking a read conversation does not write.'''
+
+    user_low_id, user_high_id = _pair(user_id, other_id)
+    side = _side(user_id, user_low_id)
+
+    data = await read_query(f'SELECT {side}_unread FROM conversations WHERE user_low_id = ? AND user_high_id = ?',
+                            (user_low_id, user_high_id))
+    if data and data[0][0]:
+        await update_query(
+            f'''UPDATE conversations SET {side}_unread = 0, {side}_last_read_id = last_message_id
+                WHERE user_low_id = ? AND user_high_id = ?''', (user_low_id, user_high_id))
+
+
+async def send_message(
         message: Message,
         sender_id: int,
         receiver_id: int):
     ''' Used for saving a new message in a conversation in the database.'''
 
     DATETIME_NOW = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    
-    generated_id = insert_query('''INSERT INTO messages(content, timestamp, sender_id, receiver_id) VALUES (?, ?, ?, ?)''',
-                                (message.content, DATETIME_NOW, sender_id, receiver_id))
-    
+    user_low_id, user_high_id = _pair(sender_id, receiver_id)
+    receiver_side = _side(receiver_id, user_low_id)
+
+    async with transaction():
+        generated_id = await insert_query('''INSERT INTO messages(content, timestamp, sender_id, receiver_id) VALUES (?, ?, ?, ?)''',
+                                    (message.content, DATETIME_NOW, sender_id, receiver_id))
+
+        # Concurrent messages of a pair can commit out of order, only a newer message replaces the last one.
+        # The assignments run left to right, last_message_id has to be compared before it is replaced.
+        await insert_query(
+            f'''INSERT INTO conversations(user_low_id, user_high_id, last_message_id, last_message_preview, last_activity, {receiver_side}_unread)
+                VALUES (?, ?, ?, LEFT(?, {_PREVIEW_LENGTH}), ?, 1)
+                ON DUPLICATE KEY UPDATE
+                    last_message_preview = IF(VALUES(last_message_id) > last_message_id, VALUES(last_message_preview), last_message_preview),
+                    last_activity = IF(VALUES(last_message_id) > last_message_id, VALUES(last_activity), last_activity),
+                    {receiver_side}_unread = {receiver_side}_unread + 1,
+                    last_message_id = GREATEST(last_message_id, VALUES(last_message_id))''',
+            (user_low_id, user_high_id, generated_id, message.content, DATETIME_NOW))
+
+        sent = MessageResponseModel(id=generated_id, content=message.content, timestamp=DATETIME_NOW,
+                                    sender_id=sender_id, receiver_id=receiver_id)
+        await events.publish(events.user_channel(receiver_id), 'message', sent, generated_id)
+        await events.publish(events.user_channel(sender_id), 'message', sent, generated_id)
+
     message.id = generated_id
     message.timestamp = DATETIME_NOW
 
     return message
 
 
-def delete_message(id: int):
-    ''' Used for deleting a message by message.id in a conversation in the database.'''
+async def get_messages_after(user_id: int, last_id: int, limit: int = MAX_PAGE_SIZE):
+    ''' Used for the messages sent or received by the user after the message last_id, e.g. the ones an event stream missed
+    while it was disconnected. Both directions are range reads of the sender_id and receiver_id indexes.
+
+    Returns:
+        - at most limit messages, oldest first
+    '''
+
+    data = await read_query(_MESSAGES_AFTER, (user_id, last_id, limit, user_id, last_id, limit, limit))
+
+    return [MessageResponseModel.from_query_result(*row) for row in data]
+
+
+async def message_events(user_id: int, last_event_id: int = None):
+    ''' Used for pushing the messages sent to or by the user as Server-Sent Events, instead of polling the conversations.
+    A reconnecting client sends the id of the last message it got as last_event_id and first gets every message it missed.
+    A message committed while the missed ones are read can be sent twice, clients keep the messages by id.
+
+    Returns:
+        - async iterator of 'message' events and None as heartbeats, for sse_response()
+    '''
+
+    async with events.subscribe(events.user_channel(user_id)) as subscription:
+        while last_event_id is not None:
+            missed = await get_messages_after(user_id, last_event_id)
+            for message in missed:
+                yield sse_event('message', message, message.id)
+            last_event_id = missed[-1].id if len(missed) == MAX_PAGE_SIZE else None
+
+        async for event in subscription.listen(events.HEARTBEAT):
+            yield event
+
 
-    insert_query('''DELETE FROM messages WHERE id = ?''',
-                 (id,))
+async def delete_message(id: int):
+    ''' Used for deleting a message by message.id in a conversation in the database.
+    The summary of the conversation is updated in the same transaction.'''
 
+    async with transaction():
+        message = await identity_map.load('messages', id)
+        if message is None:
+            return
 
-def edit_message(old_message: Message, new_message: Message):
+        _, _, _, sender_id, receiver_id = message
+        user_low_id, user_high_id = _pair(sender_id, receiver_id)
+        receiver_side = _side(receiver_id, user_low_id)
+
+        await insert_query('''DELETE FROM messages WHERE id = ?''',
+                     (id,))
+
+        await update_query(
+            f'''UPDATE conversations SET {receiver_side}_unread = {receiver_side}_unread - 1
+                WHERE user_low_id = ? AND user_high_id = ? AND {receiver_side}_unread > 0 AND {receiver_side}_last_read_id < ?''',
+            (user_low_id, user_high_id, id))
+
+        summary = await read_query('SELECT last_message_id FROM conversations WHERE user_low_id = ? AND user_high_id = ?',
+                                   (user_low_id, user_high_id), primary=True)
+        if summary and summary[0][0] == id:
+            await _replace_last_message(user_low_id, user_high_id)
+
+    identity_map.forget('messages', id)
+
+
+async def _replace_last_message(user_low_id: int, user_high_id: int):
+    ''' Used after the last message of a conversation was deleted. The summary points to the message before it,
+    or is deleted with the last message of the conversation.'''
+
+    data = await _read_pair(user_low_id, user_high_id, '', [], False, 1, primary=True)
+    if not data:
+        await update_query('DELETE FROM conversations WHERE user_low_id = ? AND user_high_id = ?', (user_low_id, user_high_id))
+        return
+
+    id, content, timestamp, _, _ = data[0]
+    await update_query(
+        f'''UPDATE conversations SET last_message_id = ?, last_message_preview = LEFT(?, {_PREVIEW_LENGTH}), last_activity = ?
+            WHERE user_low_id = ? AND user_high_id = ?''', (id, content, timestamp, user_low_id, user_high_id))
+
+
+async def edit_message(old_message: Message, new_message: Message):
     ''' Used for editing a message by message.id in a conversation in the database.'''
     
     edited_message = Message(
@@ -89,6 +326,66 @@ def edit_message(old_message: Message, new_message: Message):
         receiver_id=old_message.receiver_id
     )
 
-    update_query('''UPDATE messages SET content = ? WHERE id= ?''', (edited_message.content, edited_message.id))
+    user_low_id, user_high_id = _pair(edited_message.sender_id, edited_message.receiver_id)
+
+    async with transaction():
+        await update_query('''UPDATE messages SET content = ? WHERE id= ?''', (edited_message.content, edited_message.id))
+        await update_query(
+            f'''UPDATE conversations SET last_message_preview = LEFT(?, {_PREVIEW_LENGTH})
+                WHERE user_low_id = ? AND user_high_id = ? AND last_message_id = ?''',
+            (edited_message.content, user_low_id, user_high_id, edited_message.id))
+
+    identity_map.forget('messages', edited_message.id)
+
+    return edited_message
+
+
+async def rebuild_conversations() -> int:
+    ''' Used to rebuild the conversations table from the messages table, e.g. after messages were imported.
+    The last message of every conversation is set again, the unread counts of existing conversations are kept
+    and new conversations start as read.
+
+    Returns:
+        - number of conversations
+    '''
+
+    async with transaction():
+        await update_query(
+            f'''INSERT INTO conversations(user_low_id, user_high_id, last_message_id, last_message_preview, last_activity,
+                                          low_last_read_id, high_last_read_id)
+                SELECT user_low_id, user_high_id, id, LEFT(content, {_PREVIEW_LENGTH}), timestamp, id, id
+                FROM (SELECT id, content, timestamp,
+                             LEAST(sender_id, receiver_id) AS user_low_id, GREATEST(sender_id, receiver_id) AS user_high_id,
+                             ROW_NUMBER() OVER (PARTITION BY LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id)
+                                                ORDER BY timestamp DESC, id DESC) AS position
+                      FROM messages) m
+                WHERE position = 1
+                ON DUPLICATE KEY UPDATE
+                    last_message_id = VALUES(last_message_id),
+                    last_message_preview = VALUES(last_message_preview),
+                    last_activity = VALUES(last_activity)''')
+
+        await update_query(
+            '''DELETE FROM conversations
+               WHERE NOT EXISTS (SELECT 1 FROM messages
+                                 WHERE (sender_id = user_low_id AND receiver_id = user_high_id)
+                                    OR (sender_id = user_high_id AND receiver_id = user_low_id))''')
+
+        data = await read_query('SELECT COUNT(*) FROM conversations', primary=True)
+
+    return data[0][0]
+
+
+def hot_queries() -> list[dict]:
+    ''' Used by cli.py check-indexes to EXPLAIN the conversation and inbox statements, built like for the requests.
+    Only the rows of the unions are checked, sorting the merged pages is cheap.'''
+
+    before = ' AND (timestamp < ? OR (timestamp = ? AND id < ?))', [datetime(2024, 6, 1), datetime(2024, 6, 1), 1000]
 
-    return edited_message
\ No newline at end of file
+    return [
+        hot_query('conversation page', *_pair_sql(2, 3, '', [], False, SAMPLE_LIMIT + 1), ordered=True),
+        hot_query('conversation page before a cursor', *_pair_sql(2, 3, *before, False, SAMPLE_LIMIT + 1), ordered=True),
+        hot_query('whole conversation', _CONVERSATION, (2, 3, 3, 2)),
+        hot_query('conversations of a user', _CONVERSATIONS, (2, 2)),
+        hot_query('messages after id', _MESSAGES_AFTER, (2, 0, SAMPLE_LIMIT, 2, 0, SAMPLE_LIMIT, SAMPLE_LIMIT)),
+    ]
\ No newline at end of file
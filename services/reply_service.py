@@ -1,65 +1,104 @@
 from fastapi import HTTPException
-from data.database import read_query, insert_query, update_query
+from data import identity_map
+from data.database import insert_query, update_query, transaction
+from data.indexes import SAMPLE_LIMIT, hot_query
 from data.models.topic import Topic
 from data.models.reply import Reply
+from services import events, topic_cache
+from services.utils import keyset_query, keyset_sql, search_condition, sort_order
 from datetime import datetime
 
 
-def get_reply_by_id(reply_id: int):
-    ''' Used for getting a reply by reply.id from a topic from the database.'''
+_REPLY_COLUMNS = 'r.id, r.creation_date, r.content, r.topic_id, r.user_id, r.upvotes, r.downvotes, r.score'
+
+identity_map.register('replies', _REPLY_COLUMNS, 'replies r', 'r.id')
 
-    reply_data = read_query('SELECT id, creation_date, content, topic_id, user_id FROM replies where id = ?', (reply_id,))
+_SORT_COLUMNS = {'creation_date': 'r.creation_date', 'upvotes': 'r.upvotes', 'downvotes': 'r.downvotes', 'id': 'r.id'}
 
-    upvotes = len(read_query('SELECT * FROM votes WHERE reply_id = ? AND vote = ?', (reply_id, 1)))
-    downvotes = len(read_query('SELECT * FROM votes WHERE reply_id = ? AND vote = ?', (reply_id, 0)))
+_DELETE_VOTES = 'DELETE FROM votes WHERE reply_id = ?'
+_CLEAR_BEST_REPLY = 'UPDATE topics SET best_reply_id = NULL WHERE best_reply_id = ?'
 
-    reply_with_vote = reply_data[0] + (upvotes, downvotes)
 
-    reply = Reply.from_query_result(*reply_with_vote)
+def _from_reply_row(row):
+    reply = Reply.from_query_result(*row)
     reply.creation_date = reply.creation_date.strftime("%Y-%m-%d %H:%M:%S")
 
     return reply
 
 
-def get_topic_reply(topic_id, reply_id):
-    ''' Used for getting a topic and a specific reply by topic.id and reply.id from the database.'''
+async def get_reply_by_id(reply_id: int):
+    ''' Used for getting a reply by reply.id from a topic from the database.'''
 
-    data = read_query('SELECT id, title, body, category_id, user_id, is_locked, is_private, best_reply_id, created_at FROM topics WHERE id = ?', (topic_id,))
-    if not any(data):
-        raise HTTPException(status_code=404)
-    
-    topic = next((Topic.from_query_result(*row, ) for row in data), None)
+    row = await identity_map.load('replies', reply_id)
 
-    reply_ids = read_query('SELECT id FROM replies WHERE topic_id = ? AND id = ?', (topic_id, reply_id))
-    if not any(reply_ids):
-        raise HTTPException(status_code=404)
+    return _from_reply_row(row)
 
-    replies = [get_reply_by_id(reply[0]) for reply in reply_ids]
-    topic.replies = replies
-    
-    return topic
 
-
-def sort(replies: list[Reply], *, attribute=None, reverse=False):
-    ''' Used for sorting all replies in a topic. Can be sorted by: creation_date, upvotes, downvotes, id. Can be sorted also in reverse.
+async def get_replies_by_topic(topic_id: int, search: str = None, cursor: str = None, limit: int = None, sort: str = None, sort_by: str = None):
+    ''' Used for getting one page of the replies of a topic together with their stored vote counts in a single query.
+    Can be sorted by: creation_date, upvotes, downvotes, id. Can be sorted also in reverse. Search results are ranked by relevance unless sorted.
 
     Returns:
-        - sorted list of replies
+        - list of replies, next_cursor
     '''
 
-    if attribute == 'creation_date':
-        sort_fn = lambda r: r.creation_date
-    elif attribute == 'upvotes':
-        sort_fn = lambda r: r.upvotes
-    elif attribute == 'downvotes':
-        sort_fn = lambda r: r.downvotes
-    else:
-        sort_fn = lambda r: r.id
+    data, next_cursor = await keyset_query(_REPLY_COLUMNS, 'replies r', id_column='r.id', cursor=cursor, limit=limit,
+                                     **_replies_query(topic_id, search, sort, sort_by))
+
+    return [_from_reply_row(row) for row in data], next_cursor
+
+
+def _replies_query(topic_id: int, search: str, sort: str, sort_by: str) -> dict:
+    conditions, params, relevance = ['r.topic_id = ?'], [topic_id], None
+    if search is not None:
+        condition, search_params, relevance = search_condition('r.content', search)
+        conditions.append(condition)
+        params += search_params
+
+    order_by, descending, order_params = sort_order(_SORT_COLUMNS, sort, sort_by, default='creation_date', relevance=relevance)
+
+    return {'conditions': conditions, 'sql_params': params, 'order_by': order_by, 'descending': descending, 'order_params': order_params}
+
+
+def hot_queries() -> list[dict]:
+    ''' Used by cli.py check-indexes to EXPLAIN the reply listings of a topic and the statements of delete_reply(),
+    built like for the requests.'''
 
-    return sorted(replies, key=sort_fn, reverse=reverse)
+    def listing(name: str, search: str = None, sort: str = None, sort_by: str = None):
+        sql, sql_params = keyset_sql(_REPLY_COLUMNS, 'replies r', id_column='r.id', limit=SAMPLE_LIMIT,
+                                     **_replies_query(1, search, sort, sort_by))
 
+        return hot_query(name, sql, sql_params, ordered=search is None)
 
-def create(reply: Reply, topic_id: int, user_id: int):
+    return [
+        listing('replies by creation_date'),
+        listing('replies by upvotes', sort='desc', sort_by='upvotes'),
+        listing('replies by downvotes', sort='desc', sort_by='downvotes'),
+        listing('replies search', search='forum'),
+        hot_query('votes of a deleted reply', _DELETE_VOTES, (1,)),
+        hot_query('best reply cleared', _CLEAR_BEST_REPLY, (1,)),
+    ]
+
+
+async def get_topic_reply(topic_id, reply_id):
+    ''' Used for getting a topic and a specific reply by topic.id and reply.id from the database.'''
+
+    topic_row = await identity_map.load('topics', topic_id)
+    if topic_row is None:
+        raise HTTPException(status_code=404)
+    
+    topic = Topic.from_query_result(*topic_row)
+
+    reply_row = await identity_map.load('replies', reply_id)
+    if reply_row is None or reply_row[3] != topic_id:
+        raise HTTPException(status_code=404)
+
+    topic.replies = [_from_reply_row(reply_row)]
+    
+    return topic
+
+
+async def create(reply: Reply, topic_id: int, user_id: int):
     ''' Used for saving the created reply to the database.
     
     Returns:
@@ -70,22 +109,38 @@ def create(reply: Reply, topic_id: int, user_id: int):
     reply.topic_id = topic_id
     reply.user_id = user_id
 
-    generated_id = insert_query('INSERT INTO replies (creation_date, content, topic_id, user_id) VALUES (?,?,?,?)', (DATETIME_NOW, reply.content, topic_id, user_id))
+    generated_id = await insert_query('INSERT INTO replies (creation_date, content, topic_id, user_id) VALUES (?,?,?,?)', (DATETIME_NOW, reply.content, topic_id, user_id))
+    await topic_cache.invalidate(topic_id)
     
     reply.creation_date = DATETIME_NOW
     reply.id = generated_id
 
+    await events.publish(events.topic_channel(topic_id), 'reply_created',
+                         Reply(id=generated_id, creation_date=DATETIME_NOW, content=reply.content, topic_id=topic_id, user_id=user_id))
+
     return reply
 
 
-def delete_reply(id: int):
-    ''' Used for deleting a reply by reply.id in a topic in the database.'''
+async def delete_reply(id: int):
+    ''' Used for deleting a reply by reply.id and its votes in a topic in the database in one transaction.'''
+
+    async with transaction():
+        reply = await get_reply_by_id(id)
+        await update_query(_DELETE_VOTES, (id,))
+        was_best = await update_query(_CLEAR_BEST_REPLY, (id,))
+        await update_query('DELETE FROM replies WHERE id = ?', (id,))
+        await topic_cache.invalidate(reply.topic_id)
+
+        channel = events.topic_channel(reply.topic_id)
+        await events.publish(channel, 'reply_deleted', {'id': id})
+        if was_best:
+            await events.publish(channel, 'best_reply', {'best_reply_id': None})
 
-    insert_query('DELETE FROM votes WHERE reply_id = ?', (id,))
-    insert_query('DELETE FROM replies WHERE id = ?', (id,))
+    identity_map.forget('replies', id)
+    identity_map.forget('topics')
 
 
-def edit_reply(old_reply: Reply, new_reply: Reply):
+async def edit_reply(old_reply: Reply, new_reply: Reply):
     ''' Used for editing a reply by reply.id in a topic in the database.'''
     
     edited_reply = Reply(
@@ -96,18 +151,27 @@ def edit_reply(old_reply: Reply, new_reply: Reply):
         user_id=old_reply.user_id
     )
 
-    update_query('''UPDATE replies SET content = ? WHERE id = ?''', (edited_reply.content, edited_reply.id))
+    await update_query('''UPDATE replies SET content = ? WHERE id = ?''', (edited_reply.content, edited_reply.id))
+    identity_map.forget('replies', edited_reply.id)
+    await topic_cache.invalidate(edited_reply.topic_id)
+    await events.publish(events.topic_channel(edited_reply.topic_id), 'reply_edited', edited_reply)
 
     return edited_reply
 
 
-def assign_best_reply(topic_id: int, reply_id: int):
+async def assign_best_reply(topic_id: int, reply_id: int):
     ''' Used for assigning a best reply in a topic by topic.id reply_id in the database.'''
 
-    update_query('UPDATE topics SET best_reply_id = ? WHERE id = ?', (reply_id, topic_id))
+    await update_query('UPDATE topics SET best_reply_id = ? WHERE id = ?', (reply_id, topic_id))
+    identity_map.forget('topics', topic_id)
+    await topic_cache.invalidate(topic_id)
+    await events.publish(events.topic_channel(topic_id), 'best_reply', {'best_reply_id': reply_id})
 
 
-def remove_best_reply(topic_id: int):
+async def remove_best_reply(topic_id: int):
     ''' Used for removing a best reply in a topic by topic.id in the database.'''
 
-    update_query('UPDATE topics SET best_reply_id = NULL WHERE id = ?', (topic_id,))
\ No newline at end of file
+    await update_query('UPDATE topics SET best_reply_id = NULL WHERE id = ?', (topic_id,))
+    identity_map.forget('topics', topic_id)
+    await topic_cache.invalidate(topic_id)
+    await events.publish(events.topic_channel(topic_id), 'best_reply', {'best_reply_id': None})
\ No newline at end of file
@@ -0,0 +1,125 @@
+from contextvars import ContextVar
+import json
+import logging
+import os
+from pydantic_core import to_json
+from common.cache import create_cache
+from data.database import on_commit
+from data.models.reply import Reply
+from data.models.topic import Topic
+
+
+_cache = create_cache(
+    os.environ.get('FORUM_TOPIC_CACHE_URL'),
+    max_size=int(os.environ.get('FORUM_TOPIC_CACHE_SIZE', 1000)),
+    ttl=float(os.environ.get('FORUM_TOPIC_CACHE_TTL', 60))
+)
+
+_stats = {'hits': 0, 'misses': 0, 'bypasses': 0, 'invalidations': 0}
+
+_ALL_TOPICS = 'topics:generation'
+
+_logger = logging.getLogger(__name__)
+
+# Topics written by the current request. They skip the cache until the request ends,
+# so a request never reads its own uncommitted writes from the cache or puts them into it.
+_written = ContextVar('_topic_cache_written', default=frozenset())
+
+
+def _generation_key(topic_id: int) -> str:
+    return f'topic:{topic_id}:generation'
+
+
+def _loads(value: bytes) -> Topic:
+    ''' Topics are cached as JSON, not pickled, so whoever can write to a shared cache cannot run code in the workers.
+    The JSON was rendered from a topic built by topic_service and is trusted like a row, the models are not validated.'''
+
+    data = json.loads(value)
+    data['replies'] = [Reply.model_construct(**reply) for reply in data['replies']]
+    if isinstance(data['best_reply_id'], dict):
+        data['best_reply_id'] = Reply.model_construct(**data['best_reply_id'])
+
+    return Topic.model_construct(**data)
+
+
+async def get(topic_id: int, view: tuple):
+    ''' Used for reading an assembled topic detail view from the cache.
+
+    Args:
+        - topic_id: id of the topic
+        - view: query params the view was built with, e.g. (cursor, limit, sort, sort_by)
+
+    Returns:
+        - key to put() the topic under on a miss (None if it must not be cached), topic or None
+    '''
+
+    written = _written.get()
+    if topic_id in written or _ALL_TOPICS in written:
+        _stats['bypasses'] += 1
+        return None, None
+
+    # The generations are read before the topic is built, so a topic built from rows older than a
+    # committed write is stored under a key nobody reads anymore. This holds only for rows read from the primary,
+    # a replica may still lag behind a write whose bump is already visible, see topic_service.get_by_id().
+    everything, topic = await _cache.generations([_ALL_TOPICS, _generation_key(topic_id)])
+    key = f'topic:{topic_id}:{everything}.{topic}:' + ':'.join(str(param) for param in view)
+
+    value = await _cache.get(key)
+    if value is None:
+        _stats['misses'] += 1
+        return key, None
+
+    _stats['hits'] += 1
+
+    return key, _loads(value)
+
+
+async def put(key: str, topic: Topic):
+    ''' Used for caching a topic built after a miss of get(). It must have been built inside primary_reads().'''
+
+    if key is not None:
+        await _cache.set(key, to_json(topic))
+
+
+async def invalidate(topic_id: int):
+    ''' Used after a write to a topic, its replies or their votes. Cached views of the topic are dropped once the
+    transaction commits.'''
+
+    _written.set(_written.get() | {topic_id})
+    await on_commit(_bump, _generation_key(topic_id))
+
+
+async def invalidate_all():
+    ''' Used after writes that touch many topics at once, e.g. a category turned private.'''
+
+    _written.set(_written.get() | {_ALL_TOPICS})
+    await on_commit(_bump, _ALL_TOPICS)
+
+
+async def _bump(key: str):
+    ''' The write is already committed, a failed bump must not fail the request or the other after-commit callbacks.
+    The cached views of the topic stay until their ttl.'''
+
+    try:
+        await _cache.bump(key)
+    except Exception:
+        _logger.exception('Invalidating %s failed', key)
+        return
+
+    _stats['invalidations'] += 1
+
+
+def stats() -> dict:
+    ''' Used for monitoring the topic cache.
+
+    Returns:
+        - hits, misses, bypasses, invalidations, hit_ratio and the counters of the backend
+    '''
+
+    lookups = _stats['hits'] + _stats['misses']
+
+    return {
+        **_stats,
+        'hit_ratio': _stats['hits'] / lookups if lookups else 0.0,
+        **_cache.stats(),
+    }
@@ -1,92 +1,161 @@
 from datetime import datetime
 from fastapi import HTTPException
-from data.database import read_query, insert_query, update_query
+from data import identity_map
+from data.database import insert_query, primary_reads, update_query, transaction
+from data.indexes import SAMPLE_LIMIT, hot_query
+from data.models.category import Category
 from data.models.topic import Topic
-from services import reply_service
+from common.responses import sse_event
+from services import events, reply_service, topic_cache
+from services.utils import keyset_query, keyset_sql, keyset_stream, search_condition, sort_order
 
 
-def all(search: str = None):
+_TOPIC_COLUMNS = 'id, title, body, category_id, user_id, is_locked, is_private, best_reply_id, created_at'
+
+identity_map.register('topics', _TOPIC_COLUMNS)
+
+_SORT_COLUMNS = {'title': 'title', 'created_at': 'created_at', 'id': 'id'}
+
+
+def _topics_query(conditions: list, params: list, search: str, sort: str, sort_by: str) -> dict:
+    relevance = None
+    if search is not None:
+        condition, search_params, relevance = search_condition('title', search)
+        conditions.append(condition)
+        params += search_params
+
+    order_by, descending, order_params = sort_order(_SORT_COLUMNS, sort, sort_by, relevance=relevance)
+
+    return {'conditions': conditions, 'sql_params': params, 'order_by': order_by, 'descending': descending, 'order_params': order_params}
+
+
+async def _topics_page(conditions: list, params: list, search: str, cursor: str, limit: int, sort: str, sort_by: str):
+    data, next_cursor = await keyset_query(_TOPIC_COLUMNS, 'topics', cursor=cursor, limit=limit,
+                                     **_topics_query(conditions, params, search, sort, sort_by))
+
+    return [Topic.from_query_result(*row) for row in data], next_cursor
+
+
+def _topics_stream(conditions: list, params: list, search: str, cursor: str, sort: str, sort_by: str):
+    rows = keyset_stream(_TOPIC_COLUMNS, 'topics', cursor=cursor, **_topics_query(conditions, params, search, sort, sort_by))
+
+    return (Topic.from_query_result(*row) async for row in rows)
+
+
+def hot_queries() -> list[dict]:
+    ''' Used by cli.py check-indexes to EXPLAIN the topic listings, built like for the requests.'''
+
+    def listing(name: str, conditions: list, params: list, search: str = None, sort: str = None, sort_by: str = None):
+        sql, sql_params = keyset_sql(_TOPIC_COLUMNS, 'topics', limit=SAMPLE_LIMIT,
+                                     **_topics_query(conditions, params, search, sort, sort_by))
+
+        return hot_query(name, sql, sql_params, ordered=search is None)
+
+    return [
+        listing('topics by created_at', ['is_private = 0'], []),
+        listing('topics by title', ['is_private = 0'], [], sort='asc', sort_by='title'),
+        listing('topics of a category', ['category_id = ?'], [1]),
+        listing('topics of a category by title', ['category_id = ?'], [1], sort='asc', sort_by='title'),
+        listing('topics search', ['is_private = 0'], [], search='forum'),
+    ]
+
+
+async def all(search: str = None, cursor: str = None, limit: int = None, sort: str = None, sort_by: str = None):
     ''' Used for getting all topics(private and non-private) from database. Used functions for admins requests.
 
+    Can be sorted by: title, created_at, id. Can be sorted also in reverse. Search results are ranked by relevance unless sorted.
+
     Returns:
-        - List of all topics
+        - List of all topics, next_cursor
     '''
 
-    if search is None:
-        data = read_query('''SELECT id, title, body, category_id, user_id, is_locked, is_private, best_reply_id, created_at FROM topics''') 
-    else:
-        data = read_query('''SELECT id, title, body, category_id, user_id, is_locked, is_private, best_reply_id, created_at 
-                          FROM topics
-                          WHERE title LIKE ?''', (f'%{search}%',))
-
-    result = (Topic.from_query_result(*row) for row in data)
-
-    return result 
+    return await _topics_page([], [], search, cursor, limit, sort, sort_by)
 
 
-def all_non_private(search: str = None):
+async def all_non_private(search: str = None, cursor: str = None, limit: int = None, sort: str = None, sort_by: str = None):
     ''' Used for getting all topics(only non-private) from database. Used functions for customers requests.
 
+    Can be sorted by: title, created_at, id. Can be sorted also in reverse. Search results are ranked by relevance unless sorted.
+
     Returns:
-        - List of all non-private topics
+        - List of all non-private topics, next_cursor
     '''
 
-    if search is None:
-        data = read_query('''SELECT id, title, body, category_id, user_id, is_locked, is_private, best_reply_id, created_at 
-                          FROM topics
-                          WHERE is_private = 0''')
-    
-    result = (Topic.from_query_result(*row) for row in data)
+    return await _topics_page(['is_private = 0'], [], search, cursor, limit, sort, sort_by)
+
+
+def stream_all(search: str = None, cursor: str = None, sort: str = None, sort_by: str = None):
+    ''' Used like all(), but yields the topics one by one while they are read from the database. Used for streamed responses.'''
+
+    return _topics_stream([], [], search, cursor, sort, sort_by)
+
+
+def stream_non_private(search: str = None, cursor: str = None, sort: str = None, sort_by: str = None):
+    ''' Used like all_non_private(), but yields the topics one by one while they are read from the database. Used for streamed responses.'''
+
+    return _topics_stream(['is_private = 0'], [], search, cursor, sort, sort_by)
+
 
-    return result 
+async def get_by_category(category_id: int, search: str = None, cursor: str = None, limit: int = None, sort: str = None, sort_by: str = None):
+    ''' Used for getting one page of the topics in a category. Can be sorted by: title, created_at, id. Can be sorted also in reverse.
+    Search results are ranked by relevance unless sorted.
 
+    Returns:
+        - List of topics, next_cursor
+    '''
+
+    return await _topics_page(['category_id = ?'], [category_id], search, cursor, limit, sort, sort_by)
 
-def get_by_id(id, search):
-    ''' Used for getting a single topic by topic.id.
+
+async def get_by_id(id, search, cursor: str = None, limit: int = None, sort: str = None, sort_by: str = None):
+    ''' Used for getting a single topic by topic.id with one page of its replies.
+    Views without search are read through the topic cache.
     
     Returns:
         - topic
     '''
 
-    data = read_query('SELECT id, title, body, category_id, user_id, is_locked, is_private, best_reply_id, created_at FROM topics WHERE id = ?', (id,))
-    if not any(data):
-        raise HTTPException(status_code=404)
+    key = None
+    if search is None:
+        key, topic = await topic_cache.get(id, (cursor, limit, sort, sort_by))
+        if topic is not None:
+            return topic
+
+    if key is None:
+        return await _build_topic(id, search, cursor, limit, sort, sort_by)
+
+    # Cached topics are read from the primary. Rows of a lagging replica would be cached under the generation
+    # of a newer write and served to its writer, whose own reads skip the replicas. Rows the request already
+    # loaded, e.g. by id_exists(), may come from a replica, so they are read again.
+    identity_map.forget('topics', id)
+    identity_map.forget('replies')
+    with primary_reads():
+        topic = await _build_topic(id, search, cursor, limit, sort, sort_by)
+    await topic_cache.put(key, topic)
+
+    return topic
+
+
+async def _build_topic(id, search, cursor: str, limit: int, sort: str, sort_by: str):
+    row = await identity_map.load('topics', id)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f'Topic with id: {id} does not exist.')
     
-    topic = next((Topic.from_query_result(*row, ) for row in data), None)
+    topic = Topic.from_query_result(*row)
 
-    if search is None:
-        reply_ids = read_query('SELECT id FROM replies where topic_id = ?', (id,))
-    else:
-        reply_ids = read_query('SELECT id FROM replies WHERE topic_id = ? AND content LIKE ?', (id, f'%{search}%'))
+    replies, topic.next_cursor = await reply_service.get_replies_by_topic(id, search, cursor, limit, sort, sort_by)
 
-    best_reply_id = read_query('SELECT best_reply_id FROM topics WHERE id = ?', (id,))
-    if best_reply_id[0][0] is not None:
-        topic.best_reply_id = reply_service.get_reply_by_id(best_reply_id[0][0])
+    if topic.best_reply_id is not None:
+        best_reply = next((reply for reply in replies if reply.id == topic.best_reply_id), None)
+        topic.best_reply_id = best_reply or await reply_service.get_reply_by_id(topic.best_reply_id)
 
-    replies = [reply_service.get_reply_by_id(reply[0]) for reply in reply_ids]
     topic.replies = replies
     topic.created_at = topic.created_at.strftime("%Y-%m-%d %H:%M:%S")
     
     return topic
 
 
-def sort(topics: list[Topic], *, attribute=None, reverse=False):
-    ''' Used for sorting all topics. Can be sorted by: title, created_at, id. Can be sorted also in reverse.
-
-    Returns:
-        - sorted list of topics
-    '''
-
-    if attribute == 'title':
-        sort_fn = lambda t: t.title
-    elif attribute == 'created_at':
-        sort_fn = lambda t: t.created_at
-    else:
-        sort_fn = lambda t: t.id
-    return sorted(topics, key=sort_fn, reverse=reverse)
-
-
-def create(topic: Topic, user_id: int, category_id: int):
+async def create(topic: Topic, user_id: int, category_id: int):
     ''' Used for saving the created topic to the database.
     
     Returns:
@@ -96,7 +165,7 @@ def create(topic: Topic, user_id: int, category_id: int):
     DATETIME_NOW = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     topic.category_id = category_id
     topic.user_id = user_id
-    generated_id = insert_query(
+    generated_id = await insert_query(
         'INSERT INTO topics(title, body, category_id, user_id, is_locked, is_private, best_reply_id, created_at) VALUES(?,?,?,?,?,?,?,?)',
         (topic.title, topic.body, topic.category_id, topic.user_id, topic.is_locked, topic.is_private, topic.best_reply_id, DATETIME_NOW))
 
@@ -106,19 +175,22 @@ def create(topic: Topic, user_id: int, category_id: int):
     return topic
 
 
-def delete_topic(id: int):
-    ''' Used for deleting the topic and all replies in it from the database.'''
-
-    reply_ids = read_query('SELECT id FROM replies WHERE topic_id = ?', (id,))
+async def delete_topic(id: int):
+    ''' Used for deleting the topic and all replies and votes in it from the database in one transaction.'''
 
-    for reply_id in reply_ids:
-        reply_service.delete_reply(reply_id[0])
+    async with transaction():
+        await update_query('''DELETE v FROM votes v
+                        JOIN replies r ON v.reply_id = r.id
+                        WHERE r.topic_id = ?''', (id,))
+        await update_query('''DELETE FROM replies WHERE topic_id = ?''', (id,))
+        await update_query('''DELETE FROM topics WHERE id = ?''', (id,))
+        await topic_cache.invalidate(id)
 
-    insert_query('''DELETE FROM topics WHERE id = ?''',
-                 (id,))
+    identity_map.forget('topics', id)
+    identity_map.forget('replies')
 
 
-def edit_topic(old_topic: Topic, new_topic: Topic):
+async def edit_topic(old_topic: Topic, new_topic: Topic):
     ''' Used for editing title, body of a topic in the database.'''
     
     edited_topic = Topic(
@@ -132,13 +204,15 @@ def edit_topic(old_topic: Topic, new_topic: Topic):
         created_at=old_topic.created_at
     )
 
-    update_query('''UPDATE topics SET title = ?, body = ? WHERE id = ?''',
+    await update_query('''UPDATE topics SET title = ?, body = ? WHERE id = ?''',
                 (edited_topic.title, edited_topic.body, edited_topic.id))
+    identity_map.forget('topics', edited_topic.id)
+    await topic_cache.invalidate(edited_topic.id)
 
     return edited_topic
 
 
-def edit_topic_admin(old_topic: Topic, new_topic: Topic):
+async def edit_topic_admin(old_topic: Topic, new_topic: Topic):
     ''' Used for editing title, body, category_id, is_locked, is_private of a topic in the database.'''
 
     edited_topic = Topic(
@@ -152,15 +226,54 @@ def edit_topic_admin(old_topic: Topic, new_topic: Topic):
         created_at=old_topic.created_at
     )
 
-    update_query('''UPDATE topics SET title = ?, body = ?, category_id = ?, is_locked = ?, is_private = ? WHERE id = ?''',
+    await update_query('''UPDATE topics SET title = ?, body = ?, category_id = ?, is_locked = ?, is_private = ? WHERE id = ?''',
                 (edited_topic.title, edited_topic.body, edited_topic.category_id, edited_topic.is_locked, edited_topic.is_private, edited_topic.id))
+    identity_map.forget('topics', edited_topic.id)
+    await topic_cache.invalidate(edited_topic.id)
 
     return edited_topic
 
 
-def topic_locked(topic_id: int):
-    locked = read_query('SELECT is_locked FROM topics WHERE id = ?', (topic_id,))[0][0]
+async def topic_private(topic_id: int):
+    ''' Used for checking the access to a topic without loading its replies.
+
+    Returns:
+        - True if the topic or its category is private
+    '''
+
+    topic = Topic.from_query_result(*await identity_map.load('topics', topic_id))
+    if topic.is_private:
+        return True
+
+    category = await identity_map.load('categories', topic.category_id)
+
+    return category is not None and bool(Category.from_query_result(*category).is_private)
+
+
+async def topic_events(topic_id: int):
+    ''' Used for following a topic as Server-Sent Events instead of reloading it. Events are pushed once the write commits:
+        - subscribed: sent first, with the topic_id
+        - reply_created, reply_edited: the reply
+        - reply_deleted: id of the reply
+        - best_reply: best_reply_id, None when removed
+        - votes: reply_id, upvotes_delta, downvotes_delta and the new upvotes, downvotes and score of the reply
+    Clients get the topic once after the subscribed event and apply the following events to it.
+    After a reconnect they get the topic again.
+
+    Returns:
+        - async iterator of events and None as heartbeats, for sse_response()
+    '''
+
+    async with events.subscribe(events.topic_channel(topic_id)) as subscription:
+        yield sse_event('subscribed', {'topic_id': topic_id})
+
+        async for event in subscription.listen(events.HEARTBEAT):
+            yield event
+
+
+async def topic_locked(topic_id: int):
+    topic = Topic.from_query_result(*await identity_map.load('topics', topic_id))
 
-    if locked:
+    if topic.is_locked:
         return True
     return False
\ No newline at end of file
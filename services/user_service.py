@@ -1,7 +1,8 @@
-from data.database import insert_query, update_query, read_query
+from data import identity_map
+from data.database import insert_query, iter_query, update_query, read_query
 from data.models.user import Role, User
 from data.models.topic import Topic
-from common.auth import find_by_username
+from common.auth import find_by_username, revoke_user_tokens
 
 
 def _hash_password(password: str):
@@ -10,35 +11,37 @@ def _hash_password(password: str):
     return sha256(password.encode('utf-8')).hexdigest()
 
 
-def try_login(username: str, password: str) -> User | None:
+async def try_login(username: str, password: str) -> User | None:
     ''' Used to hash the login password and compare it with the existing password of the user in the database.'''
 
-    user = find_by_username(username)
+    user = await find_by_username(username)
 
     password = _hash_password(password)
     return user if user and user.password == password else None
 
 
-def create(username: str, password: str) -> User | None:
+async def create(username: str, password: str) -> User | None:
     ''' Used to save the already hashed password to the database.'''
 
     password = _hash_password(password)
 
-    generated_id = insert_query(
+    generated_id = await insert_query(
         'INSERT INTO users(username, password, role) VALUES (?,?,?)',
         (username, password, Role.CUSTOMER))
 
     return User(id=generated_id, username=username, password='', role=Role.CUSTOMER)
 
 
-def delete_user(id: int):
+async def delete_user(id: int):
     ''' Used for deleting the user from the database.'''
 
-    insert_query('''DELETE FROM users WHERE id = ?''',
+    await insert_query('''DELETE FROM users WHERE id = ?''',
                  (id,))
+    identity_map.forget('users', id)
+    await revoke_user_tokens(id)
     
 
-def edit_user(old_user: User, new_user: User):
+async def edit_user(old_user: User, new_user: User):
     ''' Used for editing by an admin a role of a user in the database.'''
     
     edited_user = User(
@@ -48,8 +51,10 @@ def edit_user(old_user: User, new_user: User):
         role=new_user.role
     )
 
-    update_query('''UPDATE users SET role = ? WHERE id = ?''',
+    await update_query('''UPDATE users SET role = ? WHERE id = ?''',
                 (edited_user.role, edited_user.id))
+    identity_map.forget('users', edited_user.id)
+    await revoke_user_tokens(edited_user.id)
 
     return {"User's role updated."}
 
@@ -60,21 +65,29 @@ def owns_topic(user: User, topic: Topic) -> bool:
     return topic.user_id == user.id
 
 
-def find_all_users() -> User | None:
+async def find_all_users() -> User | None:
     ''' Search in the database and creates a list of all users. Only admins can view a list of all users.
      
     Returns:
         - a list of all users(id, username, role)
     '''
 
-    data = read_query('SELECT id, username, password, role FROM users')
+    data = await read_query('SELECT id, username, password, role FROM users')
 
     result = (User.from_query_result_no_password(*row) for row in data)
 
     return result
 
 
-def find_by_id_admin(id: int) -> User | None:
+def stream_all_users():
+    ''' Used like find_all_users(), but yields the users one by one while they are read from the database. Used for streamed responses.'''
+
+    data = iter_query('SELECT id, username, password, role FROM users ORDER BY id')
+
+    return (User.from_query_result_no_password(*row) async for row in data)
+
+
+async def find_by_id_admin(id: int) -> User | None:
     ''' Search through users.id the whole information about the account in the data. Only admins can search for them.
      
     Args:
@@ -84,14 +97,12 @@ def find_by_id_admin(id: int) -> User | None:
         - all the necessary information about the user (id, username, hashed password, role and etc.)
     '''
 
-    data = read_query(
-        'SELECT id, username, password, role FROM users WHERE id = ?',
-        (id,))
+    row = await identity_map.load('users', id)
 
-    return next((User.from_query_result_no_password(*row) for row in data), None)
+    return User.from_query_result_no_password(*row) if row is not None else None
 
 
-def find_by_username_info(username: str) -> User | None:
+async def find_by_username_info(username: str) -> User | None:
     ''' Drags the username from the token so it can be compared and returns user.id
 
     Args:
@@ -101,7 +112,7 @@ def find_by_username_info(username: str) -> User | None:
         - id of the user
     '''
 
-    data = read_query(
+    data = await read_query(
         'SELECT id, username, password, role FROM users WHERE username = ?',
         (username,))
 
@@ -1,73 +1,179 @@
+import base64
+import json
+import re
 from fastapi import HTTPException
-from data.database import read_query
+from data import identity_map
+from data.database import iter_query, read_query
 from datetime import datetime
 
 
-def name_exists(name: str, table_name: str) -> bool:
+async def name_exists(name: str, table_name: str) -> bool:
     ''' Used to check if the name exists in the table in the database.'''
 
     return any(
-        read_query(
+        await read_query(
             f'SELECT name FROM {table_name} where name = ?',
             (name,)))
 
 
-def username_exists(username: str, table_name: str) -> bool:
+async def username_exists(username: str, table_name: str) -> bool:
     ''' Used to check if the username exists in the table in the database.'''
 
     return any(
-        read_query(
+        await read_query(
             f'SELECT username FROM {table_name} where username = ?',
             (username,)))
 
 
-def id_exists(id: int, table_name: str) -> bool:
-    ''' Used to check if the id exists in the table in the database.'''
+async def id_exists(id: int, table_name: str) -> bool:
+    ''' Used to check if the id exists in the table in the database.
+    Rows of the tables registered in the identity map are loaded whole, so the following get_by_id is free.'''
+
+    if identity_map.is_registered(table_name):
+        return await identity_map.load(table_name, id) is not None
 
     return any(
-        read_query(
+        await read_query(
             f'SELECT id FROM {table_name} where id = ?',
             (id,)))
 
 
-def get_page(data: list[dict], page: int=None):
-    ''' Used for get a page of searched table in the database.'''
-
-    result = []
-    start_at = False
-    for row in data:
-        if page == 1:
-            result.append(row)
-            if isinstance(row, dict) and row['Page'] == page:  
-                break  
-        if isinstance(row, dict) and row['Page'] == page - 1:
-            start_at = True
-            continue
-        if start_at:
-            result.append(row)
-        if isinstance(row, dict) and row['Page'] == page:  
-            break  
-
-    return result if result else HTTPException(
-        status_code=404, content='Page does not exist.'
-        )
-
-
-def paginate(data: list, results_per_page: int=0):
-    ''' Used to paginate the searched table in the database.'''
-
-    if results_per_page == 0:
-        return data
-    result = []
-    counter = 1
-    for index, value in enumerate(data):
-        next = (results_per_page * counter)
-        if index == next:
-            result.append({'Page': counter
-            })
-            next += results_per_page
-            counter += 1
-        result.append(value) 
-    result.append({'Page': counter})   
-
-    return result        
+MAX_PAGE_SIZE = 100
+
+FULLTEXT_MIN_WORD_LENGTH = 3
+
+
+def sort_order(sort_columns: dict, sort: str = None, sort_by: str = None, default: str = 'created_at', relevance: tuple = None):
+    ''' Used to translate the sort and sort_by query params into a whitelisted ORDER BY column.
+    Unknown sort_by values fall back to the id column. Without sort, search results are ranked by relevance
+    and everything else keeps the default ordering.
+
+    Returns:
+        - order_by column or expression, descending, params of the order_by expression
+    '''
+
+    if sort != 'asc' and sort != 'desc':
+        if relevance is not None:
+            return relevance[0], True, relevance[1]
+        return sort_columns[default], False, ()
+
+    return sort_columns.get(sort_by, sort_columns['id']), sort == 'desc', ()
+
+
+def search_condition(column: str, search: str):
+    ''' Used to build the WHERE condition for the search query param. Words are matched through the FULLTEXT
+    index of the column as prefixes (all words must match). Searches with no word long enough to be indexed
+    fall back to LIKE.
+
+    Returns:
+        - condition, params, relevance (expression, params) or None for LIKE
+    '''
+
+    words = [word for word in re.split(r'\W+', search) if len(word) >= FULLTEXT_MIN_WORD_LENGTH]
+    if not words:
+        return f'{column} LIKE ?', [f'%{search}%'], None
+
+    terms = ' '.join(f'+{word}*' for word in words)
+    match = f'MATCH({column}) AGAINST (? IN BOOLEAN MODE)'
+
+    return match, [terms], (match, (terms,))
+
+
+def encode_cursor(order_by: str, descending: bool, key: tuple) -> str:
+    ''' Used to turn the sort key of the last row of a page into an opaque cursor for the next page.'''
+
+    values = [value.isoformat(sep=' ') if isinstance(value, datetime) else value for value in key]
+    payload = json.dumps({'o': order_by, 'd': descending, 'k': values}, separators=(',', ':'))
+
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str, order_by: str, descending: bool) -> list:
+    ''' Used to read the sort key back from a cursor. A cursor can only be used with the ordering it was created for.'''
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        key = payload['k']
+        valid = payload['o'] == order_by and payload['d'] == descending and len(key) == 2
+    except (ValueError, KeyError, TypeError):
+        valid = False
+
+    if not valid:
+        raise HTTPException(status_code=400, detail='Invalid cursor.')
+
+    return key
+
+
+def keyset_sql(columns: str, table: str, conditions: list[str], sql_params: list, *,
+               order_by: str, id_column: str = 'id', descending: bool = False,
+               cursor: str = None, limit: int = None, order_params: tuple = ()):
+    ''' Used to build the statement of keyset_query() without running it, e.g. to EXPLAIN it.
+
+    Returns:
+        - sql, params
+    '''
+
+    conditions = list(conditions)
+    order_params = list(order_params)
+    sql_params = order_params + list(sql_params)
+    direction, compare = ('DESC', '<') if descending else ('ASC', '>')
+
+    if cursor is not None:
+        order_value, id_value = decode_cursor(cursor, order_by, descending)
+        conditions.append(f'({order_by} {compare} ? OR ({order_by} = ? AND {id_column} {compare} ?))')
+        sql_params += order_params + [order_value] + order_params + [order_value, id_value]
+
+    sql = f'SELECT {columns}, {order_by}, {id_column} FROM {table}'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += f' ORDER BY {order_by} {direction}, {id_column} {direction}'
+    sql_params += order_params
+    if limit is not None:
+        sql += ' LIMIT ?'
+        sql_params.append(limit + 1)
+
+    return sql, tuple(sql_params)
+
+
+async def keyset_query(columns: str, table: str, conditions: list[str], sql_params: list, *,
+                 order_by: str, id_column: str = 'id', descending: bool = False,
+                 cursor: str = None, limit: int = None, order_params: tuple = ()):
+    ''' Used to read one page of a table in SQL with ORDER BY (order_by, id_column) and LIMIT.
+    The next page continues after the last returned key instead of skipping rows, so every page costs the same.
+
+    Args:
+        - columns: selected columns, e.g. 'id, title'
+        - table: FROM clause
+        - conditions: WHERE conditions joined with AND
+        - cursor: next_cursor returned by the previous page
+        - limit: page size, all rows if None
+        - order_params: params of the order_by expression, e.g. of a MATCH ... AGAINST relevance
+
+    Returns:
+        - rows of the page, next_cursor (None on the last page)
+    '''
+
+    sql, sql_params = keyset_sql(columns, table, conditions, sql_params, order_by=order_by, id_column=id_column,
+                                 descending=descending, cursor=cursor, limit=limit, order_params=order_params)
+
+    rows = await read_query(sql, sql_params)
+
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(order_by, descending, rows[-1][-2:])
+
+    return [row[:-2] for row in rows], next_cursor
+
+
+def keyset_stream(columns: str, table: str, conditions: list[str], sql_params: list, *,
+                  order_by: str, id_column: str = 'id', descending: bool = False,
+                  cursor: str = None, order_params: tuple = ()):
+    ''' Used like keyset_query without a limit, but the rows are yielded one by one while they are read from the database.
+    The cursor is checked right away, before the iteration (and e.g. a streamed response) starts.'''
+
+    sql, sql_params = keyset_sql(columns, table, conditions, sql_params, order_by=order_by, id_column=id_column,
+                                 descending=descending, cursor=cursor, order_params=order_params)
+
+    return (row[:-2] async for row in iter_query(sql, sql_params))
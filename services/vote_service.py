@@ -1,55 +1,116 @@
-from data.database import insert_query, read_query, update_query
+from fastapi import HTTPException
+from data import identity_map
+from data.database import insert_query, read_query_additional, update_query, transaction
+from data.indexes import hot_query
+from data.models.reply import Reply
+from services import events, topic_cache
 
 
-def upvote(reply_id, user_id):
-    ''' Used to insert an upvote value into votes in the database.'''
+_VOTE_VALUES = {'upvote': 1, 'downvote': 0, 'clear': None}
 
-    insert_query('INSERT INTO votes (reply_id, user_id, vote) VALUES (?,?,?)', (reply_id, user_id, 1))
+# The reply with the vote of the user, locked until the vote is applied.
+_LOCK_REPLY_VOTE = '''SELECT r.id, r.creation_date, r.content, r.topic_id, r.user_id, r.upvotes, r.downvotes, r.score, v.vote
+                      FROM replies r
+                      LEFT JOIN votes v ON v.reply_id = r.id AND v.user_id = ?
+                      WHERE r.id = ? AND r.topic_id = ?
+                      FOR UPDATE'''
 
+_CLEAR_VOTE = 'DELETE FROM votes WHERE reply_id = ? AND user_id = ?'
 
-def downvote(reply_id, user_id):
-    ''' Used to insert a downvote value into votes in the database.'''
 
-    insert_query('INSERT INTO votes (reply_id, user_id, vote) VALUES (?,?,?)', (reply_id, user_id, 0))
+async def _change_counters(reply_id: int, upvotes: int, downvotes: int):
+    ''' Used to shift the stored upvotes/downvotes/score of a reply by the given amounts.'''
 
+    await update_query('UPDATE replies SET upvotes = upvotes + ?, downvotes = downvotes + ?, score = score + ? WHERE id = ?',
+                 (upvotes, downvotes, upvotes - downvotes, reply_id))
 
-def update_vote(reply_id: int, user_id: int, vote):
-    ''' Used to insert a new upvote/downvote value into votes in the database.'''
 
-    if vote == 'upvote': vote = 1
-    elif vote == 'downvote': vote = 0
-    update_query('UPDATE votes SET vote = ? WHERE reply_id = ? and user_id = ?', (vote, reply_id, user_id))
+async def apply_vote(topic_id: int, reply_id: int, user_id: int, vote: str):
+    ''' Used to upvote, downvote or clear the vote of a user on a reply in one transaction.
+    The reply row is locked first, so concurrent votes on the same reply are applied one after another.
+    It takes three statements on one connection: the lock with the previous vote, the vote itself and the counters.
+    The counter deltas depend on the previous vote, and no statement writes both votes and replies.
 
+    Args:
+        - vote: 'upvote', 'downvote' or 'clear'
 
-def delete_vote(reply_id: int, user_id:int):
-    ''' Used to delete a new upvote/downvote value into votes from the database.'''
+    Returns:
+        - reply with the new upvotes, downvotes and score
+    '''
 
-    insert_query('DELETE FROM votes WHERE reply_id = ? AND user_id = ?', (reply_id, user_id))
+    new_vote = _VOTE_VALUES[vote]
 
+    async with transaction():
+        row = await read_query_additional(_LOCK_REPLY_VOTE, (user_id, reply_id, topic_id), primary=True)
 
-def already_voted(reply_id, user_id, vote):
-    ''' Used to check in the database if a reply is already upvoted/downvoted by the user.'''
+        if row is None:
+            raise HTTPException(status_code=404, detail=f'Reply with id: {reply_id} does not exist in topic with id: {topic_id}.')
 
-    if vote == 'upvote': vote = 1
-    elif vote == 'downvote': vote = 0
+        reply = Reply.from_query_result(*row[:-1])
+        old_vote = row[-1]
 
-    if len(read_query('SELECT * FROM votes WHERE reply_id = ? AND user_id = ? AND vote = ?', (reply_id, user_id, vote))) > 0:
-        return True
-    else:
-        return False
+        if old_vote == new_vote and new_vote is not None:
+            raise HTTPException(status_code=403, detail='You cannot vote twice on a reply.')
 
+        if old_vote != new_vote:
+            if new_vote is None:
+                await update_query(_CLEAR_VOTE, (reply_id, user_id))
+            else:
+                await insert_query('''INSERT INTO votes (reply_id, user_id, vote) VALUES (?,?,?)
+                                ON DUPLICATE KEY UPDATE vote = VALUES(vote)''', (reply_id, user_id, new_vote))
 
-def different_vote(reply_id, user_id, vote):
-    ''' Used to check in the database if a reply is upvoted/downvoted by the user so it can save the opposite vote and delete the value of the opposite value.'''
+            upvotes = (new_vote == 1) - (old_vote == 1)
+            downvotes = (new_vote == 0) - (old_vote == 0)
+            await _change_counters(reply_id, upvotes, downvotes)
+            identity_map.forget('replies', reply_id)
+            await topic_cache.invalidate(topic_id)
 
-    if vote == 'upvote': vote = 1
-    elif vote == 'downvote': vote = 0
-    current_vote = read_query('SELECT vote FROM votes WHERE reply_id = ? AND user_id = ?', (reply_id, user_id))
+            reply.upvotes += upvotes
+            reply.downvotes += downvotes
+            reply.score += upvotes - downvotes
 
-    if len(current_vote) > 0:
-        if current_vote[0] is not vote:
-            return True
-    else:
-        return False
+            await events.publish(events.topic_channel(topic_id), 'votes', {
+                'reply_id': reply_id,
+                'upvotes_delta': upvotes,
+                'downvotes_delta': downvotes,
+                'upvotes': reply.upvotes,
+                'downvotes': reply.downvotes,
+                'score': reply.score,
+            })
 
+    reply.creation_date = reply.creation_date.strftime("%Y-%m-%d %H:%M:%S")
 
+    return reply
+
+
+async def recount_votes(reply_id: int = None) -> int:
+    ''' Used to rebuild the stored upvotes/downvotes/score of replies from the votes table.
+
+    Args:
+        - reply_id: only this reply is recounted, all replies if None
+
+    Returns:
+        - number of replies whose counters were changed
+    '''
+
+    sql = '''UPDATE replies r
+             LEFT JOIN (SELECT reply_id, SUM(vote = 1) AS upvotes, SUM(vote = 0) AS downvotes
+                        FROM votes
+                        GROUP BY reply_id) v ON v.reply_id = r.id
+             SET r.upvotes = COALESCE(v.upvotes, 0),
+                 r.downvotes = COALESCE(v.downvotes, 0),
+                 r.score = COALESCE(v.upvotes, 0) - COALESCE(v.downvotes, 0)'''
+
+    if reply_id is None:
+        return await update_query(sql)
+
+    return await update_query(f'{sql} WHERE r.id = ?', (reply_id,))
+
+
+def hot_queries() -> list[dict]:
+    ''' Used by cli.py check-indexes to EXPLAIN the statements of apply_vote().'''
+
+    return [
+        hot_query('reply with the vote of the user', _LOCK_REPLY_VOTE, (2, 1, 1)),
+        hot_query('vote cleared', _CLEAR_VOTE, (1, 2)),
+    ]
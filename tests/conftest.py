@@ -0,0 +1,86 @@
+import pytest
+
+
+class FakeCursor:
+    def __init__(self, respond):
+        self.respond = respond
+        self.rows = []
+        self.description = None
+        self.lastrowid = 1
+        self.rowcount = 1
+
+    def execute(self, sql: str, sql_params=()):
+        self.rows = list(self.respond(sql, sql_params))
+        self.lastrowid = getattr(self.respond, 'lastrowid', 1)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchmany(self, size: int):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows))
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, respond):
+        self.respond = respond
+
+    def cursor(self, **kwargs):
+        return FakeCursor(self.respond)
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    ''' Pool of a database server that answers every statement with respond(sql, sql_params).
+    Inserts return respond.lastrowid, 1 if it has none.'''
+
+    def __init__(self, respond):
+        self.respond = respond
+
+    def acquire(self):
+        return FakeConnection(self.respond)
+
+    def release(self, conn, discard: bool = False):
+        pass
+
+    def in_use(self) -> int:
+        return 0
+
+    def stats(self) -> dict:
+        return {}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_servers(monkeypatch):
+    ''' Replaces the pools of data.database, e.g. fake_servers(primary, replica) with functions (sql, sql_params) -> rows.'''
+
+    from data import database
+
+    def install(primary, *replicas):
+        monkeypatch.setattr(database, '_pool', FakePool(primary))
+        monkeypatch.setattr(database, '_replica_pools', [FakePool(replica) for replica in replicas])
+
+    return install
@@ -0,0 +1,97 @@
+import asyncio
+import time
+import pytest
+
+pytest.importorskip('mariadb')
+
+from common import auth
+from data import database
+from data.models.user import User
+
+
+@pytest.fixture
+def revocations(monkeypatch):
+    ''' Revocations kept in memory only, as if they were just loaded from the database.'''
+
+    async def insert_query(sql, sql_params=()):
+        return 0
+
+    monkeypatch.setattr(auth, 'insert_query', insert_query)
+    monkeypatch.setattr(auth, '_revocations', {})
+    monkeypatch.setattr(auth, '_revocations_loaded_at', time.monotonic())
+
+
+def _clock(monkeypatch, *moments):
+    ''' time.time() returns the given moments first, then the real time.'''
+
+    real = time.time
+    moments = list(moments)
+    monkeypatch.setattr(auth.time, 'time', lambda: moments.pop(0) if moments else real())
+
+
+def test_token_issued_after_revocation_in_the_same_second_is_accepted(monkeypatch, revocations):
+    second = int(time.time()) - 1
+    _clock(monkeypatch, second + 0.25, second + 0.75)
+
+    asyncio.run(auth.revoke_user_tokens(2))
+    token = auth.create_token(User(id=2, username='customer', password='', role='customer'))
+
+    assert asyncio.run(auth.get_user_or_raise_401(token)).id == 2
+
+
+def test_token_issued_before_revocation_in_the_same_second_is_rejected(monkeypatch, revocations):
+    second = int(time.time()) - 1
+    _clock(monkeypatch, second + 0.25, second + 0.75)
+
+    token = auth.create_token(User(id=3, username='customer', password='', role='admin'))
+    asyncio.run(auth.revoke_user_tokens(3))
+
+    with pytest.raises(auth.HTTPException) as error:
+        asyncio.run(auth.get_user_or_raise_401(token))
+    assert error.value.status_code == 401
+
+
+def test_revocation_rolled_back_is_not_applied(revocations, fake_servers):
+    fake_servers(lambda sql, sql_params: [])
+
+    async def scenario():
+        async with database.transaction():
+            await auth.revoke_user_tokens(4)
+            raise RuntimeError('The request failed after the revocation.')
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(scenario())
+
+    assert auth._revocations == {}
+
+
+def test_revocation_committed_is_applied(revocations, fake_servers):
+    fake_servers(lambda sql, sql_params: [])
+
+    async def scenario():
+        async with database.transaction():
+            await auth.revoke_user_tokens(4)
+            assert auth._revocations == {}
+
+    asyncio.run(scenario())
+
+    assert 4 in auth._revocations
+
+
+def test_reload_keeps_revocations_missing_from_the_database(monkeypatch):
+    now = time.time()
+    reads = []
+
+    async def read_query(sql, sql_params=(), primary=False):
+        reads.append(primary)
+        return [(5, now - 10), (6, now - 10)]
+
+    monkeypatch.setattr(auth, 'read_query', read_query)
+    monkeypatch.setattr(auth, '_revocations', {5: now - 1, 7: now - 2, 8: now - auth._ACCESS_TOKEN_TTL - 1})
+    monkeypatch.setattr(auth, '_revocations_loaded_at', None)
+
+    asyncio.run(auth._load_revocations())
+
+    assert reads == [True]
+    assert auth._revocations == {5: now - 1, 6: now - 10, 7: now - 2}
+
@@ -0,0 +1,48 @@
+import asyncio
+import threading
+import pytest
+
+pytest.importorskip('mariadb')
+
+from data import database
+
+
+@pytest.fixture
+def one_stream(fake_servers, monkeypatch):
+    ''' A server with three rows in every result, which allows one stream at a time.'''
+
+    fake_servers(lambda sql, sql_params: [(1,), (2,), (3,)])
+    monkeypatch.setattr(database, '_stream_slots', threading.BoundedSemaphore(1))
+    monkeypatch.setattr(database, '_POOL_ACQUIRE_TIMEOUT', 0.1)
+
+
+def test_streams_above_the_limit_wait_while_other_reads_run(one_stream):
+    async def scenario():
+        first = database.iter_query('SELECT id FROM topics')
+        assert await anext(first) == (1,)
+
+        with pytest.raises(database.PoolError):
+            await anext(database.iter_query('SELECT id FROM replies'))
+        assert await database.read_query('SELECT id FROM users') == [(1,), (2,), (3,)]
+
+        await first.aclose()
+
+        return [row async for row in database.iter_query('SELECT id FROM replies')]
+
+    assert asyncio.run(scenario()) == [(1,), (2,), (3,)]
+
+
+def test_stream_cancelled_while_waiting_gives_its_slot_back(one_stream):
+    async def scenario():
+        first = database.iter_query('SELECT id FROM topics')
+        await anext(first)
+
+        waiting = asyncio.ensure_future(anext(database.iter_query('SELECT id FROM replies')))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await first.aclose()
+        await asyncio.sleep(0.2)
+
+        return [row async for row in database.iter_query('SELECT id FROM replies')]
+
+    assert asyncio.run(scenario()) == [(1,), (2,), (3,)]
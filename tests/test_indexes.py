@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+
+pytest.importorskip('mariadb')
+
+import cli
+from mariadb import Error
+from data import indexes
+from data.database import direct_connection
+from services import category_service, message_service, reply_service, topic_service
+
+
+@pytest.fixture(scope='module')
+def database():
+    try:
+        direct_connection().close()
+    except Error:
+        pytest.skip('No forum database to EXPLAIN against, see the FORUM_DB_* settings.')
+
+
+def test_hot_queries_use_indexes(database):
+    ''' Meaningful on a database with production-like data, e.g. python -m benchmarks.seed.'''
+
+    results = indexes.check_indexes(cli.hot_queries())
+
+    assert {name: problems for name, (_, problems) in results.items() if problems} == {}
+
+
+def test_hot_queries_are_the_statements_the_services_run(fake_servers):
+    executed = []
+
+    def respond(sql, sql_params):
+        executed.append(sql)
+        return []
+
+    fake_servers(respond)
+
+    async def requests():
+        await category_service.all_non_private(limit=indexes.SAMPLE_LIMIT, sort='asc', sort_by='name')
+        await topic_service.all_non_private(limit=indexes.SAMPLE_LIMIT, sort='asc', sort_by='title')
+        await topic_service.get_by_category(1, limit=indexes.SAMPLE_LIMIT)
+        await reply_service.get_replies_by_topic(1, limit=indexes.SAMPLE_LIMIT, sort='desc', sort_by='upvotes')
+        await message_service.get_conversation(2, 3)
+        await message_service.get_conversation_page(2, 3, limit=indexes.SAMPLE_LIMIT)
+        await message_service.get_conversations_list(2)
+        await message_service.get_messages_after(2, 0, indexes.SAMPLE_LIMIT)
+
+    asyncio.run(requests())
+
+    assert len(executed) == 8
+    assert set(executed) <= {query['sql'] for query in cli.hot_queries()}
+
+
+def test_full_scans_and_filesorts_of_large_tables_are_problems():
+    plan = [
+        {'table': 'topics', 'type': 'ALL', 'key': None, 'rows': 5000, 'Extra': 'Using where; Using filesort'},
+        {'table': '<derived2>', 'type': 'ALL', 'key': None, 'rows': 5000, 'Extra': 'Using filesort'},
+        {'table': 'categories', 'type': 'ALL', 'key': None, 'rows': 20, 'Extra': ''},
+        {'table': 'replies', 'type': 'ref', 'key': 'replies_topic_creation_date_idx', 'rows': 1200, 'Extra': 'Using where'},
+    ]
+
+    assert indexes.problems({'ordered': True}, plan) == ['full scan of topics (5000 rows)', 'filesort of topics (5000 rows)']
+    assert indexes.problems({'ordered': False}, plan) == ['full scan of topics (5000 rows)']
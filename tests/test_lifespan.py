@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import pytest
+
+pytest.importorskip('mariadb')
+
+from data import database
+
+
+class _Connection:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    ''' A primary and a replica pool of two connections, which connect without a server.'''
+
+    monkeypatch.setattr(database, '_connect', lambda config: _Connection())
+    primary, replica = (database.ConnectionPool({}, min_size=2, max_size=4, idle_timeout=300,
+                                                acquire_timeout=1, health_check_after=30) for _ in range(2))
+    monkeypatch.setattr(database, '_pool', primary)
+    monkeypatch.setattr(database, '_replica_pools', [replica])
+
+    return primary, replica
+
+
+def test_lifespan_opens_the_pools_before_the_first_request_and_closes_them(pools):
+    from main import app, lifespan
+
+    async def scenario():
+        async with lifespan(app):
+            opened = [pool.stats() for pool in pools]
+        return opened, [pool.stats() for pool in pools]
+
+    opened, closed = asyncio.run(scenario())
+
+    assert [(stats['size'], stats['idle']) for stats in opened] == [(2, 2), (2, 2)]
+    assert [(stats['size'], stats['closed']) for stats in closed] == [(0, 2), (0, 2)]
+
+
+def test_warm_up_keeps_connections_in_use(pools):
+    primary, _ = pools
+    conn = primary.acquire()
+
+    primary.warm_up()
+
+    assert primary.stats()['size'] == 2
+    assert primary.stats()['in_use'] == 1
+    primary.release(conn)
+
+
+def test_connection_released_after_close_is_closed(pools):
+    primary, _ = pools
+    conn = primary.acquire()
+
+    primary.close()
+    primary.release(conn)
+
+    assert conn.closed
+    assert (primary.stats()['size'], primary.stats()['idle']) == (0, 0)
+    with pytest.raises(database.PoolError):
+        primary.acquire()
+
+
+
+def test_lifespan_migrates_off_the_event_loop(pools, monkeypatch):
+    from main import app, lifespan, migrations
+
+    threads = []
+    monkeypatch.setattr(migrations, 'MIGRATE_ON_STARTUP', True)
+    monkeypatch.setattr(migrations, 'migrate', lambda: threads.append(threading.get_ident()))
+
+    async def scenario():
+        async with lifespan(app):
+            return threading.get_ident()
+
+    loop_thread = asyncio.run(scenario())
+
+    assert len(threads) == 1 and threads[0] != loop_thread
@@ -0,0 +1,351 @@
+import asyncio
+import re
+import time
+from datetime import datetime
+import httpx
+import pytest
+
+pytest.importorskip('mariadb')
+
+from common import auth
+from data.models.message import Message
+from data.models.user import User
+from services import events, message_service
+
+
+def _message(id: int, sender_id: int, receiver_id: int, second: int = None) -> tuple:
+    return (id, f'message {id}', datetime(2024, 1, 1, 0, 0, id if second is None else second), sender_id, receiver_id)
+
+
+# Users 2 and 3 write in turns, messages 4 and 5 were sent in the same second. Message 8 is between users 2 and 4.
+_MESSAGES = [_message(1, 2, 3), _message(2, 3, 2), _message(3, 2, 3), _message(4, 3, 2, 4), _message(5, 2, 3, 4),
+             _message(6, 3, 2), _message(7, 2, 3), _message(8, 4, 2)]
+
+
+def _time(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _messages_server(messages: list, statements: list = None):
+    ''' A server holding the messages, which answers the conversation and catch-up statements of message_service.'''
+
+    def respond(sql, sql_params):
+        if statements is not None:
+            statements.append((sql, sql_params))
+
+        if 'sender_id = ? AND receiver_id = ?' in sql:
+            user_id, other_id, *condition = sql_params[:(len(sql_params) - 7) // 2 + 2]
+            rows = [row for row in messages if {row[3], row[4]} == {user_id, other_id}]
+            if '(timestamp < ?' in sql:
+                rows = [row for row in rows if (row[2], row[0]) < (_time(condition[0]), condition[2])]
+            elif '(timestamp > ?' in sql:
+                rows = [row for row in rows if (row[2], row[0]) > (_time(condition[0]), condition[2])]
+            elif 'timestamp > ?' in sql:
+                rows = [row for row in rows if row[2] > condition[0]]
+
+            forward = 'ASC' in sql
+            return sorted(rows, key=lambda row: (row[2], row[0]), reverse=not forward)[:sql_params[-1]]
+
+        if 'id > ?' in sql:
+            user_id, last_id, *_, limit = sql_params
+            return [row for row in messages if user_id in (row[3], row[4]) and row[0] > last_id][:limit]
+
+        return []
+
+    return respond
+
+
+def _page(**kwargs) -> tuple:
+    messages, previous_cursor, next_cursor = asyncio.run(message_service.get_conversation_page(2, 3, **kwargs))
+
+    return [message.id for message in messages], previous_cursor, next_cursor
+
+
+def test_latest_page_holds_both_directions_oldest_first(fake_servers):
+    statements = []
+    fake_servers(_messages_server(_MESSAGES, statements))
+
+    ids, previous_cursor, next_cursor = _page(limit=3)
+
+    assert ids == [5, 6, 7]
+    assert previous_cursor is not None and next_cursor is not None
+    ((_, sql_params),) = statements
+    assert sql_params == (2, 3, 4, 3, 2, 4, 4)
+
+
+def test_pages_before_a_cursor_reach_the_first_message(fake_servers):
+    fake_servers(_messages_server(_MESSAGES))
+
+    ids, previous_cursor, _ = _page(limit=3)
+    pages = [ids]
+    while previous_cursor is not None:
+        ids, previous_cursor, _ = _page(before=previous_cursor, limit=3)
+        pages.insert(0, ids)
+
+    assert pages == [[1], [2, 3, 4], [5, 6, 7]]
+
+
+def test_page_after_a_cursor_continues_with_the_same_second(fake_servers):
+    fake_servers(_messages_server(_MESSAGES))
+
+    first, _, next_cursor = _page(since=datetime(2024, 1, 1), limit=4)
+    ids, previous_cursor, last_cursor = _page(after=next_cursor, limit=4)
+
+    assert first == [1, 2, 3, 4]
+    assert ids == [5, 6, 7]
+    assert _page(before=previous_cursor, limit=4)[0] == [1, 2, 3, 4]
+    assert _page(after=last_cursor, limit=4) == ([], None, last_cursor)
+
+
+def test_page_since_a_time_is_oldest_first(fake_servers):
+    fake_servers(_messages_server(_MESSAGES))
+
+    ids, _, _ = _page(since=datetime(2024, 1, 1, 0, 0, 4), limit=10)
+
+    assert ids == [6, 7]
+
+
+def test_invalid_cursor_is_rejected(fake_servers):
+    fake_servers(_messages_server(_MESSAGES))
+
+    with pytest.raises(message_service.HTTPException) as error:
+        _page(before='not a cursor')
+    assert error.value.status_code == 400
+
+
+def test_message_events_send_the_missed_messages_first(fake_servers):
+    missed = [_message(id, 2 + id % 2, 3 - id % 2, 0) for id in range(1, message_service.MAX_PAGE_SIZE + 21)]
+    fake_servers(_messages_server(missed))
+
+    async def scenario():
+        stream = message_service.message_events(2, last_event_id=10)
+        received = [await anext(stream) for _ in range(len(missed) - 10)]
+
+        live = _message(len(missed) + 1, 3, 2, 0)
+        await events._publish(events.user_channel(2), message_service.sse_event('message', {'id': live[0]}, live[0]))
+        received.append(await anext(stream))
+        await stream.aclose()
+
+        return received
+
+    received = asyncio.run(scenario())
+
+    ids = [int(event.split(b'\n')[1].removeprefix(b'id: ')) for event in received]
+    assert ids == list(range(11, len(missed) + 2))
+
+
+class _Store:
+    ''' A server holding users, messages and the conversations table, which applies the statements of message_service
+    to them the way MariaDB does.'''
+
+    def __init__(self):
+        self.messages = {}
+        self.conversations = {}
+        self.lastrowid = None
+
+    def __call__(self, sql, sql_params):
+        side = re.search(r'\b(low|high)_unread\b', sql)
+        side = side and side.group(1)
+
+        if sql.startswith('INSERT INTO messages'):
+            content, timestamp, sender_id, receiver_id = sql_params
+            self.lastrowid = max(self.messages, default=0) + 1
+            self.messages[self.lastrowid] = (self.lastrowid, content, _time(timestamp), sender_id, receiver_id)
+        elif 'INSERT INTO conversations' in sql and 'VALUES (?' in sql:
+            low, high, id, content, timestamp = sql_params
+            row = self.conversations.setdefault((low, high), self._summary(0, '', None, read_id=0))
+            if id > row['last_message_id']:
+                row.update(last_message_id=id, last_message_preview=content[:100], last_activity=_time(timestamp))
+            row[f'{side}_unread'] += 1
+        elif 'INSERT INTO conversations' in sql:
+            for pair, (id, content, timestamp, _, _) in self._last_messages().items():
+                summary = {'last_message_id': id, 'last_message_preview': content[:100], 'last_activity': timestamp}
+                self.conversations.setdefault(pair, self._summary(**summary, read_id=id)).update(summary)
+        elif 'NOT EXISTS' in sql:
+            last_messages = self._last_messages()
+            self.conversations = {pair: row for pair, row in self.conversations.items() if pair in last_messages}
+        elif sql.startswith('DELETE FROM conversations'):
+            self.conversations.pop(tuple(sql_params), None)
+        elif sql.startswith('SELECT COUNT(*) FROM conversations'):
+            return [(len(self.conversations),)]
+        elif sql.startswith('SELECT last_message_id FROM conversations') or sql.startswith(f'SELECT {side}_unread'):
+            row = self.conversations.get(tuple(sql_params))
+            return [(row[sql.split()[1]],)] if row else []
+        elif sql.startswith('UPDATE conversations') and f'{side}_unread = 0' in sql:
+            row = self.conversations[tuple(sql_params)]
+            row.update({f'{side}_unread': 0, f'{side}_last_read_id': row['last_message_id']})
+        elif sql.startswith('UPDATE conversations') and f'{side}_unread - 1' in sql:
+            low, high, id = sql_params
+            row = self.conversations.get((low, high))
+            if row and row[f'{side}_unread'] > 0 and row[f'{side}_last_read_id'] < id:
+                row[f'{side}_unread'] -= 1
+        elif sql.startswith('UPDATE conversations SET last_message_id'):
+            id, content, timestamp, low, high = sql_params
+            self.conversations[(low, high)].update(last_message_id=id, last_message_preview=content[:100], last_activity=timestamp)
+        elif sql.startswith('UPDATE conversations SET last_message_preview'):
+            content, low, high, id = sql_params
+            row = self.conversations.get((low, high))
+            if row and row['last_message_id'] == id:
+                row['last_message_preview'] = content[:100]
+        elif sql.startswith('DELETE FROM messages'):
+            self.messages.pop(sql_params[0], None)
+        elif sql.startswith('UPDATE messages SET content'):
+            content, id = sql_params
+            self.messages[id] = (id, content, *self.messages[id][2:])
+        elif 'FROM messages WHERE id = ?' in sql:
+            return [self.messages[sql_params[0]]] if sql_params[0] in self.messages else []
+        elif 'FROM users WHERE id = ?' in sql:
+            return [(sql_params[0], f'user {sql_params[0]}', '', 'customer')]
+        else:
+            return _messages_server(list(self.messages.values()))(sql, sql_params)
+
+        return []
+
+    @staticmethod
+    def _summary(last_message_id, last_message_preview, last_activity, read_id) -> dict:
+        return {'last_message_id': last_message_id, 'last_message_preview': last_message_preview, 'last_activity': last_activity,
+                'low_unread': 0, 'high_unread': 0, 'low_last_read_id': read_id, 'high_last_read_id': read_id}
+
+    def _last_messages(self) -> dict:
+        last = {}
+        for row in sorted(self.messages.values(), key=lambda row: (row[2], row[0])):
+            last[(min(row[3], row[4]), max(row[3], row[4]))] = row
+
+        return last
+
+    def summary(self, low: int, high: int) -> tuple | None:
+        ''' last_message_id, last_message_preview, low_unread, high_unread of the conversation.'''
+
+        row = self.conversations.get((low, high))
+
+        return row and (row['last_message_id'], row['last_message_preview'], row['low_unread'], row['high_unread'])
+
+
+@pytest.fixture
+def store(fake_servers):
+    store = _Store()
+    fake_servers(store)
+
+    return store
+
+
+def _send(*messages):
+    ''' Sends (sender_id, receiver_id, content) messages one after another.'''
+
+    async def send():
+        for sender_id, receiver_id, content in messages:
+            await message_service.send_message(Message(content=content), sender_id, receiver_id)
+
+    asyncio.run(send())
+
+
+def test_sent_messages_count_as_unread_for_the_receiver(store):
+    _send((2, 3, 'hello'), (2, 3, 'are you there'), (3, 2, 'yes'))
+
+    assert store.summary(2, 3) == (3, 'yes', 1, 2)
+
+
+def test_mark_read_clears_the_unread_count_of_the_reader_only(store):
+    _send((2, 3, 'hello'), (3, 2, 'hi'))
+
+    asyncio.run(message_service.mark_read(3, 2))
+
+    assert store.summary(2, 3) == (2, 'hi', 1, 0)
+    assert store.conversations[(2, 3)]['high_last_read_id'] == 2
+
+
+def test_mark_read_of_a_read_conversation_does_not_write(fake_servers):
+    statements = []
+
+    def respond(sql, sql_params):
+        statements.append(sql)
+        return [(0,)]
+
+    fake_servers(respond)
+
+    asyncio.run(message_service.mark_read(2, 3))
+
+    assert [sql.split()[0] for sql in statements] == ['SELECT']
+
+
+def test_deleting_an_unread_message_decrements_the_unread_count(store):
+    _send((2, 3, 'hello'), (2, 3, 'oops'), (3, 2, 'hi'))
+
+    asyncio.run(message_service.delete_message(2))
+
+    assert store.summary(2, 3) == (3, 'hi', 1, 1)
+
+
+def test_deleting_a_read_message_keeps_the_unread_count(store):
+    _send((2, 3, 'hello'), (2, 3, 'again'))
+    asyncio.run(message_service.mark_read(3, 2))
+    _send((2, 3, 'unread'))
+
+    asyncio.run(message_service.delete_message(1))
+
+    assert store.summary(2, 3) == (3, 'unread', 0, 1)
+
+
+def test_deleting_the_last_message_shows_the_one_before(store):
+    _send((2, 3, 'hello'), (3, 2, 'hi'))
+
+    asyncio.run(message_service.delete_message(2))
+
+    assert store.summary(2, 3) == (1, 'hello', 0, 1)
+
+
+def test_deleting_every_message_deletes_the_conversation(store):
+    _send((2, 3, 'hello'))
+
+    asyncio.run(message_service.delete_message(1))
+
+    assert store.summary(2, 3) is None
+
+
+def test_editing_the_last_message_updates_the_preview_only(store):
+    _send((2, 3, 'hello'), (3, 2, 'hi'))
+
+    async def edit(id: int, content: str):
+        await message_service.edit_message(await message_service.get_by_id(id), Message(content=content))
+
+    asyncio.run(edit(1, 'hello there'))
+    assert store.summary(2, 3) == (2, 'hi', 1, 1)
+
+    asyncio.run(edit(2, 'hi there'))
+    assert store.summary(2, 3) == (2, 'hi there', 1, 1)
+
+
+def test_rebuild_sets_the_last_messages_and_keeps_the_unread_counts(store):
+    _send((2, 3, 'hello'), (3, 2, 'hi'), (4, 2, 'hey'))
+    store.conversations[(2, 3)].update(last_message_id=1, last_message_preview='hello')
+    store.conversations[(5, 6)] = store._summary(9, 'deleted', datetime(2024, 1, 1), read_id=9)
+    del store.conversations[(2, 4)]
+
+    count = asyncio.run(message_service.rebuild_conversations())
+
+    assert count == 2
+    assert store.summary(2, 3) == (2, 'hi', 1, 1)
+    assert store.summary(2, 4) == (3, 'hey', 0, 0)
+
+
+def _request(method: str, path: str, user_id: int) -> httpx.Response:
+    from main import app
+
+    headers = {'x-token': auth.create_token(User(id=user_id, username=f'user{user_id}', password='', role='customer'))}
+
+    async def request():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://forum') as client:
+            return await client.request(method, path, headers=headers)
+
+    return asyncio.run(request())
+
+
+def test_viewing_a_conversation_does_not_mark_it_read(store, monkeypatch):
+    monkeypatch.setattr(auth, '_revocations_loaded_at', time.monotonic())
+    _send((2, 3, 'hello'))
+
+    assert _request('GET', '/messages/conversation/3/to/2?limit=10', 3).status_code == 200
+    assert store.summary(2, 3) == (1, 'hello', 0, 1)
+
+    assert _request('POST', '/messages/conversation/3/to/2/read', 3).status_code == 200
+    assert store.summary(2, 3) == (1, 'hello', 0, 0)
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime
+import pytest
+
+pytest.importorskip('mariadb')
+
+from common.cache import LRUCache
+from data import database, identity_map
+from services import topic_cache, topic_service
+from services.utils import id_exists
+
+
+_TOPIC_ID = 41
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(topic_cache, '_cache', LRUCache(max_size=100, ttl=60))
+
+
+def _server(reply_ids: list):
+    ''' A server holding the topic with the given replies.'''
+
+    def respond(sql, sql_params):
+        if 'FROM topics' in sql:
+            return [(_TOPIC_ID, 'Replica lag', 'Body of the topic.', 1, 2, 0, 0, None, datetime(2024, 1, 1))]
+        if 'FROM replies' in sql:
+            return [(id, datetime(2024, 1, 2, 0, 0, id), f'reply {id}', _TOPIC_ID, 2, 0, 0, 0, datetime(2024, 1, 2, 0, 0, id), id)
+                    for id in reply_ids]
+        return []
+
+    return respond
+
+
+def test_topic_cached_after_a_write_is_read_from_the_primary(fake_servers):
+    fake_servers(_server([1, 2]), _server([1]))
+
+    async def scenario():
+        with database.session('writer'):
+            # Reply 2 is written, the replica has not caught up yet.
+            await database.insert_query('INSERT INTO replies(content) VALUES(?)', ('reply 2',))
+            await asyncio.create_task(topic_cache.invalidate(_TOPIC_ID))
+
+        with database.session('reader'):
+            await asyncio.create_task(topic_service.get_by_id(_TOPIC_ID, None))
+
+        with database.session('writer'):
+            return await asyncio.create_task(topic_service.get_by_id(_TOPIC_ID, None))
+
+    hits = topic_cache.stats()['hits']
+    topic = asyncio.run(scenario())
+
+    assert topic_cache.stats()['hits'] == hits + 1
+    assert [reply.id for reply in topic.replies] == [1, 2]
+
+
+def test_topic_not_cached_is_read_from_a_replica(fake_servers):
+    fake_servers(_server([1, 2]), _server([1]))
+
+    async def scenario():
+        with database.session('reader'):
+            return await topic_service.get_by_id(_TOPIC_ID, 'reply')
+
+    topic = asyncio.run(scenario())
+
+    assert [reply.id for reply in topic.replies] == [1]
+
+
+def test_topic_cached_after_id_exists_on_a_replica_is_read_from_the_primary(fake_servers):
+    def titled(title: str, respond):
+        def server(sql, sql_params):
+            rows = respond(sql, sql_params)
+            if 'FROM topics' in sql:
+                return [(*row[:1], title, *row[2:]) for row in rows]
+            return rows
+
+        return server
+
+    fake_servers(titled('Edited on the primary', _server([1, 2])), titled('Stale on the replica', _server([1])))
+
+    async def scenario():
+        with identity_map.identity_scope(), database.session('reader'):
+            assert await id_exists(_TOPIC_ID, 'topics')
+            built = await topic_service.get_by_id(_TOPIC_ID, None)
+
+        with database.session('reader'):
+            return built, await topic_service.get_by_id(_TOPIC_ID, None)
+
+    built, cached = asyncio.run(scenario())
+
+    assert built.title == cached.title == 'Edited on the primary'
+    assert [reply.id for reply in cached.replies] == [1, 2]
@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime
+import httpx
+import pytest
+
+pytest.importorskip('mariadb')
+
+from common import auth
+from common.responses import sse_event
+from data.models.user import User
+from services import topic_service
+
+
+_TOPIC_ID = 7
+
+
+def _server(topic_private: int, category_private: int):
+    ''' A server holding the topic in category 1.'''
+
+    def respond(sql, sql_params):
+        if 'FROM topics' in sql:
+            return [(_TOPIC_ID, 'Events', 'Body of the topic.', 1, 2, 0, topic_private, None, datetime(2024, 1, 1))]
+        if 'FROM categories' in sql:
+            return [(1, 'Staff', 'Private category.', 0, category_private, datetime(2024, 1, 1))]
+        return []
+
+    return respond
+
+
+@pytest.fixture
+def subscriptions(monkeypatch):
+    ''' Topic ids subscribed to, each stream sends the subscribed event only.'''
+
+    subscribed = []
+
+    async def topic_events(topic_id: int):
+        subscribed.append(topic_id)
+        yield sse_event('subscribed', {'topic_id': topic_id})
+
+    monkeypatch.setattr(topic_service, 'topic_events', topic_events)
+
+    return subscribed
+
+
+def _follow(headers: dict = None) -> httpx.Response:
+    from main import app
+
+    async def request():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://forum') as client:
+            return await client.get(f'/topics/{_TOPIC_ID}/events', headers=headers)
+
+    return asyncio.run(request())
+
+
+def _token(role: str) -> dict:
+    return {'x-token': auth.create_token(User(id=2, username=role, password='', role=role))}
+
+
+@pytest.mark.parametrize('topic_private, category_private', [(1, 1), (0, 1)])
+def test_private_topic_requires_a_token(fake_servers, subscriptions, topic_private, category_private):
+    fake_servers(_server(topic_private, category_private))
+
+    assert _follow().status_code == 401
+    assert subscriptions == []
+
+
+def test_private_topic_is_not_followed_by_customers(fake_servers, subscriptions):
+    fake_servers(_server(0, 1))
+
+    assert _follow(_token('customer')).status_code == 400
+    assert subscriptions == []
+
+
+def test_private_topic_is_followed_by_admins(fake_servers, subscriptions):
+    fake_servers(_server(0, 1))
+
+    response = _follow(_token('admin'))
+
+    assert response.status_code == 200
+    assert subscriptions == [_TOPIC_ID]
+
+
+def test_public_topic_is_followed_without_a_token(fake_servers, subscriptions):
+    fake_servers(_server(0, 0))
+
+    assert _follow().status_code == 200
+    assert subscriptions == [_TOPIC_ID]
\ No newline at end of file
@@ -0,0 +1,129 @@
+import asyncio
+from datetime import datetime
+import pytest
+
+pytest.importorskip('mariadb')
+
+from services.utils import HTTPException, decode_cursor, encode_cursor, keyset_query, keyset_sql, sort_order
+
+
+_SORT_COLUMNS = {'title': 'title', 'created_at': 'created_at', 'id': 'id'}
+
+_RELEVANCE = 'MATCH(title) AGAINST (? IN BOOLEAN MODE)'
+
+
+def test_datetime_cursor_round_trip():
+    cursor = encode_cursor('created_at', True, (datetime(2024, 3, 1, 12, 30, 5), 17))
+
+    assert decode_cursor(cursor, 'created_at', True) == ['2024-03-01 12:30:05', 17]
+
+
+def test_relevance_cursor_round_trip():
+    cursor = encode_cursor(_RELEVANCE, True, (0.4375, 8))
+
+    assert decode_cursor(cursor, _RELEVANCE, True) == [0.4375, 8]
+
+
+@pytest.mark.parametrize('order_by, descending', [('title', True), ('created_at', False)])
+def test_cursor_of_another_ordering_is_rejected(order_by, descending):
+    cursor = encode_cursor('created_at', True, (datetime(2024, 3, 1), 17))
+
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, order_by, descending)
+    assert error.value.status_code == 400
+
+
+def test_malformed_cursor_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        decode_cursor('not a cursor', 'id', False)
+    assert error.value.status_code == 400
+
+
+def test_keyset_params_follow_the_placeholders_with_relevance():
+    cursor = encode_cursor(_RELEVANCE, True, (0.5, 8))
+
+    sql, sql_params = keyset_sql('id, title', 'topics', [_RELEVANCE, 'category_id = ?'], ['+word*', 3],
+                                 order_by=_RELEVANCE, descending=True, cursor=cursor, limit=10, order_params=('+word*',))
+
+    assert sql == (f'SELECT id, title, {_RELEVANCE}, id FROM topics'
+                   f' WHERE {_RELEVANCE} AND category_id = ? AND ({_RELEVANCE} < ? OR ({_RELEVANCE} = ? AND id < ?))'
+                   f' ORDER BY {_RELEVANCE} DESC, id DESC LIMIT ?')
+    assert sql_params == ('+word*', '+word*', 3, '+word*', 0.5, '+word*', 0.5, 8, '+word*', 11)
+    assert sql.count('?') == len(sql_params)
+
+
+def test_keyset_without_cursor_starts_at_the_first_row():
+    sql, sql_params = keyset_sql('id, title', 'topics', [], [], order_by='title', limit=10)
+
+    assert sql == 'SELECT id, title, title, id FROM topics ORDER BY title ASC, id ASC LIMIT ?'
+    assert sql_params == (11,)
+
+
+def test_keyset_page_returns_the_cursor_of_its_last_row(monkeypatch):
+    async def read_query(sql, sql_params=()):
+        return [(id, f'topic {id}', f'topic {id}', id) for id in (1, 2, 3)]
+
+    monkeypatch.setattr('services.utils.read_query', read_query)
+
+    rows, next_cursor = asyncio.run(keyset_query('id, title', 'topics', [], [], order_by='title', limit=2))
+
+    assert rows == [(1, 'topic 1'), (2, 'topic 2')]
+    assert decode_cursor(next_cursor, 'title', False) == ['topic 2', 2]
+
+
+@pytest.mark.parametrize('sort, sort_by, expected', [
+    ('asc', 'title', ('title', False, ())),
+    ('desc', 'title', ('title', True, ())),
+    ('desc', 'password', ('id', True, ())),
+    ('asc', None, ('id', False, ())),
+    (None, 'title', ('created_at', False, ())),
+])
+def test_sort_order_whitelists_the_columns(sort, sort_by, expected):
+    assert sort_order(_SORT_COLUMNS, sort, sort_by) == expected
+
+
+def test_sort_order_ranks_searches_unless_sorted():
+    relevance = (_RELEVANCE, ('+word*',))
+
+    assert sort_order(_SORT_COLUMNS, None, None, relevance=relevance) == (_RELEVANCE, True, ('+word*',))
+    assert sort_order(_SORT_COLUMNS, 'asc', 'title', relevance=relevance) == ('title', False, ())
+
+
+def _listing_server(statements: list):
+    ''' A server with three topics, which records the statements it runs.'''
+
+    def respond(sql, sql_params):
+        statements.append((sql, sql_params))
+        return [(id, f'topic {id}', 'body', 1, 2, 0, 0, None, datetime(2024, 1, id), 0.5, id) for id in (3, 2, 1)]
+
+    return respond
+
+
+def test_topic_search_pages_by_relevance(fake_servers):
+    from services import topic_service
+
+    statements = []
+    fake_servers(_listing_server(statements))
+
+    topics, next_cursor = asyncio.run(topic_service.get_by_category(1, 'forum', None, 2))
+    asyncio.run(topic_service.get_by_category(1, 'forum', next_cursor, 2))
+
+    assert [topic.id for topic in topics] == [3, 2]
+    assert decode_cursor(next_cursor, _RELEVANCE, True) == [0.5, 2]
+    (_, first_params), (second_sql, second_params) = statements
+    assert first_params == ('+forum*', 1, '+forum*', '+forum*', 3)
+    assert second_params == ('+forum*', 1, '+forum*', '+forum*', 0.5, '+forum*', 0.5, 2, '+forum*', 3)
+    assert second_sql.count('?') == len(second_params)
+
+
+def test_short_search_falls_back_to_like(fake_servers):
+    from services import topic_service
+
+    statements = []
+    fake_servers(_listing_server(statements))
+
+    asyncio.run(topic_service.get_by_category(1, 'go', None, 2))
+
+    ((sql, sql_params),) = statements
+    assert 'title LIKE ?' in sql and 'MATCH' not in sql
+    assert sql_params == (1, '%go%', 3)
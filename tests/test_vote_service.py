@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime
+import pytest
+
+pytest.importorskip('mariadb')
+
+from services import vote_service
+
+
+_TOPIC_ID, _REPLY_ID, _USER_ID = 3, 9, 2
+
+
+class _Server:
+    ''' A server holding one reply with 5 upvotes and 2 downvotes, and the vote of the user.'''
+
+    def __init__(self, vote):
+        self.vote = vote
+        self.counters = []
+
+    def __call__(self, sql, sql_params):
+        if 'FOR UPDATE' in sql:
+            return [(_REPLY_ID, datetime(2024, 1, 1), 'reply', _TOPIC_ID, 1, 5, 2, 3, self.vote)]
+        if sql.startswith('UPDATE replies'):
+            self.counters.append(sql_params[:3])
+        return []
+
+
+def _apply(fake_servers, old_vote, vote: str):
+    server = _Server(old_vote)
+    fake_servers(server)
+
+    reply = asyncio.run(vote_service.apply_vote(_TOPIC_ID, _REPLY_ID, _USER_ID, vote))
+
+    return reply, server.counters
+
+
+@pytest.mark.parametrize('old_vote, vote, deltas, counts', [
+    (None, 'upvote', (1, 0, 1), (6, 2, 4)),
+    (None, 'downvote', (0, 1, -1), (5, 3, 2)),
+    (1, 'downvote', (-1, 1, -2), (4, 3, 1)),
+    (0, 'upvote', (1, -1, 2), (6, 1, 5)),
+    (0, 'clear', (0, -1, 1), (5, 1, 4)),
+    (1, 'clear', (-1, 0, -1), (4, 2, 2)),
+])
+def test_vote_shifts_the_counters(fake_servers, old_vote, vote, deltas, counts):
+    reply, counters = _apply(fake_servers, old_vote, vote)
+
+    assert counters == [deltas]
+    assert (reply.upvotes, reply.downvotes, reply.score) == counts
+
+
+def test_clearing_without_a_vote_changes_nothing(fake_servers):
+    reply, counters = _apply(fake_servers, None, 'clear')
+
+    assert counters == []
+    assert (reply.upvotes, reply.downvotes, reply.score) == (5, 2, 3)
+
+
+def test_voting_twice_is_rejected(fake_servers):
+    with pytest.raises(vote_service.HTTPException) as error:
+        _apply(fake_servers, 1, 'upvote')
+
+    assert error.value.status_code == 403
@@ -25,7 +25,11 @@ CREATE TABLE IF NOT EXISTS `web_teamwork`.`categories` (
   `is_private` TINYINT(1) NULL DEFAULT 0,
   `created_at` DATETIME NOT NULL,
   PRIMARY KEY (`id`),
-  UNIQUE INDEX `name_UNIQUE` (`name` ASC) VISIBLE)
+  UNIQUE INDEX `name_UNIQUE` (`name` ASC) VISIBLE,
+  INDEX `categories_created_at_idx` (`created_at` ASC) VISIBLE,
+  INDEX `categories_private_created_at_idx` (`is_private` ASC, `created_at` ASC) VISIBLE,
+  INDEX `categories_private_name_idx` (`is_private` ASC, `name` ASC) VISIBLE,
+  FULLTEXT INDEX `categories_name_ft` (`name`))
 ENGINE = InnoDB
 DEFAULT CHARACTER SET = utf8mb4;
 
@@ -56,6 +60,7 @@ CREATE TABLE IF NOT EXISTS `web_teamwork`.`messages` (
   PRIMARY KEY (`id`),
   INDEX `fk_messages_users1_idx` (`sender_id` ASC) VISIBLE,
   INDEX `fk_messages_users2_idx` (`receiver_id` ASC) VISIBLE,
+  INDEX `messages_pair_timestamp_idx` (`sender_id` ASC, `receiver_id` ASC, `timestamp` ASC) VISIBLE,
   CONSTRAINT `fk_messages_users1`
     FOREIGN KEY (`sender_id`)
     REFERENCES `web_teamwork`.`users` (`id`)
@@ -70,6 +75,36 @@ ENGINE = InnoDB
 DEFAULT CHARACTER SET = utf8mb4;
 
 
+-- -----------------------------------------------------
+-- Table `web_teamwork`.`conversations`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `web_teamwork`.`conversations` (
+  `user_low_id` INT(11) NOT NULL,
+  `user_high_id` INT(11) NOT NULL,
+  `last_message_id` INT(11) NOT NULL,
+  `last_message_preview` VARCHAR(100) NOT NULL,
+  `last_activity` DATETIME NOT NULL,
+  `low_unread` INT(11) NOT NULL DEFAULT 0,
+  `high_unread` INT(11) NOT NULL DEFAULT 0,
+  `low_last_read_id` INT(11) NOT NULL DEFAULT 0,
+  `high_last_read_id` INT(11) NOT NULL DEFAULT 0,
+  PRIMARY KEY (`user_low_id`, `user_high_id`),
+  INDEX `conversations_low_activity_idx` (`user_low_id` ASC, `last_activity` ASC) VISIBLE,
+  INDEX `conversations_high_activity_idx` (`user_high_id` ASC, `last_activity` ASC) VISIBLE,
+  CONSTRAINT `fk_conversations_users1`
+    FOREIGN KEY (`user_low_id`)
+    REFERENCES `web_teamwork`.`users` (`id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION,
+  CONSTRAINT `fk_conversations_users2`
+    FOREIGN KEY (`user_high_id`)
+    REFERENCES `web_teamwork`.`users` (`id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4;
+
+
 -- -----------------------------------------------------
 -- Table `web_teamwork`.`topics`
 -- -----------------------------------------------------
@@ -86,6 +121,13 @@ CREATE TABLE IF NOT EXISTS `web_teamwork`.`topics` (
   PRIMARY KEY (`id`),
   INDEX `fk_topics_categories_idx` (`category_id` ASC) VISIBLE,
   INDEX `fk_topics_users1_idx` (`user_id` ASC) VISIBLE,
+  INDEX `topics_created_at_idx` (`created_at` ASC) VISIBLE,
+  INDEX `topics_private_created_at_idx` (`is_private` ASC, `created_at` ASC) VISIBLE,
+  INDEX `topics_category_created_at_idx` (`category_id` ASC, `created_at` ASC) VISIBLE,
+  INDEX `topics_category_title_idx` (`category_id` ASC, `title` ASC) VISIBLE,
+  INDEX `topics_private_title_idx` (`is_private` ASC, `title` ASC) VISIBLE,
+  INDEX `topics_best_reply_idx` (`best_reply_id` ASC) VISIBLE,
+  FULLTEXT INDEX `topics_title_ft` (`title`),
   CONSTRAINT `fk_topics_categories`
     FOREIGN KEY (`category_id`)
     REFERENCES `web_teamwork`.`categories` (`id`)
@@ -109,9 +151,16 @@ CREATE TABLE IF NOT EXISTS `web_teamwork`.`replies` (
   `content` LONGTEXT NOT NULL,
   `topic_id` INT(11) NOT NULL,
   `user_id` INT(11) NOT NULL,
+  `upvotes` INT(11) NOT NULL DEFAULT 0,
+  `downvotes` INT(11) NOT NULL DEFAULT 0,
+  `score` INT(11) NOT NULL DEFAULT 0,
   PRIMARY KEY (`id`),
   INDEX `fk_replies_topics1_idx` (`topic_id` ASC) VISIBLE,
   INDEX `fk_replies_users1_idx` (`user_id` ASC) VISIBLE,
+  INDEX `replies_topic_creation_date_idx` (`topic_id` ASC, `creation_date` ASC) VISIBLE,
+  INDEX `replies_topic_upvotes_idx` (`topic_id` ASC, `upvotes` ASC) VISIBLE,
+  INDEX `replies_topic_downvotes_idx` (`topic_id` ASC, `downvotes` ASC) VISIBLE,
+  FULLTEXT INDEX `replies_content_ft` (`content`),
   CONSTRAINT `fk_replies_topics1`
     FOREIGN KEY (`topic_id`)
     REFERENCES `web_teamwork`.`topics` (`id`)
@@ -135,6 +184,7 @@ CREATE TABLE IF NOT EXISTS `web_teamwork`.`votes` (
   `user_id` INT(11) NOT NULL,
   `vote` TINYINT(1) NOT NULL,
   PRIMARY KEY (`id`),
+  UNIQUE INDEX `reply_user_UNIQUE` (`reply_id` ASC, `user_id` ASC) VISIBLE,
   INDEX `fk_votes_replies_idx` (`reply_id` ASC) VISIBLE,
   INDEX `fk_votes_users1_idx` (`user_id` ASC) VISIBLE,
   CONSTRAINT `fk_votes_replies`
@@ -151,6 +201,18 @@ ENGINE = InnoDB
 DEFAULT CHARACTER SET = utf8mb4;
 
 
+-- -----------------------------------------------------
+-- Table `web_teamwork`.`token_revocations`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `web_teamwork`.`token_revocations` (
+  `user_id` INT(11) NOT NULL,
+  `revoked_at` DATETIME(6) NOT NULL,
+  PRIMARY KEY (`user_id`),
+  INDEX `token_revocations_revoked_at_idx` (`revoked_at` ASC) VISIBLE)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4;
+
+
 SET SQL_MODE=@OLD_SQL_MODE;
 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS;
 SET UNIQUE_CHECKS=@OLD_UNIQUE_CHECKS;